@@ -0,0 +1,69 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+from typing import Iterable, Iterator, Tuple
+
+logger = logging.getLogger("collector")
+
+# Directory the raw search pages of every crawl are archived to, as
+# gzipped NDJSON. Archiving is disabled when unset.
+ARCHIVE_DIR = os.getenv("FLASK_COLLECTOR_ARCHIVE_DIR")
+
+
+def get_archive_path(directory: str, checkpoint: dict) -> str:
+    """
+    Returns the archive path for a crawl, starting at the page after the
+    checkpoint. A resumed crawl gets a new part instead of appending to
+    an archive that may have been cut short.
+    """
+    started_at = datetime.datetime.fromisoformat(checkpoint["started_at"])
+    return os.path.join(
+        directory,
+        f"snaps-{started_at:%Y%m%dT%H%M%S}-{checkpoint['run_id']}"
+        f"-p{checkpoint['page'] + 1:05d}.ndjson.gz",
+    )
+
+
+def iter_archiving(
+    pages: Iterable[Tuple[int, list]], path: str
+) -> Iterator[Tuple[int, list]]:
+    """
+    Passes pages through, writing each one to the archive at `path` as a
+    {"page": ..., "snaps": [...]} line. Every page is flushed, so the
+    archive of an interrupted crawl stays readable up to its last page.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    logger.info(f"Archiving search pages to {path}")
+
+    with gzip.open(path, "wt", encoding="utf-8") as archive:
+        for page, snaps in pages:
+            if snaps is not None:
+                archive.write(json.dumps({"page": page, "snaps": snaps}))
+                archive.write("\n")
+                archive.flush()
+            yield page, snaps
+
+
+def iter_archived_pages(*paths: str) -> Iterator[Tuple[int, list]]:
+    """
+    Reads pages back from one or more archives written by `iter_archiving`.
+
+    :param paths: The archive paths, read in the given order.
+    :return: An iterator of (page number, list of snaps) tuples.
+    """
+    for path in paths:
+        logger.info(f"Ingesting search pages from {path}")
+        with gzip.open(path, "rt", encoding="utf-8") as archive:
+            try:
+                for line in archive:
+                    if not line.endswith("\n"):
+                        raise EOFError(path)
+                    entry = json.loads(line)
+                    yield entry["page"], entry["snaps"]
+            except EOFError:
+                logger.warning(
+                    f"Archive {path} is truncated, ingested up to its last "
+                    "complete page."
+                )
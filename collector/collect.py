@@ -1,12 +1,46 @@
+import hashlib
+import io
+import json
 import logging
-from typing import Tuple
-import requests
+import os
+import codecs
+import queue
+import resource
+import threading
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Iterable, Iterator, Optional, Tuple
+from uuid import uuid4
 import datetime
+from sqlalchemy import (
+    ARRAY,
+    String,
+    all_,
+    any_,
+    bindparam,
+    column,
+    func,
+    literal_column,
+    select,
+    table,
+    text,
+    update,
+)
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
 from snaprecommend import db
-from snaprecommend.models import Snap, PipelineSteps
+from snaprecommend.models import Snap, PipelineSteps, ALL_MEDIA_TYPES
 from snaprecommend.logic import add_pipeline_step_log
+from snaprecommend.settings import get_setting, set_setting
+from collector.http_client import http_session
+from collector.json_stream import iter_array_items
+from collector.archive import (
+    ARCHIVE_DIR,
+    get_archive_path,
+    iter_archived_pages,
+    iter_archiving,
+)
 
 
 FIELDS = (
@@ -27,12 +61,124 @@ FIELDS = (
     "sections",
 )
 
-URL = f"http://api.snapcraft.io/api/v1/snaps/search?fields={','.join(FIELDS)}&scope=wide&confinement=strict,classic"
+# Can be pointed at scripts/store_api_standin.py for local benchmarks
+STORE_API_URL = os.getenv(
+    "FLASK_COLLECTOR_STORE_API_URL", "http://api.snapcraft.io"
+)
+
+URL = f"{STORE_API_URL}/api/v1/snaps/search?fields={','.join(FIELDS)}&scope=wide&confinement=strict,classic"
+
+# Number of search pages requested ahead of the page being written
+COLLECT_WORKERS = int(os.getenv("FLASK_COLLECTOR_WORKERS", 4))
+
+# When positive, search pages are fetched one at a time and decoded while
+# they are downloaded, handing this many snaps at a time to the writer so
+# memory use does not grow with the page size. 0 parses whole pages.
+COLLECT_STREAM_CHUNK_SIZE = int(
+    os.getenv("FLASK_COLLECTOR_STREAM_CHUNK_SIZE", 0)
+)
+
+# Bytes read off a streamed response at a time
+STREAM_READ_SIZE = 1 << 16
+
+# Number of parsed pages buffered between the fetcher and the writer.
+# 0 disables the pipeline and fetches, parses and writes on one thread.
+COLLECT_PIPELINE_DEPTH = int(os.getenv("FLASK_COLLECTOR_PIPELINE_DEPTH", 2))
+
+# How parsed snaps are written: "upsert" runs one INSERT ... ON CONFLICT per
+# page, "copy" streams every page into a staging table with COPY and merges
+# it into the snap table once at the end of the run.
+COLLECT_LOADER = os.getenv("FLASK_COLLECTOR_LOADER", "upsert")
+
+STAGING_TABLE = "snap_staging"
+
+# Settings key holding the cursor of the current crawl
+COLLECT_CHECKPOINT_KEY = "collect_checkpoint"
+
+# Interrupted crawls older than this start again from the first page
+COLLECT_CHECKPOINT_MAX_AGE = datetime.timedelta(
+    hours=float(os.getenv("FLASK_COLLECTOR_CHECKPOINT_MAX_AGE_HOURS", 6))
+)
+
+# A crawl returning fewer than this share of the currently listed snaps is
+# treated as truncated and never delists anything
+SWEEP_MIN_SEEN_RATIO = 0.5
+
+# Columns written by the collect step besides snap_id. Columns filled in by
+# other steps (e.g. active_devices) are left untouched.
+UPSERT_COLUMNS = (
+    "name",
+    "icon",
+    "summary",
+    "description",
+    "title",
+    "website",
+    "version",
+    "publisher",
+    "revision",
+    "contact",
+    "links",
+    "media",
+    "developer_validation",
+    "license",
+    "last_updated",
+    "date_published",
+    "categories",
+    "media_count",
+    "icon_count",
+    "screenshot_count",
+    "video_count",
+    "banner_count",
+    "logo_count",
+    "has_icon",
+    "link_count",
+    "has_contact_link",
+    "has_issues_link",
+    "description_length",
+    "license_set",
+    "fingerprint",
+)
+
+_END_OF_PAGES = object()
+
+# has_next and snap ids from the last full response of each page URL, used
+# to answer pages the store reports as not modified
+_page_summaries = {}
 
 
 logger = logging.getLogger("collector")
 
 
+def snap_fingerprint(row: dict) -> str:
+    """
+    Returns a stable hash of a parsed snap row.
+    """
+    payload = json.dumps(row, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def derive_snap_columns(row: dict) -> dict:
+    """
+    Computes the scalar columns used by the filter and score steps from a
+    parsed snap row, so they don't have to walk its JSON columns.
+    """
+    media = row["media"] or []
+    links = row["links"] or {}
+    derived = {
+        "media_count": len(media),
+        "has_icon": row["icon"] is not None,
+        "link_count": sum(1 for link in links.values() if link),
+        "has_contact_link": bool(links.get("contact")),
+        "has_issues_link": bool(links.get("issues")),
+        "description_length": len(row["description"] or ""),
+        "license_set": row["license"] != "unset",
+    }
+    media_types = Counter(item["type"] for item in media)
+    for media_type in ALL_MEDIA_TYPES:
+        derived[f"{media_type}_count"] = media_types[media_type]
+    return derived
+
+
 def parse_snap_from_response(snap: dict) -> dict:
     website = snap["links"].get("website", [])
     website = website[0] if len(website) else None
@@ -42,7 +188,7 @@ def parse_snap_from_response(snap: dict) -> dict:
     contact = contact[0] if len(contact) else None
 
     icon = next(filter(lambda x: x["type"] == "icon", snap["media"]), None)
-    return {
+    row = {
         "snap_id": snap["snap_id"],
         "name": snap["package_name"],
         "icon": icon["url"] if icon else None,
@@ -62,6 +208,9 @@ def parse_snap_from_response(snap: dict) -> dict:
         "date_published": datetime.datetime.fromisoformat(snap["date_published"].replace("Z", "+00:00")) if snap.get("date_published") else None,
         "categories": snap.get("sections"),
     }
+    row.update(derive_snap_columns(row))
+    row["fingerprint"] = snap_fingerprint(row)
+    return row
 
 
 def upsert_snap(session: Session, snap):
@@ -79,46 +228,522 @@ def upsert_snap(session: Session, snap):
     session.merge(snap_object)
 
 
-def get_snap_page(page: int) -> Tuple[list, bool]:
+def get_snap_page(
+    page: int, conditional: bool = True
+) -> Tuple[Optional[list], bool]:
     """
     Fetches a single page of snaps from the API.
 
+    Pages fetched before are revalidated with a conditional request.
+
     :param page: The page number to fetch.
-    :return: A tuple containing the list of snaps and a
-             boolean indicating if there are more pages.
+    :param conditional: Whether a page that has not changed may be skipped.
+    :return: A tuple containing the list of snaps (None if the page has
+             not changed since it was last fetched) and a boolean
+             indicating if there are more pages.
     """
-    response = requests.get(f"{URL}&page={page}")
+    url = f"{URL}&page={page}"
+    if not conditional:
+        http_session.forget(url)
+    response = http_session.get_conditional(url)
+    if response.status_code == 304:
+        if url in _page_summaries:
+            return None, _page_summaries[url][0]
+        http_session.forget(url)
+        response = http_session.get_conditional(url)
+
     response.raise_for_status()
     data = response.json()
     snaps = data["_embedded"]["clickindex:package"]
     has_next = "next" in data["_links"]
+    _page_summaries[url] = (has_next, [snap["snap_id"] for snap in snaps])
     return snaps, has_next
 
 
-def insert_snaps() -> int:
+def get_unchanged_page_snap_ids(page: int) -> list:
     """
-    Inserts all searchable snaps from the API into the database.
+    Returns the ids of the snaps on a page reported as not modified.
+    """
+    return _page_summaries[f"{URL}&page={page}"][1]
 
-    :return: The total number of snaps inserted.
+
+def iter_snap_pages(
+    workers: int = COLLECT_WORKERS,
+    first_page: int = 1,
+    conditional: bool = True,
+) -> Iterator[Tuple[int, list]]:
     """
-    page = 1
-    total_snaps = 0
-    has_next = True
+    Fetches pages of snaps concurrently and yields them in page order,
+    starting from `first_page`.
+
+    Up to `workers` pages are in flight at any time. Once a page without a
+    `next` link is reached, the remaining requests are cancelled and their
+    results (or errors, e.g. for pages past the end) are discarded.
 
+    :param workers: The maximum number of pages fetched concurrently.
+    :param first_page: The page number to start from.
+    :param conditional: Whether pages that have not changed may be skipped.
+    :return: An iterator of (page number, list of snaps) tuples.
+    """
+    workers = max(1, workers)
+    executor = ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="collect"
+    )
+    in_flight = deque()
+    next_page = first_page
+
+    def submit_next_page():
+        nonlocal next_page
+        in_flight.append(
+            (
+                next_page,
+                executor.submit(get_snap_page, next_page, conditional),
+            )
+        )
+        next_page += 1
+
+    try:
+        for _ in range(workers):
+            submit_next_page()
+
+        while in_flight:
+            page, future = in_flight.popleft()
+            snaps, has_next = future.result()
+            if has_next:
+                submit_next_page()
+            else:
+                for _, pending in in_flight:
+                    pending.cancel()
+                in_flight.clear()
+            yield page, snaps
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_response_text(response) -> Iterator[str]:
+    """
+    Yields the body of a streamed response as decoded UTF-8 text chunks.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in response.iter_content(chunk_size=STREAM_READ_SIZE):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def iter_snap_page_chunks(
+    chunk_size: int = COLLECT_STREAM_CHUNK_SIZE,
+    first_page: int = 1,
+    conditional: bool = True,
+) -> Iterator[Tuple[int, Optional[list]]]:
+    """
+    Fetches pages of snaps one at a time, starting from `first_page`, and
+    yields the snaps of each page in chunks as they are decoded from the
+    response, so a full page is never held in memory.
+
+    A page yields several (page number, list of snaps) tuples, and a single
+    (page number, None) tuple when it has not changed since it was last
+    fetched.
+
+    :param chunk_size: The maximum number of snaps per chunk.
+    :param first_page: The page number to start from.
+    :param conditional: Whether pages that have not changed may be skipped.
+    :return: An iterator of (page number, list of snaps) tuples.
+    """
+    page = first_page
+    has_next = True
     while has_next:
-        snaps, has_next = get_snap_page(page)
-        total_snaps += len(snaps)
+        url = f"{URL}&page={page}"
+        if not conditional:
+            http_session.forget(url)
+        response = http_session.get_conditional(url, stream=True)
+        if response.status_code == 304:
+            response.close()
+            if url not in _page_summaries:
+                http_session.forget(url)
+                continue
+            has_next = _page_summaries[url][0]
+            yield page, None
+            page += 1
+            continue
+
+        with response:
+            response.raise_for_status()
+            document = {}
+            snap_ids = []
+            chunk = []
+            for snap in iter_array_items(
+                iter_response_text(response), "clickindex:package", document
+            ):
+                snap_ids.append(snap["snap_id"])
+                chunk.append(snap)
+                if len(chunk) == chunk_size:
+                    yield page, chunk
+                    chunk = []
+
+        has_next = "next" in document["_links"]
+        _page_summaries[url] = (has_next, snap_ids)
+        if chunk or not snap_ids:
+            yield page, chunk
+        page += 1
+
+
+def get_resumable_checkpoint(loader: str) -> Optional[dict]:
+    """
+    Returns the checkpoint of an interrupted crawl that can be resumed, if
+    it is recent enough and used the same loader.
+    """
+    setting = get_setting(COLLECT_CHECKPOINT_KEY)
+    checkpoint = setting.value if setting else None
+    if not checkpoint:
+        return None
+
+    started_at = datetime.datetime.fromisoformat(checkpoint["started_at"])
+    if datetime.datetime.now() - started_at > COLLECT_CHECKPOINT_MAX_AGE:
+        logger.info(
+            f"Collect run {checkpoint['run_id']} started at {started_at} "
+            "is too old to resume, starting a new crawl."
+        )
+        return None
+    if checkpoint.get("loader") != loader:
+        logger.info(
+            f"Collect run {checkpoint['run_id']} used the "
+            f"{checkpoint.get('loader')} loader, starting a new crawl."
+        )
+        return None
+    return checkpoint
+
+
+def iter_parsed_pages(
+    pages: Iterable[Tuple[int, list]], timings: dict
+) -> Iterator[Tuple[int, list]]:
+    """
+    Parses each page of snaps into rows ready to be upserted. Pages that
+    have not changed since they were last fetched are yielded as None.
+
+    Time spent waiting for pages and parsing them is added to the
+    `fetch` and `parse` entries of `timings`.
+
+    :param pages: An iterable of (page number, list of snaps) tuples.
+    :param timings: A dict accumulating the time spent in each stage.
+    :return: An iterator of (page number, list of rows) tuples.
+    """
+    pages = iter(pages)
+    try:
+        while True:
+            start = perf_counter()
+            try:
+                page, snaps = next(pages)
+            except StopIteration:
+                return
+            fetched = perf_counter()
+            rows = (
+                None
+                if snaps is None
+                else [parse_snap_from_response(snap) for snap in snaps]
+            )
+            timings["fetch"] += fetched - start
+            timings["parse"] += perf_counter() - fetched
+            yield page, rows
+    finally:
+        if hasattr(pages, "close"):
+            pages.close()
+
+
+def iter_pipelined(items: Iterator, depth: int, timings: dict) -> Iterator:
+    """
+    Consumes `items` on a background thread and yields them through a
+    bounded queue, so the producer runs ahead of the caller by at most
+    `depth` items.
+
+    Time the producer spends blocked on a full queue is added to the
+    `fetch_blocked` entry of `timings`, and time the caller spends waiting
+    on an empty queue to the `write_waited` entry. Errors raised by the
+    producer are re-raised to the caller.
+
+    :param items: The iterator to consume in the background.
+    :param depth: The maximum number of items buffered.
+    :param timings: A dict accumulating the time spent in each stage.
+    :return: An iterator over the same items.
+    """
+    item_queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item, error=None):
+        start = perf_counter()
+        while not stop.is_set():
+            try:
+                item_queue.put((item, error), timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        timings["fetch_blocked"] += perf_counter() - start
+
+    def produce():
         try:
-            bulk_upsert_snaps(db.session, snaps)
+            for item in items:
+                if stop.is_set():
+                    return
+                put(item)
+            put(_END_OF_PAGES)
         except Exception as e:
-            logger.error(f"Error during bulk upsert on page {page}: {e}")
-            raise
+            put(_END_OF_PAGES, e)
+        finally:
+            items.close()
+
+    producer = threading.Thread(
+        target=produce, name="collect-producer", daemon=True
+    )
+    producer.start()
+    try:
+        while True:
+            start = perf_counter()
+            item, error = item_queue.get()
+            timings["write_waited"] += perf_counter() - start
+            if error is not None:
+                raise error
+            if item is _END_OF_PAGES:
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
 
+
+def save_collect_checkpoint(checkpoint: Optional[dict], page: int):
+    """
+    Records `page` as the last written page of the crawl, committing it
+    together with the page's rows.
+    """
+    if checkpoint is None:
+        return
+    checkpoint["page"] = page
+    set_setting(COLLECT_CHECKPOINT_KEY, dict(checkpoint))
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak resident set size of the process to its current size,
+    so steps run in a long-lived process can measure their own peak.
+
+    :return: Whether the peak could be reset, which requires Linux.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss_mib() -> float:
+    """
+    Returns the peak resident set size of the process since the last
+    `reset_peak_rss`, or since it started, in MiB.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    # In kilobytes
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux, and can't be reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def log_collect_timings(timings: dict):
+    logger.info(
+        "Collect stage timings: "
+        + ", ".join(
+            f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()
+        )
+    )
+    if "write_waited" in timings:
+        bottleneck = (
+            "fetching"
+            if timings["write_waited"] > timings["fetch_blocked"]
+            else "writing"
+        )
+        logger.info(f"Collect step is bound by {bottleneck} pages.")
+
+
+def insert_snaps(
+    workers: int = COLLECT_WORKERS,
+    pipeline_depth: int = COLLECT_PIPELINE_DEPTH,
+    loader: str = COLLECT_LOADER,
+    pages: Iterable[Tuple[int, list]] = None,
+    sweep: bool = True,
+    archive_dir: str = ARCHIVE_DIR,
+    stream_chunk_size: int = COLLECT_STREAM_CHUNK_SIZE,
+) -> int:
+    """
+    Inserts all searchable snaps from the API into the database.
+
+    Pages are fetched concurrently but written one at a time, in order,
+    by the calling thread. When `pipeline_depth` is positive, fetching and
+    parsing run on a background thread so the next pages are downloaded
+    while the current one is being written.
+
+    When crawling the store, the last written page is checkpointed in the
+    settings table so an interrupted crawl resumes where it stopped.
+
+    :param workers: The maximum number of pages fetched concurrently.
+    :param pipeline_depth: The maximum number of parsed pages buffered
+                           ahead of the writer, 0 to disable pipelining.
+    :param loader: "upsert" to upsert each page as it arrives, or "copy"
+                   to COPY pages into a staging table merged at the end.
+    :param pages: An iterable of (page number, list of snaps) tuples to
+                  ingest instead of crawling the store API.
+    :param sweep: Whether snaps missing from a complete crawl are delisted.
+                  Resumed crawls never delist snaps, as the pages written
+                  before the interruption were not seen by this run.
+    :param archive_dir: A directory to archive the raw search pages of the
+                        crawl to. Pages are then always fetched in full.
+    :param stream_chunk_size: When positive, pages are fetched one at a time
+                              and written in chunks of this many snaps as
+                              they are decoded, instead of concurrently and
+                              whole.
+    :return: The total number of snaps inserted.
+    """
+    if loader not in ("upsert", "copy"):
+        raise ValueError(f"Unknown collect loader: {loader}")
+
+    peak_rss_reset = reset_peak_rss()
+    total_snaps = 0
+    timings = defaultdict(float)
+    totals = defaultdict(int)
+    seen_snap_ids = set()
+    checkpoint = None
+
+    if pages is None:
+        checkpoint = get_resumable_checkpoint(loader)
+        if checkpoint:
+            logger.info(
+                f"Resuming collect run {checkpoint['run_id']} "
+                f"after page {checkpoint['page']}."
+            )
+            sweep = False
+        else:
+            checkpoint = {
+                "run_id": uuid4().hex,
+                "page": 0,
+                "started_at": datetime.datetime.now().isoformat(),
+                "loader": loader,
+            }
+        if checkpoint.get("crawled"):
+            # Every page was written, only the end of the run failed
+            logger.info(
+                f"Collect run {checkpoint['run_id']} crawled every page, "
+                "finishing it."
+            )
+            pages = []
+        elif stream_chunk_size > 0:
+            pages = iter_snap_page_chunks(
+                stream_chunk_size,
+                first_page=checkpoint["page"] + 1,
+                conditional=not archive_dir,
+            )
+        else:
+            pages = iter_snap_pages(
+                workers,
+                first_page=checkpoint["page"] + 1,
+                conditional=not archive_dir,
+            )
+        if archive_dir:
+            pages = iter_archiving(
+                pages, get_archive_path(archive_dir, checkpoint)
+            )
+    pages = iter_parsed_pages(pages, timings)
+    if pipeline_depth > 0:
+        pages = iter_pipelined(pages, pipeline_depth, timings)
+
+    if loader == "copy":
+        # A resumed crawl keeps the pages it already staged
+        create_staging_table(
+            db.session, reset=not (checkpoint and checkpoint["page"])
+        )
+
+    try:
+        for page, rows in pages:
+            if rows is None:
+                unchanged = get_unchanged_page_snap_ids(page)
+                seen_snap_ids.update(unchanged)
+                total_snaps += len(unchanged)
+                totals["unchanged"] += len(unchanged)
+                save_collect_checkpoint(checkpoint, page)
+                logger.info(f"Page {page} not modified, skipped.")
+                continue
+
+            seen_snap_ids.update(row["snap_id"] for row in rows)
+            total_snaps += len(rows)
+            start = perf_counter()
+            try:
+                if loader == "copy":
+                    copy_rows_to_staging(db.session, rows)
+                else:
+                    counts = upsert_snap_rows(db.session, rows)
+            except Exception as e:
+                logger.error(f"Error during bulk upsert on page {page}: {e}")
+                raise
+
+            # A chunk may not be the last one of its page, only the pages
+            # before it are known to be complete
+            save_collect_checkpoint(
+                checkpoint, page - 1 if stream_chunk_size > 0 else page
+            )
+            db.session.commit()
+            timings["write"] += perf_counter() - start
+            if loader == "copy":
+                logger.info(f"Page {page} staged with {len(rows)} snaps.")
+                continue
+
+            for key, value in counts.items():
+                totals[key] += value
+            logger.info(
+                f"Page {page} processed with {len(rows)} snaps "
+                f"({counts['inserted']} inserted, {counts['changed']} changed, "
+                f"{counts['unchanged']} unchanged)."
+            )
+    except Exception:
+        # Pages fetched but not written must not be revalidated as not
+        # modified and skipped when the collect step runs again in this
+        # process
+        http_session.forget()
+        raise
+
+    # Past the last page, resuming the crawl would request a page beyond
+    # the end of the catalog
+    if checkpoint and not checkpoint.get("crawled"):
+        checkpoint["crawled"] = True
+        set_setting(COLLECT_CHECKPOINT_KEY, dict(checkpoint))
+
+    if loader == "copy":
+        start = perf_counter()
+        totals.update(merge_staging_table(db.session))
         db.session.commit()
-        logger.info(f"Page {page} processed with {len(snaps)} snaps.")
-        if not has_next:
-            break
-        page += 1
+        timings["merge"] += perf_counter() - start
+
+    # Only reached once the whole crawl has been written, a failed page
+    # raises before any snap can be delisted
+    if sweep:
+        start = perf_counter()
+        sweep_delisted_snaps(db.session, seen_snap_ids)
+        db.session.commit()
+        timings["sweep"] += perf_counter() - start
+
+    if checkpoint:
+        set_setting(COLLECT_CHECKPOINT_KEY, None)
+
+    logger.info(
+        f"{totals['inserted']} snaps inserted, {totals['changed']} changed "
+        f"and {totals['unchanged']} unchanged."
+    )
+    log_collect_timings(timings)
+    logger.info(
+        f"Collect peak RSS: {get_peak_rss_mib():.1f} MiB"
+        + ("." if peak_rss_reset else " (since the process started).")
+    )
     return total_snaps
 
 
@@ -131,43 +756,206 @@ def bulk_upsert_snaps(session: Session, snaps: list):
     """
     logger.debug("Preparing bulk upsert.")
 
-    snap_data = []
-    for snap in snaps:
-        snap_data.append(parse_snap_from_response(snap))
-
-    if snap_data:
-        stmt = insert(Snap).values(snap_data)
-        stmt = stmt.on_conflict_do_update(
-            index_elements=["snap_id"],
-            set_={
-                "name": stmt.excluded.name,
-                "icon": stmt.excluded.icon,
-                "summary": stmt.excluded.summary,
-                "description": stmt.excluded.description,
-                "title": stmt.excluded.title,
-                "website": stmt.excluded.website,
-                "version": stmt.excluded.version,
-                "publisher": stmt.excluded.publisher,
-                "revision": stmt.excluded.revision,
-                "contact": stmt.excluded.contact,
-                "links": stmt.excluded.links,
-                "media": stmt.excluded.media,
-                "developer_validation": stmt.excluded.developer_validation,
-                "license": stmt.excluded.license,
-                "last_updated": stmt.excluded.last_updated,
-                "date_published": stmt.excluded.date_published,
-                "categories": stmt.excluded.categories,
-                # created_at is intentionally excluded to preserve the original value
-            },
+    upsert_snap_rows(
+        session, [parse_snap_from_response(snap) for snap in snaps]
+    )
+
+
+def on_conflict_update_changed(stmt):
+    """
+    Turns an INSERT into snap into an upsert of UPSERT_COLUMNS that only
+    rewrites existing snaps whose fingerprint changed, returning the
+    written snap ids and whether each one was inserted.
+    """
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["snap_id"],
+        set_={name: stmt.excluded[name] for name in UPSERT_COLUMNS},
+        where=Snap.fingerprint.is_distinct_from(stmt.excluded.fingerprint),
+    )
+    # Rows skipped by the WHERE clause are not returned, and xmax is 0
+    # only for freshly inserted rows
+    return stmt.returning(
+        Snap.snap_id, literal_column("xmax = 0").label("inserted")
+    )
+
+
+def count_written_rows(written: list, total: int) -> dict:
+    inserted = sum(1 for row in written if row.inserted)
+    return {
+        "inserted": inserted,
+        "changed": len(written) - inserted,
+        "unchanged": total - len(written),
+    }
+
+
+def upsert_snap_rows(session: Session, snap_data: list) -> dict:
+    """
+    Performs a bulk upsert of parsed snap rows into the database.
+
+    Existing snaps are only rewritten when their fingerprint changed.
+
+    :param session: The database session.
+    :param snap_data: A list of rows from `parse_snap_from_response`.
+    :return: A dict with the number of inserted, changed and unchanged rows.
+    """
+    if not snap_data:
+        return count_written_rows([], 0)
+
+    stmt = on_conflict_update_changed(insert(Snap).values(snap_data))
+    written = session.execute(stmt).all()
+    return count_written_rows(written, len(snap_data))
+
+
+def create_staging_table(session: Session, reset: bool = True):
+    """
+    Creates the unlogged staging table used by the COPY loader.
+
+    :param session: The database session.
+    :param reset: Whether rows staged by a previous run are dropped.
+    """
+    if reset:
+        session.execute(text(f"DROP TABLE IF EXISTS {STAGING_TABLE}"))
+    # Only the columns written by COPY, without the snap table's NOT NULL
+    # constraints: LIKE would copy them but not the defaults of the
+    # columns filled in by other steps, failing the COPY
+    columns = ", ".join(("snap_id",) + UPSERT_COLUMNS)
+    session.execute(
+        text(
+            f"CREATE UNLOGGED TABLE IF NOT EXISTS {STAGING_TABLE} "
+            f"AS SELECT {columns} FROM snap WITH NO DATA"
         )
+    )
+    session.commit()
+
+
+def _copy_value(value) -> str:
+    """
+    Formats a value for COPY's text format.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
 
-        session.execute(stmt)
 
+def copy_rows_to_staging(session: Session, snap_data: list):
+    """
+    Streams parsed snap rows into the staging table with COPY.
+
+    :param session: The database session.
+    :param snap_data: A list of rows from `parse_snap_from_response`.
+    """
+    if not snap_data:
+        return
+
+    columns = ("snap_id",) + UPSERT_COLUMNS
+    buffer = io.StringIO()
+    for row in snap_data:
+        buffer.write(
+            "\t".join(_copy_value(row[name]) for name in columns) + "\n"
+        )
+    buffer.seek(0)
 
-def collect_initial_snap_data():
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {STAGING_TABLE} ({', '.join(columns)}) FROM STDIN",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def merge_staging_table(session: Session) -> dict:
+    """
+    Merges the staging table into the snap table with a single upsert and
+    drops it. Snaps staged more than once (e.g. because they moved between
+    pages during the crawl) keep their most recently updated row.
+
+    :param session: The database session.
+    :return: A dict with the number of inserted, changed and unchanged rows.
+    """
+    columns = ("snap_id",) + UPSERT_COLUMNS
+    staging = table(STAGING_TABLE, *(column(name) for name in columns))
+
+    latest = (
+        select(*(staging.c[name] for name in columns))
+        .distinct(staging.c.snap_id)
+        .order_by(staging.c.snap_id, staging.c.last_updated.desc())
+    )
+    staged = session.execute(
+        select(func.count(staging.c.snap_id.distinct()))
+    ).scalar_one()
+
+    stmt = on_conflict_update_changed(
+        insert(Snap).from_select(list(columns), latest)
+    )
+    written = session.execute(stmt).all()
+    session.execute(text(f"DROP TABLE {STAGING_TABLE}"))
+    return count_written_rows(written, staged)
+
+
+def sweep_delisted_snaps(session: Session, seen_snap_ids: set) -> dict:
+    """
+    Marks listed snaps missing from a complete crawl as delisted, and
+    relists delisted snaps that showed up again.
+
+    :param session: The database session.
+    :param seen_snap_ids: The ids of every snap returned by the crawl.
+    :return: A dict with the number of delisted and relisted snaps.
+    """
+    listed = session.execute(
+        select(func.count()).where(Snap.delisted_at.is_(None))
+    ).scalar_one()
+    if len(seen_snap_ids) < listed * SWEEP_MIN_SEEN_RATIO:
+        logger.warning(
+            f"Crawl returned {len(seen_snap_ids)} snaps out of {listed} "
+            "listed, not delisting any snap."
+        )
+        return {"delisted": 0, "relisted": 0}
+
+    seen = bindparam(
+        "seen_snap_ids", list(seen_snap_ids), type_=ARRAY(String)
+    )
+    delisted = session.execute(
+        update(Snap)
+        .where(Snap.delisted_at.is_(None), Snap.snap_id != all_(seen))
+        .values(delisted_at=datetime.datetime.now())
+    ).rowcount
+    relisted = session.execute(
+        update(Snap)
+        .where(Snap.delisted_at.isnot(None), Snap.snap_id == any_(seen))
+        .values(delisted_at=None)
+    ).rowcount
+
+    logger.info(f"{delisted} snaps delisted, {relisted} snaps relisted.")
+    return {"delisted": delisted, "relisted": relisted}
+
+
+def collect_initial_snap_data(archives: list = None):
+    """
+    Collects snaps from the store, or from the given page archives.
+
+    Ingesting archives never delists snaps, as they may be older than the
+    data already in the database.
+    """
     logger.info("Starting the snap data ingestion process.")
     try:
-        snaps_count = insert_snaps()
+        if archives:
+            snaps_count = insert_snaps(
+                pages=iter_archived_pages(*archives), sweep=False
+            )
+        else:
+            snaps_count = insert_snaps()
         add_pipeline_step_log(PipelineSteps.COLLECT, True)
         logger.info(
             f"Snap data ingestion process completed. {snaps_count} snaps inserted."
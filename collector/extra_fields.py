@@ -1,26 +1,77 @@
-from typing import TypeVar
+from bisect import bisect_left
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterator, Optional, Tuple, TypeVar
 from snaprecommend.models import Snap, PipelineSteps
+from sqlalchemy import String, cast, column, or_, select, update, values
 from sqlalchemy.orm import Session
 import datetime
 import requests
 import logging
 import os
+import time
 from typing import List
+from flask import Flask, current_app
 from snaprecommend import db
 from config import MACAROON_ENV_PATH
 from snaprecommend.logic import add_pipeline_step_log
-from collector.ratings.collect_ratings import get_ratings, ratings_login
+from collector.ratings.collect_ratings import (
+    RATINGS_SOURCE,
+    fetch_chart_ratings,
+    fetch_ratings,
+)
+from collector.http_client import (
+    AdaptiveBatchSize,
+    RateLimiter,
+    backoff_delay,
+    get_retry_after,
+    http_session,
+)
+from collector.installed_base import (
+    delete_expired_installed_base,
+    get_metrics_start_dates,
+    installed_base_rows,
+    store_installed_base,
+)
 
 
+# Initial number of snaps per metrics request, adapted to the API latency
 METRICS_BATCH_SIZE = 15
+METRICS_MAX_BATCH_SIZE = int(
+    os.getenv("FLASK_COLLECTOR_METRICS_MAX_BATCH_SIZE", 100)
+)
+# Metrics requests slower than this (in seconds) shrink the next batches
+METRICS_TARGET_LATENCY = float(
+    os.getenv("FLASK_COLLECTOR_METRICS_TARGET_LATENCY", 2)
+)
+METRICS_MAX_RETRIES = int(os.getenv("FLASK_COLLECTOR_METRICS_MAX_RETRIES", 5))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Number of metrics batches requested concurrently, 1 to fetch sequentially
+METRICS_WORKERS = int(os.getenv("FLASK_COLLECTOR_METRICS_WORKERS", 4))
+# Maximum metrics requests per second across all workers, 0 for no limit
+METRICS_RATE_LIMIT = float(os.getenv("FLASK_COLLECTOR_METRICS_RATE_LIMIT", 0))
 RATINGS_BATCH_SIZE = 20
+# Number of snaps written per UPDATE ... FROM (VALUES ...) statement
+UPDATE_CHUNK_SIZE = 500
+# Eligible snap ids fetched per round trip of the server-side cursor
+ELIGIBLE_SNAPS_YIELD_PER = 5000
+METRICS_COLUMNS = ("active_devices",)
+RATINGS_COLUMNS = ("raw_rating", "total_votes")
+# Can be pointed at scripts/store_api_standin.py for local benchmarks
+DASHBOARD_API_URL = os.getenv(
+    "FLASK_COLLECTOR_DASHBOARD_API_URL", "https://dashboard.snapcraft.io"
+)
 RELEASES_URL = "http://api.snapcraft.io/api/v1/snaps/search?fields=revision"
-METRICS_URL = "https://dashboard.snapcraft.io/dev/api/snaps/metrics"
+METRICS_URL = f"{DASHBOARD_API_URL}/dev/api/snaps/metrics"
 
 MACAROON = os.environ.get(MACAROON_ENV_PATH)
 
 logger = logging.getLogger("extra_fields")
 
+# Also paused for every worker when the API answers with a Retry-After
+METRICS_RATE_LIMITER = RateLimiter(METRICS_RATE_LIMIT)
+
 T = TypeVar("T")
 
 
@@ -32,49 +83,78 @@ def batched(iterable: list[T], batch_size: int = 1):
         yield iterable[i : i + batch_size]
 
 
-def calculate_latest_active_devices(metrics_data: dict) -> int:
+def latest_active_devices(
+    metrics: List[dict], start_date: Optional[str] = None
+) -> List[int]:
     """
-    Calculates the latest number of active devices from metrics data.
+    Calculates the latest number of active devices of every snap in a
+    metrics response: the last non-zero value of each version series
+    covering all the buckets, summed per snap. Missing values count as 0.
+
+    The series are scanned from their end with C-level iterators, and
+    neither sorted nor patched in place.
+
+    :param metrics: The "metrics" list of a metrics API response.
+    :param start_date: Ignore the days before this one, e.g. history
+                       fetched for the installed base table.
+    :return: The active devices of each snap, in the order of `metrics`.
     """
-    latest_active_devices = 0
-    metrics_data["series"] = sorted(
-        metrics_data["series"], key=lambda x: x["name"]
-    )
+    active_devices = []
+    for snap_metrics in metrics:
+        buckets = snap_metrics["buckets"]
+        days = len(buckets)
+        if start_date:
+            # Buckets are ISO dates in ascending order
+            days -= bisect_left(buckets, start_date)
+        total = 0
+        if days:
+            for series in snap_metrics["series"]:
+                values = series["values"]
+                if len(values) == len(buckets):
+                    # Most series end with a value, so check that first
+                    total += values[-1] or next(
+                        filter(None, islice(reversed(values), days)), 0
+                    )
+        active_devices.append(total)
+    return active_devices
 
-    for series_index, series in enumerate(metrics_data["series"]):
-        for index, value in enumerate(series["values"]):
-            if value is None:
-                metrics_data["series"][series_index]["values"][index] = 0
-        values = series["values"]
-        if len(values) == len(metrics_data["buckets"]):
-            for i in range(len(values) - 1, -1, -1):
-                if values[i] != 0:
-                    latest_active_devices += values[i]
-                    break
 
-    return latest_active_devices
+def calculate_latest_active_devices(metrics_data: dict) -> int:
+    """
+    Calculates the latest number of active devices from metrics data.
+    """
+    return latest_active_devices([metrics_data])[0]
 
 
 def fetch_metrics_from_api(
-    snaps: List[Snap], start_date: str, end_date: str
+    snap_ids: List[str],
+    start_date: str,
+    end_date: str,
+    start_dates: Optional[dict] = None,
 ) -> dict:
     """
     Fetches metrics data for a batch of snaps from the API.
+
+    Safe to call from several threads at once.
+
+    :param start_dates: Start dates by snap id overriding `start_date`.
     """
+    start_dates = start_dates or {}
     request_body = {
         "filters": [
             {
-                "start": start_date,
+                "start": start_dates.get(snap_id, start_date),
                 "end": end_date,
                 "metric_name": "weekly_installed_base_by_version",
-                "snap_id": snap.snap_id,
+                "snap_id": snap_id,
             }
-            for snap in snaps
+            for snap_id in snap_ids
         ]
     }
 
     try:
-        response = requests.post(
+        METRICS_RATE_LIMITER.wait()
+        response = http_session.post(
             METRICS_URL,
             headers={
                 "Authorization": f"Macaroon {MACAROON}",
@@ -103,43 +183,308 @@ def fetch_metrics_from_api(
         raise
 
 
-def process_and_update_snap_metrics(
-    snaps: List[Snap], metrics_data: dict, db_session: Session
-):
+def is_retryable(error: Exception) -> bool:
     """
-    Processes API response data and updates
-    the database with active device counts.
+    Whether a failed metrics request may succeed if sent again.
     """
-    try:
-        for snap, snap_metrics in zip(snaps, metrics_data.get("metrics", [])):
-            active_devices = calculate_latest_active_devices(snap_metrics)
-            snap.active_devices = active_devices
+    if isinstance(error, requests.HTTPError):
+        return (
+            error.response is not None
+            and error.response.status_code in RETRYABLE_STATUS_CODES
+        )
+    return isinstance(error, (requests.Timeout, requests.ConnectionError))
+
+
+def fetch_metrics_batch(
+    snap_ids: List[str],
+    start_date: str,
+    end_date: str,
+    start_dates: Optional[dict],
+    batch_size: AdaptiveBatchSize,
+    retries: int = METRICS_MAX_RETRIES,
+) -> dict:
+    """
+    Fetches metrics for a batch of snaps like `fetch_metrics_from_api`,
+    reporting the latency or failure of every attempt to `batch_size`.
+
+    Rate limited, failed and timed out requests are retried up to
+    `retries` times, after the Retry-After delay when the API gives one
+    and an exponential backoff otherwise. Failures other than rate limiting
+    shrink the batch size, and a retried batch larger than the current
+    batch size is split into several requests.
+    """
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        try:
+            metrics_data = fetch_metrics_from_api(
+                snap_ids, start_date, end_date, start_dates
+            )
+        except Exception as error:
+            if attempt >= retries or not is_retryable(error):
+                raise
+            response = getattr(error, "response", None)
+            # Smaller batches would only mean more requests to rate limit
+            if response is None or response.status_code != 429:
+                batch_size.record_failure(len(snap_ids))
+            retry_after = get_retry_after(response)
+            attempt += 1
+            if retry_after is not None:
+                # Holds back the other workers too, the limit is shared
+                METRICS_RATE_LIMITER.pause(retry_after)
+                delay = 0
+            else:
+                delay = backoff_delay(attempt - 1)
+            logger.warning(
+                f"Retrying metrics for {len(snap_ids)} snaps "
+                f"({attempt}/{retries}) in {retry_after or delay:.1f}s: "
+                f"{error}"
+            )
+            time.sleep(delay)
+
+            if len(snap_ids) > batch_size.size:
+                metrics = []
+                for chunk in batched(snap_ids, batch_size.size):
+                    metrics.extend(
+                        fetch_metrics_batch(
+                            chunk,
+                            start_date,
+                            end_date,
+                            start_dates,
+                            batch_size,
+                            retries - attempt,
+                        )["metrics"]
+                    )
+                return {"metrics": metrics}
+            continue
+
+        batch_size.record_success(len(snap_ids), time.monotonic() - started)
+        return metrics_data
+
+
+def bulk_update_snaps(
+    session: Session, rows: List[dict], columns: Tuple[str, ...]
+) -> int:
+    """
+    Sets `columns` of many snaps with a single UPDATE ... FROM (VALUES ...),
+    skipping snaps whose values did not change.
+
+    :param session: The database session.
+    :param rows: Dicts with a snap_id and a value for each of `columns`.
+    :param columns: The snap columns to update.
+    :return: The number of snaps written.
+    """
+    if not rows:
+        return 0
+
+    new_values = values(
+        column("snap_id", String),
+        *(column(name, Snap.__table__.c[name].type) for name in columns),
+        name="new_values",
+    ).data([(row["snap_id"], *(row[name] for name in columns)) for row in rows])
+    # Postgres types a VALUES column from its data, so a column that is
+    # NULL in every row would be text and not comparable with the snap's
+    typed = {
+        name: cast(new_values.c[name], Snap.__table__.c[name].type)
+        for name in columns
+    }
+    stmt = (
+        update(Snap)
+        .where(Snap.snap_id == new_values.c.snap_id)
+        .where(
+            or_(
+                *(
+                    Snap.__table__.c[name].is_distinct_from(typed[name])
+                    for name in columns
+                )
+            )
+        )
+        .values(typed)
+        .execution_options(synchronize_session=False)
+    )
+    return session.execute(stmt).rowcount
+
+
+def lock_snaps(session: Session, snap_ids: List[str]):
+    """
+    Locks the rows of `snap_ids` in snap_id order until the transaction
+    ends.
+    """
+    session.execute(
+        select(Snap.snap_id)
+        .where(Snap.snap_id.in_(snap_ids))
+        .order_by(Snap.snap_id)
+        .with_for_update()
+    ).all()
+
+
+def write_snap_updates(
+    db_session: Session, rows: List[dict], columns: Tuple[str, ...]
+) -> int:
+    """
+    Writes `rows` in snap_id order with one `bulk_update_snaps` statement
+    per UPDATE_CHUNK_SIZE rows, committing each chunk.
+
+    The metrics and ratings sub-steps update the same snaps concurrently.
+    Short transactions that lock their rows in the same order keep them
+    from waiting on each other for long or deadlocking.
+
+    :return: The number of snaps written.
+    """
+    written = 0
+    for chunk in batched(
+        sorted(rows, key=lambda row: row["snap_id"]), UPDATE_CHUNK_SIZE
+    ):
+        lock_snaps(db_session, [row["snap_id"] for row in chunk])
+        written += bulk_update_snaps(db_session, chunk, columns)
         db_session.commit()
-        logger.info(f"Updated metrics for {len(snaps)} snaps successfully.")
+    return written
+
+
+def calculate_active_devices_rows(
+    snap_ids: List[str], metrics_data: dict, start_date: Optional[str] = None
+) -> List[dict]:
+    """
+    Returns an active_devices row for each snap of a metrics response.
+
+    :param start_date: Ignore the days before this one, e.g. history
+                       fetched for the installed base table.
+    """
+    try:
+        return [
+            {"snap_id": snap_id, "active_devices": active_devices}
+            for snap_id, active_devices in zip(
+                snap_ids,
+                latest_active_devices(
+                    metrics_data.get("metrics", []), start_date
+                ),
+            )
+        ]
     except KeyError as key_err:
         logger.error(f"Missing expected data in metrics response: {key_err}")
         raise
-    except Exception as ex:
-        logger.error(f"Unexpected error during metrics processing: {ex}")
-        raise
 
 
-def fetch_and_update_metrics_for_snaps(snaps: List[Snap], db_session: Session):
+def iter_metrics_batches(
+    snap_ids: List[str],
+    start_date: str,
+    end_date: str,
+    workers: int = METRICS_WORKERS,
+    start_dates: Optional[dict] = None,
+    batch_size: Optional[AdaptiveBatchSize] = None,
+) -> Iterator[Tuple[List[str], dict]]:
     """
-    Fetches and updates metrics for a list of snaps in batches.
+    Fetches metrics for batches of snaps with up to `workers` requests in
+    flight, yielding the responses in batch order. `start_dates` overrides
+    `start_date` for individual snaps.
+
+    Each batch takes the size `batch_size` has adapted to when it is
+    submitted, starting from METRICS_BATCH_SIZE. Once a batch fails for
+    good, the pending ones are cancelled and the error is raised to the
+    caller.
+
+    :return: An iterator of (batch snap ids, metrics) tuples.
+    """
+    if batch_size is None:
+        batch_size = AdaptiveBatchSize(
+            METRICS_BATCH_SIZE,
+            maximum=METRICS_MAX_BATCH_SIZE,
+            target_latency=METRICS_TARGET_LATENCY,
+        )
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, workers), thread_name_prefix="metrics"
+    )
+    next_offset = 0
+    in_flight = deque()
+
+    def submit_next_batch():
+        nonlocal next_offset
+        if next_offset < len(snap_ids):
+            batch = snap_ids[next_offset : next_offset + batch_size.size]
+            next_offset += len(batch)
+            in_flight.append(
+                (
+                    batch,
+                    executor.submit(
+                        fetch_metrics_batch,
+                        batch,
+                        start_date,
+                        end_date,
+                        start_dates,
+                        batch_size,
+                    ),
+                )
+            )
+
+    try:
+        for _ in range(max(1, workers)):
+            submit_next_batch()
+
+        while in_flight:
+            batch, future = in_flight.popleft()
+            metrics_data = future.result()
+            submit_next_batch()
+            yield batch, metrics_data
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def fetch_and_update_metrics_for_snaps(
+    snap_ids: List[str], db_session: Session, workers: int = METRICS_WORKERS
+):
+    """
+    Fetches and updates metrics for a list of snap ids in batches.
+
+    Up to `workers` batches are fetched concurrently, while the calling
+    thread alone writes the results to the database. Days missing from
+    the installed base history of each snap are fetched along with the
+    window active devices are computed from, and stored.
     """
     start_date, end_date = get_metrics_time_range()
-    for snap_batch in batched(snaps, METRICS_BATCH_SIZE):
-        try:
-            metrics_data = fetch_metrics_from_api(
-                snap_batch, start_date, end_date
+    start_dates = get_metrics_start_dates(
+        db_session, snap_ids, start_date, end_date
+    )
+    batch_size = AdaptiveBatchSize(
+        METRICS_BATCH_SIZE,
+        maximum=METRICS_MAX_BATCH_SIZE,
+        target_latency=METRICS_TARGET_LATENCY,
+    )
+    pending = []
+    pending_installed_base = []
+    written = 0
+    stored_days = 0
+
+    def write_pending():
+        nonlocal pending, pending_installed_base, written, stored_days
+        stored_days += store_installed_base(
+            db_session, pending_installed_base
+        )
+        written += write_snap_updates(db_session, pending, METRICS_COLUMNS)
+        pending = []
+        pending_installed_base = []
+
+    try:
+        for batch, metrics_data in iter_metrics_batches(
+            snap_ids, start_date, end_date, workers, start_dates, batch_size
+        ):
+            pending_installed_base.extend(
+                installed_base_rows(batch, metrics_data)
             )
-            process_and_update_snap_metrics(
-                snap_batch, metrics_data, db_session
+            pending.extend(
+                calculate_active_devices_rows(batch, metrics_data, start_date)
             )
-        except Exception as ex:
-            logger.error(f"Failed to process batch of snaps: {ex}")
-            raise
+            if len(pending) >= UPDATE_CHUNK_SIZE:
+                write_pending()
+        write_pending()
+        logger.info(
+            f"Updated metrics for {len(snap_ids)} snaps, {written} changed, "
+            f"{stored_days} installed base days stored. Batch size "
+            f"ended at {batch_size.size} after {batch_size.failures} "
+            f"failed requests."
+        )
+    except Exception as ex:
+        logger.error(f"Failed to process batch of snaps: {ex}")
+        raise
 
 
 def get_metrics_time_range() -> tuple[str, str]:
@@ -151,55 +496,170 @@ def get_metrics_time_range() -> tuple[str, str]:
     return start_date, end_date
 
 
-def fetch_eligible_snaps(db_session: Session) -> List[Snap]:
+def iter_eligible_snap_ids(
+    db_session: Session, yield_per: int = ELIGIBLE_SNAPS_YIELD_PER
+) -> Iterator[str]:
+    """
+    Streams the ids of the snaps that meet the minimum threshold through
+    a server-side cursor, `yield_per` at a time, without loading the
+    snaps themselves.
+    """
+    stmt = (
+        select(Snap.snap_id)
+        .where(Snap.reaches_min_threshold, Snap.delisted_at.is_(None))
+        .order_by(Snap.snap_id)
+        .execution_options(yield_per=yield_per)
+    )
+    yield from db_session.execute(stmt).scalars()
+
+
+def fetch_eligible_snap_ids(db_session: Session) -> List[str]:
     """
-    Fetches snaps from the database that meet the minimum threshold.
+    Returns the ids of the snaps that meet the minimum threshold.
     """
     try:
-        snaps = db_session.query(Snap).filter(Snap.reaches_min_threshold).all()
+        snap_ids = list(iter_eligible_snap_ids(db_session))
         logger.info(
-            f"Found {len(snaps)} eligible snaps for extra fields collection."
+            f"Found {len(snap_ids)} eligible snaps for extra fields "
+            f"collection."
         )
-        return snaps
+        return snap_ids
     except Exception as e:
         logger.error(f"Error querying eligible snaps: {e}")
         raise
 
 
-def update_snap_metrics():
+def update_snap_metrics(snap_ids: Optional[List[str]] = None):
+    """
+    Updates the metrics of `snap_ids`, the eligible snaps when None.
+    """
     try:
-        eligible_snaps = fetch_eligible_snaps(db.session)
-        fetch_and_update_metrics_for_snaps(eligible_snaps, db.session)
+        if snap_ids is None:
+            snap_ids = fetch_eligible_snap_ids(db.session)
+        fetch_and_update_metrics_for_snaps(snap_ids, db.session)
+        delete_expired_installed_base(db.session)
+        db.session.commit()
     except Exception as e:
         logger.error(f"Error during metrics update process: {e}")
         raise
 
 
-def update_snap_ratings():
+def chart_rating_rows(
+    snap_ids: List[str], charts: dict, failed: set = frozenset()
+) -> dict:
+    """
+    Returns a row of chart rating columns for each snap, with NULLs for
+    the timeframes whose charts it isn't in.
+
+    A snap missing from the charts of a timeframe may be in one of its
+    `failed` charts, so its columns for that timeframe are left out
+    rather than set to NULL.
+
+    :param failed: The (timeframe, category) of the charts that could not
+                   be fetched.
+    :return: The rows grouped by the tuple of columns they set.
+    """
+    failed_timeframes = {timeframe for timeframe, _ in failed}
+    rows = defaultdict(list)
+    for snap_id in snap_ids:
+        row = {"snap_id": snap_id}
+        for timeframe, chart in charts.items():
+            if snap_id not in chart and timeframe in failed_timeframes:
+                continue
+            rating = chart.get(snap_id, {})
+            for name in RATINGS_COLUMNS:
+                row[f"{timeframe}_{name}"] = rating.get(name)
+        columns = tuple(row)[1:]
+        if columns:
+            rows[columns].append(row)
+    return dict(rows)
+
+
+def update_snap_ratings(
+    snap_ids: Optional[List[str]] = None, source: str = RATINGS_SOURCE
+):
+    """
+    Updates the ratings of `snap_ids` (the eligible snaps when None),
+    requested by snap id or, when `source` is "chart", taken from the
+    ratings charts.
+    """
     try:
-        eligible_snaps = fetch_eligible_snaps(db.session)
-        token = ratings_login()
-        for snap_batch in batched(eligible_snaps, RATINGS_BATCH_SIZE):
-            ratings_dict = get_ratings(
-                [snap.snap_id for snap in snap_batch], token
+        if snap_ids is None:
+            snap_ids = fetch_eligible_snap_ids(db.session)
+        if source == "chart":
+            ratings_dict, charts, failed = fetch_chart_ratings(
+                snap_ids, RATINGS_BATCH_SIZE
             )
-            for snap in snap_batch:
-                if snap.snap_id in ratings_dict:
-                    snap.raw_rating = ratings_dict[snap.snap_id]["raw_rating"]
-                    snap.total_votes = ratings_dict[snap.snap_id][
-                        "total_votes"
-                    ]
-        db.session.commit()
-        logger.info("Updated ratings for eligible snaps successfully.")
+            for columns, rows in chart_rating_rows(
+                snap_ids, charts, failed
+            ).items():
+                write_snap_updates(db.session, rows, columns)
+        else:
+            # Batches are requested concurrently over a single channel
+            ratings_dict = fetch_ratings(snap_ids, RATINGS_BATCH_SIZE)
+        rows = [
+            {
+                "snap_id": snap_id,
+                "raw_rating": ratings_dict[snap_id]["raw_rating"],
+                "total_votes": ratings_dict[snap_id]["total_votes"],
+            }
+            for snap_id in snap_ids
+            if snap_id in ratings_dict
+        ]
+        written = write_snap_updates(db.session, rows, RATINGS_COLUMNS)
+        logger.info(
+            f"Updated ratings for eligible snaps successfully, "
+            f"{written} changed."
+        )
     except Exception as e:
         logger.error(f"Error during ratings update process: {e}")
         raise
 
 
+def run_sub_step(app: Flask, name: str, function, *args) -> Optional[str]:
+    """
+    Runs a sub-step of the extra fields step in its own app context, and
+    so with its own database session, logging how long it took.
+
+    :return: The error the sub-step failed with, None if it succeeded.
+    """
+    start = time.monotonic()
+    error = None
+    try:
+        with app.app_context():
+            function(*args)
+    except Exception as e:
+        error = f"{name}: {e}"
+    logger.info(
+        f"{name.capitalize()} {'failed' if error else 'updated'} "
+        f"in {time.monotonic() - start:.1f}s."
+    )
+    return error
+
+
 def fetch_extra_fields():
+    """
+    Updates the metrics and the ratings of the eligible snaps. Both talk
+    to unrelated services and write different columns, so they run
+    concurrently, and one failing doesn't stop the other.
+    """
     try:
-        update_snap_metrics()
-        update_snap_ratings()
+        snap_ids = fetch_eligible_snap_ids(db.session)
+        app = current_app._get_current_object()
+        sub_steps = {
+            "metrics": update_snap_metrics,
+            "ratings": update_snap_ratings,
+        }
+        with ThreadPoolExecutor(
+            max_workers=len(sub_steps), thread_name_prefix="extra_fields"
+        ) as executor:
+            futures = [
+                executor.submit(run_sub_step, app, name, function, snap_ids)
+                for name, function in sub_steps.items()
+            ]
+        errors = [future.result() for future in futures if future.result()]
+        if errors:
+            raise RuntimeError("; ".join(errors))
         add_pipeline_step_log(PipelineSteps.EXTRA_FIELDS, True)
     except Exception as e:
         logger.error(f"Error during extra fields update: {e}")
@@ -1,78 +1,179 @@
-from sqlalchemy import func
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.orm import Session
 from snaprecommend.models import Snap, PipelineSteps
 import datetime
 from snaprecommend import db
 from snaprecommend.logic import add_pipeline_step_log
+from snaprecommend.settings import get_setting, set_setting
 
 import logging
 
 logger = logging.getLogger("collector")
 
 
-# TODO: It would be nice to have the criteria configured through UI.
-# i.e, consider having a config table in the database
-MINIMUM_DESCRIPTION_LENGTH = 50
-LAST_UPDATED_THRESHOLD = 180  # in days
-MINIMUM_MEDIA_ITEMS = 1  # Including the icon
+# Settings key holding the criteria edited through the API. Missing keys
+# fall back to DEFAULT_FILTER_CRITERIA.
+FILTER_CRITERIA_KEY = "filter_criteria"
 
+DEFAULT_FILTER_CRITERIA = {
+    "minimum_description_length": 50,
+    "last_updated_threshold_days": 180,
+    "minimum_media_items": 1,  # Including the icon
+    "require_icon": True,
+    "require_author_contact": True,
+}
 
-def snap_meets_minimum_criteria_query():
+
+def validate_filter_criteria(criteria: dict, base: dict = None) -> dict:
     """
-    Builds the SQL filter criteria for snaps meeting the minimum requirements
-    to be considered for recommendations
+    Validates criteria and merges them over `base`.
+
+    :param criteria: A possibly partial dict of criteria.
+    :param base: The criteria to merge over, the defaults when None.
+    :return: The complete criteria.
+    :raises ValueError: If the criteria aren't a dict, or a criterion is
+                        unknown or has the wrong type.
     """
-    update_threshold = datetime.datetime.now() - datetime.timedelta(
-        days=LAST_UPDATED_THRESHOLD
-    )
+    # Criteria come straight from request bodies, which may be any JSON
+    if not isinstance(criteria, dict):
+        raise ValueError("Filter criteria must be an object")
+    merged = dict(base or DEFAULT_FILTER_CRITERIA)
+    for name, value in criteria.items():
+        if name not in DEFAULT_FILTER_CRITERIA:
+            raise ValueError(f"Unknown filter criterion: {name}")
+        expected = type(DEFAULT_FILTER_CRITERIA[name])
+        # bool is a subclass of int, so compare the exact types
+        if type(value) is not expected:
+            raise ValueError(
+                f"Filter criterion {name} must be of type {expected.__name__}"
+            )
+        if expected is int and value < 0:
+            raise ValueError(f"Filter criterion {name} can't be negative")
+        merged[name] = value
+    return merged
+
+
+def get_filter_criteria() -> dict:
+    """
+    Returns the filter criteria stored in the settings table.
+    """
+    setting = get_setting(FILTER_CRITERIA_KEY)
+    return validate_filter_criteria(setting.value if setting else {})
+
+
+def set_filter_criteria(criteria: dict) -> dict:
+    """
+    Validates and stores (possibly partial) filter criteria, which are
+    applied on the next filter run.
+    """
+    merged = validate_filter_criteria(criteria, get_filter_criteria())
+    set_setting(FILTER_CRITERIA_KEY, merged)
+    return merged
 
-    has_icon = Snap.icon.isnot(None)
 
-    has_media = func.json_array_length(Snap.media) >= MINIMUM_MEDIA_ITEMS
+def snap_meets_minimum_criteria_query(criteria: dict = None) -> dict:
+    """
+    Compiles the filter criteria into SQL conditions for snaps meeting the
+    minimum requirements to be considered for recommendations.
 
-    issues = func.json_extract_path(Snap.links, "issues")
-    has_issues_link = issues.isnot(None) & (func.json_array_length(issues) > 0)
+    :param criteria: The criteria, the stored ones when None.
+    :return: A dict of conditions by name, in evaluation order. Disabled
+             criteria are left out.
+    """
+    if criteria is None:
+        criteria = get_filter_criteria()
 
-    contact = func.json_extract_path(Snap.links, "contact")
-    has_contact_link = contact.isnot(None) & (
-        func.json_array_length(contact) > 0
+    update_threshold = datetime.datetime.now() - datetime.timedelta(
+        days=criteria["last_updated_threshold_days"]
     )
 
-    author_can_be_reached = has_issues_link | has_contact_link
+    conditions = {"is_listed": Snap.delisted_at.is_(None)}
+
+    if criteria["require_icon"]:
+        conditions["has_icon"] = Snap.has_icon.is_(True)
 
-    has_description = Snap.description.isnot(None) & (
-        func.length(Snap.description) > MINIMUM_DESCRIPTION_LENGTH
+    conditions["has_media"] = (
+        Snap.media_count >= criteria["minimum_media_items"]
     )
 
-    is_recent = Snap.last_updated > update_threshold
+    if criteria["require_author_contact"]:
+        conditions["author_can_be_reached"] = (
+            Snap.has_contact_link.is_(True) | Snap.has_issues_link.is_(True)
+        )
 
-    return (
-        has_icon,
-        has_media,
-        author_can_be_reached,
-        has_description,
-        is_recent,
+    conditions["has_description"] = (
+        Snap.description_length > criteria["minimum_description_length"]
     )
 
+    conditions["is_recent"] = Snap.last_updated > update_threshold
 
-def filter_snaps_meeting_minimum_criteria():
-    try:
-        query = db.session.query(Snap).filter(
-            *snap_meets_minimum_criteria_query()
-        )
+    return conditions
 
-        db.session.query(Snap).update(
-            {Snap.reaches_min_threshold: False}, synchronize_session=False
-        )
 
-        query.update(
-            {Snap.reaches_min_threshold: True}, synchronize_session=False
-        )
+def evaluate_filter_criteria(session: Session, criteria: dict) -> dict:
+    """
+    Counts the snaps passing each criterion individually and all of them
+    together, in a single aggregate query and without writing anything.
+
+    :param session: The database session.
+    :param criteria: The criteria to evaluate.
+    :return: A dict with the total number of snaps, the number passing each
+             criterion and the number passing all of them.
+    """
+    conditions = snap_meets_minimum_criteria_query(criteria)
+    stmt = select(
+        func.count().label("total"),
+        *(
+            func.count().filter(condition).label(name)
+            for name, condition in conditions.items()
+        ),
+        func.count().filter(and_(*conditions.values())).label("passing"),
+    ).select_from(Snap)
+    counts = session.execute(stmt).one()._asdict()
+
+    return {
+        "total": counts["total"],
+        "by_criterion": {name: counts[name] for name in conditions},
+        "passing": counts["passing"],
+    }
+
+
+def update_min_threshold_flags(
+    session: Session, criteria: dict = None
+) -> dict:
+    """
+    Recomputes `reaches_min_threshold` for every snap in a single UPDATE
+    that only writes the snaps whose flag changes.
 
+    :param session: The database session.
+    :param criteria: The criteria to apply, the stored ones when None.
+    :return: A dict with the number of newly passing and newly failing snaps.
+    """
+    # Criteria on missing data (e.g. no last_updated) evaluate to NULL
+    meets_criteria = func.coalesce(
+        and_(*snap_meets_minimum_criteria_query(criteria).values()), False
+    )
+    stmt = (
+        update(Snap)
+        .where(Snap.reaches_min_threshold.is_distinct_from(meets_criteria))
+        .values(reaches_min_threshold=meets_criteria)
+        .returning(Snap.reaches_min_threshold)
+        .execution_options(synchronize_session=False)
+    )
+    changed = session.execute(stmt).scalars().all()
+
+    passing = sum(1 for flag in changed if flag)
+    return {"passing": passing, "failing": len(changed) - passing}
+
+
+def filter_snaps_meeting_minimum_criteria():
+    try:
+        counts = update_min_threshold_flags(db.session)
         db.session.commit()
 
-        snap_count = query.count()
         logger.info(
-            f"Filtered snaps to {snap_count} snaps meeting minimum criteria."
+            f"{counts['passing']} snaps now meet the minimum criteria, "
+            f"{counts['failing']} no longer do."
         )
 
         add_pipeline_step_log(PipelineSteps.FILTER, True)
@@ -0,0 +1,236 @@
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("collector")
+
+# (connect, read) timeouts in seconds for every collector request
+HTTP_TIMEOUT = (
+    float(os.getenv("FLASK_COLLECTOR_HTTP_CONNECT_TIMEOUT", 5)),
+    float(os.getenv("FLASK_COLLECTOR_HTTP_READ_TIMEOUT", 60)),
+)
+HTTP_POOL_SIZE = int(os.getenv("FLASK_COLLECTOR_HTTP_POOL_SIZE", 16))
+
+
+class RateLimiter:
+    """
+    Spaces calls to `wait` at least 1 / `rate` seconds apart across all
+    threads sharing the limiter, or not at all when `rate` is 0.
+    """
+
+    def __init__(self, rate: float = 0):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def pause(self, seconds: float):
+        """
+        Holds every call to `wait` back for `seconds`, e.g. when a server
+        asks for it with a Retry-After header.
+        """
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class AdaptiveBatchSize:
+    """
+    Sizes the batches of a batched API by additive increase and
+    multiplicative decrease, sharing the size between concurrent workers.
+
+    The size grows by one after each full batch answered within
+    `target_latency` seconds, shrinks by a quarter after a slower one and
+    is halved after a failed one, staying between `minimum` and `maximum`.
+    Each change is computed from the size of the batch that caused it, so
+    several workers failing at once only halve the size once.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: int = None,
+        target_latency: float = 2.0,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.target_latency = target_latency
+        self.failures = 0
+        self._size = max(minimum, min(initial, self.maximum))
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._size
+
+    def _resize(self, size: int):
+        self._size = max(self.minimum, min(size, self.maximum))
+
+    def record_success(self, size: int, latency: float):
+        with self._lock:
+            if latency > self.target_latency:
+                self._resize(min(self._size, size - max(1, size // 4)))
+            elif size >= self._size:
+                self._resize(self._size + 1)
+
+    def record_failure(self, size: int):
+        with self._lock:
+            self.failures += 1
+            self._resize(min(self._size, size // 2))
+
+
+def get_retry_after(response: Optional[Response]) -> Optional[float]:
+    """
+    Returns the seconds to wait before retrying a request, as given by the
+    Retry-After header of its response in seconds or as an HTTP date.
+
+    :return: The delay, or None when the response has no valid header.
+    """
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """
+    Returns the delay before retry number `attempt` (from 0): an exponential
+    backoff with jitter, so workers failing together don't retry together.
+    """
+    delay = min(cap, base * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class CollectorSession(Session):
+    """
+    A keep-alive session shared by the collector steps.
+
+    Connections are pooled per host, every request gets a timeout and
+    negotiates gzip, and `get_conditional` revalidates previously seen
+    URLs with their ETag/Last-Modified so unchanged resources come back
+    as an empty 304. Request counts, bytes received and 304 hits are
+    accumulated until `reset_stats` is called.
+    """
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+        self.headers["Accept-Encoding"] = "gzip, deflate"
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._validators = {}
+        self.reset_stats()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        response = super().request(method, url, **kwargs)
+
+        if kwargs.get("stream"):
+            received = int(response.headers.get("Content-Length", 0))
+        else:
+            received = len(response.content)
+            try:
+                # Bytes read off the wire, i.e. before decompression
+                received = response.raw.tell() or received
+            except Exception:
+                pass
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += received
+            if response.status_code == 304:
+                self.stats["not_modified"] += 1
+        return response
+
+    def get_conditional(self, url: str, **kwargs):
+        """
+        GETs `url`, revalidating the validators of its last 200 response.
+
+        :return: The response, with status code 304 when `url` is unchanged.
+        """
+        with self._lock:
+            etag, last_modified = self._validators.get(url, (None, None))
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        response = self.get(url, headers=headers, **kwargs)
+
+        if response.status_code == 200:
+            validators = (
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+            with self._lock:
+                if any(validators):
+                    self._validators[url] = validators
+                else:
+                    self._validators.pop(url, None)
+        return response
+
+    def forget(self, url: str = None):
+        """
+        Drops the validators of `url`, or of every URL when None, so its
+        next GET is unconditional.
+        """
+        with self._lock:
+            if url is None:
+                self._validators.clear()
+            else:
+                self._validators.pop(url, None)
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"requests": 0, "bytes": 0, "not_modified": 0}
+
+    def log_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        hit_ratio = (
+            stats["not_modified"] / stats["requests"]
+            if stats["requests"]
+            else 0
+        )
+        logger.info(
+            f"HTTP: {stats['requests']} requests, "
+            f"{stats['bytes'] / 1024 / 1024:.1f} MiB received, "
+            f"{stats['not_modified']} not modified ({hit_ratio:.0%})."
+        )
+
+
+http_session = CollectorSession()
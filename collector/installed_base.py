@@ -0,0 +1,127 @@
+import datetime
+import logging
+import os
+from typing import List
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from snaprecommend.models import SnapInstalledBase
+
+logger = logging.getLogger("extra_fields")
+
+# Days of installed base requested for a snap without any stored history
+INSTALLED_BASE_HISTORY_DAYS = int(
+    os.getenv("FLASK_COLLECTOR_INSTALLED_BASE_HISTORY_DAYS", 30)
+)
+# Stored days older than this are deleted after each metrics update
+INSTALLED_BASE_RETENTION_DAYS = int(
+    os.getenv("FLASK_COLLECTOR_INSTALLED_BASE_RETENTION_DAYS", 90)
+)
+
+# Number of rows per INSERT ... ON CONFLICT statement
+INSTALLED_BASE_CHUNK_SIZE = 1000
+
+
+def get_metrics_start_dates(
+    session: Session, snap_ids: List[str], start_date: str, end_date: str
+) -> dict:
+    """
+    Returns the first day to request metrics from for each snap, so that
+    only days missing from the installed base history are fetched.
+
+    Every snap still gets at least the [start_date, end_date] window its
+    active devices are computed from. Snaps without any history get
+    INSTALLED_BASE_HISTORY_DAYS days.
+
+    :return: A dict of ISO start dates by snap id.
+    """
+    end = datetime.date.fromisoformat(end_date)
+    window_start = datetime.date.fromisoformat(start_date)
+    earliest = end - datetime.timedelta(days=INSTALLED_BASE_HISTORY_DAYS - 1)
+
+    last_days = dict(
+        session.execute(
+            select(SnapInstalledBase.snap_id, func.max(SnapInstalledBase.day))
+            # Older days would be clamped to `earliest` anyway. Filtering
+            # on the day rather than the ids keeps the query size constant.
+            .where(SnapInstalledBase.day >= earliest)
+            .group_by(SnapInstalledBase.snap_id)
+        ).all()
+    )
+
+    start_dates = {}
+    for snap_id in snap_ids:
+        last_day = last_days.get(snap_id)
+        first_missing = (
+            last_day + datetime.timedelta(days=1) if last_day else earliest
+        )
+        start_dates[snap_id] = min(
+            max(first_missing, earliest), window_start
+        ).isoformat()
+    return start_dates
+
+
+def installed_base_rows(snap_ids: List[str], metrics_data: dict) -> List[dict]:
+    """
+    Sums the version series of each snap in a metrics response into one
+    installed base row per day. Days without any value yet are skipped.
+    """
+    rows = []
+    for snap_id, snap_metrics in zip(
+        snap_ids, metrics_data.get("metrics", [])
+    ):
+        for index, day in enumerate(snap_metrics.get("buckets", [])):
+            values = [
+                series["values"][index]
+                for series in snap_metrics.get("series", [])
+                if index < len(series["values"])
+                and series["values"][index] is not None
+            ]
+            if values:
+                rows.append(
+                    {
+                        "snap_id": snap_id,
+                        "day": datetime.date.fromisoformat(day),
+                        "installed_base": sum(values),
+                    }
+                )
+    return rows
+
+
+def store_installed_base(session: Session, rows: List[dict]) -> int:
+    """
+    Upserts installed base rows, rewriting stored days whose value was
+    revised since they were last fetched.
+
+    :return: The number of rows written.
+    """
+    written = 0
+    for start in range(0, len(rows), INSTALLED_BASE_CHUNK_SIZE):
+        stmt = insert(SnapInstalledBase).values(
+            rows[start : start + INSTALLED_BASE_CHUNK_SIZE]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["snap_id", "day"],
+            set_={"installed_base": stmt.excluded.installed_base},
+            where=SnapInstalledBase.installed_base.is_distinct_from(
+                stmt.excluded.installed_base
+            ),
+        )
+        written += session.execute(stmt).rowcount
+    return written
+
+
+def delete_expired_installed_base(session: Session) -> int:
+    """
+    Deletes stored days older than INSTALLED_BASE_RETENTION_DAYS.
+
+    :return: The number of rows deleted.
+    """
+    cutoff = datetime.date.today() - datetime.timedelta(
+        days=INSTALLED_BASE_RETENTION_DAYS
+    )
+    deleted = session.execute(
+        delete(SnapInstalledBase).where(SnapInstalledBase.day < cutoff)
+    ).rowcount
+    logger.info(f"Deleted {deleted} expired installed base rows.")
+    return deleted
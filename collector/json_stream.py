@@ -0,0 +1,74 @@
+import json
+from typing import Iterable, Iterator
+
+_decoder = json.JSONDecoder()
+
+_SEPARATORS = " \t\n\r,"
+
+# Decoded text is dropped from the buffer once this many characters of it
+# have been consumed
+_COMPACT_THRESHOLD = 1 << 16
+
+
+def iter_array_items(
+    chunks: Iterable[str], key: str, document: dict
+) -> Iterator:
+    """
+    Incrementally decodes the items of the array stored under `key` in a
+    JSON document received as a sequence of text chunks.
+
+    Only the item being decoded and the current chunk are held in memory.
+    Once the array has been consumed, the rest of the document (with the
+    array left empty) is parsed into `document`.
+
+    :param chunks: The JSON document, as an iterable of text chunks.
+    :param key: The key of the array to stream, which must be the first
+                occurrence of that key in the document.
+    :param document: A dict updated with the rest of the document.
+    :return: An iterator over the decoded array items.
+    """
+    chunks = iter(chunks)
+    marker = json.dumps(key)
+    buffer = ""
+
+    while True:
+        start = buffer.find(marker)
+        bracket = buffer.find("[", start + len(marker)) if start != -1 else -1
+        if bracket != -1:
+            break
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError(f"{key} not found in the document")
+        buffer += chunk
+
+    prefix = buffer[: bracket + 1]
+    buffer = buffer[bracket + 1 :]
+    position = 0
+
+    while True:
+        while position < len(buffer) and buffer[position] in _SEPARATORS:
+            position += 1
+
+        if position < len(buffer) and buffer[position] == "]":
+            suffix = buffer[position:] + "".join(chunks)
+            break
+
+        try:
+            if position == len(buffer):
+                raise json.JSONDecodeError("Incomplete item", buffer, position)
+            item, position = _decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+
+        yield item
+
+        if position > _COMPACT_THRESHOLD:
+            buffer = buffer[position:]
+            position = 0
+
+    document.update(json.loads(prefix + suffix))
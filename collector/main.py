@@ -7,6 +7,7 @@ from collector.collect import collect_initial_snap_data
 from collector.filter import filter_snaps_meeting_minimum_criteria
 from collector.extra_fields import fetch_extra_fields
 from collector.score import calculate_scores
+from collector.http_client import http_session
 from snaprecommend import db
 from config import MACAROON_ENV_PATH
 from snaprecommend.settings import get_setting, set_setting
@@ -63,12 +64,15 @@ def collect_data(force_update: bool = False):
 
     # TODO: don't repeat a step if it has already been done successfully
 
+    http_session.reset_stats()
+
     collect_initial_snap_data()
     filter_snaps_meeting_minimum_criteria()
     fetch_extra_fields()
     calculate_scores()
 
     logger.info("Data collection pipeline complete")
+    http_session.log_stats()
 
     set_setting("last_updated", datetime.now().isoformat())
 
@@ -88,6 +92,8 @@ def collector_service():
                 logger.error("snapstore macaroon secret not given. Quitting")
                 return
 
+            http_session.reset_stats()
+
             logger.info("Running initial data collection step...")
             collect_initial_snap_data()
 
@@ -108,6 +114,7 @@ def collector_service():
                 db.session.commit()
                 logger.info("Full data collection pipeline complete.")
 
+            http_session.log_stats()
             logger.info(f"Sleeping for {INITIAL_STEP_INTERVAL} seconds...")
             sleep(INITIAL_STEP_INTERVAL)
     except KeyboardInterrupt:
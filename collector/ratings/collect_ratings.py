@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import grpc
 from hashlib import sha256
@@ -6,33 +7,134 @@ from collector.ratings.generated import (
     ratings_features_user_pb2_grpc as ratings_features_user_grpc,
     ratings_features_app_pb2 as ratings_features_app,
     ratings_features_app_pb2_grpc as ratings_features_app_grpc,
+    ratings_features_chart_pb2 as ratings_features_chart,
+    ratings_features_chart_pb2_grpc as ratings_features_chart_grpc,
 )
 import os
+from typing import Awaitable, Iterable, Optional
 
 logger = logging.getLogger("ratings_collector")
 
 RATINGS_ADDRESS = os.getenv("FLASK_RATINGS_BACKEND")
+# Plaintext channel, for local services such as scripts/ratings_standin.py
+RATINGS_INSECURE = os.getenv("FLASK_RATINGS_INSECURE", "").lower() in (
+    "1",
+    "true",
+)
+# Maximum number of ratings requests in flight at once
+RATINGS_CONCURRENCY = int(os.getenv("FLASK_RATINGS_CONCURRENCY", 16))
+# Deadline in seconds of each ratings request
+RATINGS_TIMEOUT = float(os.getenv("FLASK_RATINGS_TIMEOUT", 10))
+
+# "bulk" to request the ratings of every snap by id, "chart" to take them
+# from the monthly charts and only request the snaps missing from them
+RATINGS_SOURCE = os.getenv("FLASK_RATINGS_SOURCE", "bulk")
 
 USER_ID = sha256(b"snaprecommend").hexdigest()
 
+CHART_TIMEFRAMES = {
+    "weekly": ratings_features_chart.TIMEFRAME_WEEK,
+    "monthly": ratings_features_chart.TIMEFRAME_MONTH,
+}
+
+
+def parse_chart_data(chart_data: Iterable) -> dict[str, dict]:
+    """
+    Maps a list of ChartData to rating data by snap id, containing
+    raw_rating and total_votes.
+    """
+    ratings_dict = {}
+    for data in chart_data:
+        if data.rating and data.rating.snap_id:
+            ratings_dict[data.rating.snap_id] = {
+                "raw_rating": data.raw_rating,
+                "total_votes": data.rating.total_votes,
+            }
+    return ratings_dict
+
+
+async def gather_bounded(
+    coroutines: Iterable[Awaitable], concurrency: int
+) -> list:
+    """
+    Awaits `coroutines` with at most `concurrency` of them running at once.
+
+    :return: Their results, in order.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(bounded(c) for c in coroutines))
 
-def ratings_login():
-    creds = grpc.ssl_channel_credentials()
-    with grpc.secure_channel(RATINGS_ADDRESS, creds) as channel:
-        stub = ratings_features_user_grpc.UserStub(channel)
 
+class RatingsClient:
+    """
+    An asyncio client of the ratings service keeping a single channel
+    open, so TLS is only negotiated once for all the requests of a
+    collector step and many requests can share it concurrently.
+
+    The auth token is cached until the service rejects it, then renewed
+    and the request retried once. The client must be created and used
+    within one event loop, as an async context manager to close the
+    channel when done.
+
+    :param insecure: Use a plaintext channel, RATINGS_INSECURE when None.
+    """
+
+    def __init__(
+        self,
+        address: str = None,
+        credentials=None,
+        timeout: float = RATINGS_TIMEOUT,
+        insecure: bool = None,
+    ):
+        address = address or RATINGS_ADDRESS
+        if RATINGS_INSECURE if insecure is None else insecure:
+            self.channel = grpc.aio.insecure_channel(address)
+        else:
+            self.channel = grpc.aio.secure_channel(
+                address, credentials or grpc.ssl_channel_credentials()
+            )
+        self.user_stub = ratings_features_user_grpc.UserStub(self.channel)
+        self.app_stub = ratings_features_app_grpc.AppStub(self.channel)
+        self.chart_stub = ratings_features_chart_grpc.ChartStub(self.channel)
+        self.timeout = timeout
+        self._token = None
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.channel.close()
+
+    async def login(self) -> Optional[str]:
+        """
+        Authenticates with the ratings service and caches the token.
+
+        :return: The token, or None when authentication failed.
+        """
         try:
             auth_request = ratings_features_user.AuthenticateRequest(
                 id=USER_ID
             )
 
-            auth_response = stub.Authenticate(auth_request)
+            auth_response = await self.user_stub.Authenticate(
+                auth_request, timeout=self.timeout
+            )
             token = auth_response.token
 
             if not token:
                 logger.error("Authentication failed: Did not receive a token.")
                 return
             logger.info("Successfully authenticated with ratings service.")
+            self._token = token
             return token
         except grpc.RpcError as e:
             logger.error(
@@ -41,50 +143,72 @@ def ratings_login():
         except Exception as e:
             logger.error(f"Unexpected error during authentication: {e}")
 
+    async def get_token(self) -> str:
+        """
+        Returns the cached token, authenticating first if there is none.
+        Concurrent callers wait for a single authentication.
 
-def get_ratings(snap_ids: list[str], token: str) -> dict[str, dict]:
-    """
-    Fetches ratings for a list of snap IDs from the ratings service.
-    Returns a dictionary mapping snap IDs to rating data containing
-    raw_rating and total_votes.
-    """
-    if not snap_ids:
-        return {}
+        :raises ValueError: If authentication failed.
+        """
+        async with self._lock:
+            token = self._token or await self.login()
+        if not token:
+            logger.error("Failed to authenticate with ratings service")
+            raise ValueError("Authentication token is required")
+        return token
 
-    # First authenticate to get the token
-    if not token:
-        logger.error("Failed to authenticate with ratings service")
-        raise ValueError("Authentication token is required")
-
-    creds = grpc.ssl_channel_credentials()
-    with grpc.secure_channel(RATINGS_ADDRESS, creds) as channel:
-        stub = ratings_features_app_grpc.AppStub(channel)
+    def invalidate_token(self, token: str):
+        """
+        Drops `token` from the cache, unless it was already renewed.
+        """
+        if self._token == token:
+            self._token = None
 
+    async def call(self, method, request):
+        """
+        Calls the RPC `method` of a stub with the auth token and the
+        client's deadline, renewing the token and retrying once if the
+        service rejects it.
+        """
+        token = await self.get_token()
         try:
-            # Create metadata with the authentication token
-            metadata = [("authorization", f"Bearer {token}")]
-
-            # Create the bulk ratings request
-            bulk_request = ratings_features_app.GetBulkRatingsRequest(
-                snap_ids=snap_ids
+            return await method(
+                request,
+                metadata=[("authorization", f"Bearer {token}")],
+                timeout=self.timeout,
             )
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.UNAUTHENTICATED:
+                raise
+            logger.info("Ratings service token rejected, authenticating.")
+            self.invalidate_token(token)
+            token = await self.get_token()
+            return await method(
+                request,
+                metadata=[("authorization", f"Bearer {token}")],
+                timeout=self.timeout,
+            )
+
+    async def get_ratings(self, snap_ids: list[str]) -> dict[str, dict]:
+        """
+        Fetches ratings for a list of snap IDs from the ratings service.
+        Returns a dictionary mapping snap IDs to rating data containing
+        raw_rating and total_votes.
+        """
+        if not snap_ids:
+            return {}
 
-            # Make the gRPC call
-            bulk_response = stub.GetBulkRatings(
-                bulk_request, metadata=metadata
+        # Fails before the request when the service can't be authenticated
+        await self.get_token()
+
+        try:
+            bulk_response = await self.call(
+                self.app_stub.GetBulkRatings,
+                ratings_features_app.GetBulkRatingsRequest(snap_ids=snap_ids),
             )
 
-            # Process the response into the expected format
-            ratings_dict = {}
-            for chart_data in bulk_response.ratings:
-                if chart_data.rating and chart_data.rating.snap_id:
-                    snap_id = chart_data.rating.snap_id
-                    ratings_dict[snap_id] = {
-                        "raw_rating": chart_data.raw_rating,
-                        "total_votes": chart_data.rating.total_votes,
-                    }
-
-            logger.info(
+            ratings_dict = parse_chart_data(bulk_response.ratings)
+            logger.debug(
                 f"Successfully fetched ratings for {len(ratings_dict)} snaps"
             )
             return ratings_dict
@@ -98,3 +222,164 @@ def get_ratings(snap_ids: list[str], token: str) -> dict[str, dict]:
         except Exception as e:
             logger.error(f"Unexpected error during bulk ratings fetch: {e}")
             return {}
+
+    async def get_all_ratings(
+        self,
+        snap_ids: list[str],
+        batch_size: int,
+        concurrency: int = RATINGS_CONCURRENCY,
+    ) -> dict[str, dict]:
+        """
+        Fetches ratings for any number of snaps, in batches of
+        `batch_size` with up to `concurrency` batches in flight.
+
+        :return: The ratings of every batch merged into a single dict.
+        """
+        # Authenticate once rather than in every batch
+        await self.get_token()
+
+        results = await gather_bounded(
+            (
+                self.get_ratings(snap_ids[i : i + batch_size])
+                for i in range(0, len(snap_ids), batch_size)
+            ),
+            concurrency,
+        )
+
+        ratings_dict = {}
+        for batch_ratings in results:
+            ratings_dict.update(batch_ratings)
+        logger.info(
+            f"Successfully fetched ratings for {len(ratings_dict)} snaps"
+        )
+        return ratings_dict
+
+    async def get_chart(
+        self, timeframe: int, category: int
+    ) -> Optional[dict[str, dict]]:
+        """
+        Fetches the chart of a category over a timeframe.
+
+        :return: The ratings of the snaps in the chart by snap id, None
+                 when the request failed.
+        """
+        try:
+            chart_response = await self.call(
+                self.chart_stub.GetChart,
+                ratings_features_chart.GetChartRequest(
+                    timeframe=timeframe, category=category
+                ),
+            )
+            return parse_chart_data(chart_response.ordered_chart_data)
+        except grpc.RpcError as e:
+            logger.error(
+                f"gRPC error during chart fetch: {e.code()} - {e.details()}"
+            )
+            return None
+
+    async def get_charts(
+        self, concurrency: int = RATINGS_CONCURRENCY
+    ) -> tuple[dict[str, dict[str, dict]], set[tuple[str, int]]]:
+        """
+        Fetches the charts of every category for each of CHART_TIMEFRAMES,
+        with up to `concurrency` requests in flight.
+
+        :return: The ratings of the snaps in any chart of a timeframe, by
+                 timeframe name and snap id, and the (timeframe name,
+                 category) of the charts that could not be fetched.
+        """
+        await self.get_token()
+
+        chart_requests = [
+            (name, timeframe, category)
+            for name, timeframe in CHART_TIMEFRAMES.items()
+            for category in ratings_features_chart.Category.values()
+        ]
+        results = await gather_bounded(
+            (
+                self.get_chart(timeframe, category)
+                for _, timeframe, category in chart_requests
+            ),
+            concurrency,
+        )
+
+        charts = {name: {} for name in CHART_TIMEFRAMES}
+        failed = set()
+        for (name, _, category), chart in zip(chart_requests, results):
+            if chart is None:
+                failed.add((name, category))
+            else:
+                charts[name].update(chart)
+        if failed:
+            logger.warning(f"{len(failed)} ratings charts could not be fetched.")
+        return charts, failed
+
+    async def get_chart_ratings(
+        self,
+        snap_ids: list[str],
+        batch_size: int,
+        concurrency: int = RATINGS_CONCURRENCY,
+    ) -> tuple[
+        dict[str, dict], dict[str, dict[str, dict]], set[tuple[str, int]]
+    ]:
+        """
+        Rates `snap_ids` from the monthly charts of every category, only
+        requesting the bulk ratings of the snaps missing from them.
+
+        :return: The ratings by snap id, and the charts and failed charts
+                 as returned by `get_charts`.
+        """
+        charts, failed = await self.get_charts(concurrency)
+        monthly = charts["monthly"]
+
+        ratings_dict = {
+            snap_id: monthly[snap_id] for snap_id in snap_ids if snap_id in monthly
+        }
+        missing = [snap_id for snap_id in snap_ids if snap_id not in monthly]
+        logger.info(
+            f"{len(ratings_dict)} snaps rated from the charts, "
+            f"requesting {len(missing)} more."
+        )
+        if missing:
+            ratings_dict.update(
+                await self.get_all_ratings(missing, batch_size, concurrency)
+            )
+        return ratings_dict, charts, failed
+
+
+def fetch_ratings(
+    snap_ids: list[str],
+    batch_size: int,
+    concurrency: int = RATINGS_CONCURRENCY,
+) -> dict[str, dict]:
+    """
+    Fetches ratings for `snap_ids` with `RatingsClient.get_all_ratings`,
+    blocking until every batch is done.
+    """
+
+    async def fetch():
+        async with RatingsClient() as client:
+            return await client.get_all_ratings(
+                snap_ids, batch_size, concurrency
+            )
+
+    return asyncio.run(fetch())
+
+
+def fetch_chart_ratings(
+    snap_ids: list[str],
+    batch_size: int,
+    concurrency: int = RATINGS_CONCURRENCY,
+) -> tuple[dict[str, dict], dict[str, dict[str, dict]], set[tuple[str, int]]]:
+    """
+    Fetches ratings for `snap_ids` with `RatingsClient.get_chart_ratings`,
+    blocking until every request is done.
+    """
+
+    async def fetch():
+        async with RatingsClient() as client:
+            return await client.get_chart_ratings(
+                snap_ids, batch_size, concurrency
+            )
+
+    return asyncio.run(fetch())
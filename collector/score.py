@@ -1,6 +1,5 @@
 from datetime import datetime, timedelta
-from collections import Counter
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, load_only
 from sqlalchemy import func
 from snaprecommend.models import (
     Snap,
@@ -18,6 +17,18 @@ from math import log1p, ceil, inf
 
 logger = logging.getLogger("scorer")
 
+SCORE_COLUMNS = (
+    Snap.snap_id,
+    Snap.active_devices,
+    Snap.last_updated,
+    Snap.raw_rating,
+    Snap.developer_validation,
+    Snap.link_count,
+    Snap.license_set,
+) + tuple(
+    getattr(Snap, f"{media_type}_count") for media_type in ALL_MEDIA_TYPES
+)
+
 
 def normalize_field(session: Session, field: str, filter_condition=None):
     query = session.query(func.min(field), func.max(field))
@@ -44,21 +55,19 @@ def log_scale(value, min_value, max_value):
 def calculate_media_score(snap: Snap):
     """Calculate the media quality score for a snap."""
 
-    media_types = [item["type"] for item in snap.media]
-    media_counter = Counter(media_types)
-
-    return sum(media_counter[media_type] for media_type in ALL_MEDIA_TYPES) / (
-        len(ALL_MEDIA_TYPES) * 2
+    media_count = sum(
+        getattr(snap, f"{media_type}_count") or 0
+        for media_type in ALL_MEDIA_TYPES
     )
 
+    return media_count / (len(ALL_MEDIA_TYPES) * 2)
+
 
 def calculate_metadata_score(snap: Snap):
     """Calculate the metadata quality score for a snap."""
     MAX_LINKS = 5
-    num_of_links = min(
-        MAX_LINKS, sum(1 for link in snap.links.values() if link)
-    )
-    set_license = snap.license != "unset"
+    num_of_links = min(MAX_LINKS, snap.link_count or 0)
+    set_license = bool(snap.license_set)
     media_quality = min(1.0, calculate_media_score(snap))  # Clamp to max 1.0
     links_quality = (set_license + num_of_links) / (
         MAX_LINKS + 1
@@ -125,7 +134,11 @@ def calculate_category_scores():
 
     session = db.session
 
-    filter_condition = Snap.reaches_min_threshold.is_(True) & Snap.excluded.is_(False)
+    filter_condition = (
+        Snap.reaches_min_threshold.is_(True)
+        & Snap.excluded.is_(False)
+        & Snap.delisted_at.is_(None)
+    )
 
     min_active_devices, max_active_devices = normalize_field(
         session, Snap.active_devices, filter_condition=filter_condition
@@ -134,7 +147,13 @@ def calculate_category_scores():
         session, Snap.last_updated, filter_condition=filter_condition
     )
 
-    snaps = session.query(Snap).filter(filter_condition).all()
+    # Scoring only needs scalar columns, the JSON ones are never loaded
+    snaps = (
+        session.query(Snap)
+        .options(load_only(*SCORE_COLUMNS))
+        .filter(filter_condition)
+        .all()
+    )
 
     snap_scores = []
     for snap in snaps:
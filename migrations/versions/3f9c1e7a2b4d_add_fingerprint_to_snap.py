@@ -0,0 +1,26 @@
+"""Add fingerprint to snap
+
+Revision ID: 3f9c1e7a2b4d
+Revises: b2c3d4e5f6a7
+Create Date: 2026-10-18 09:12:41.503218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c1e7a2b4d'
+down_revision = 'b2c3d4e5f6a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('snap', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fingerprint', sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('snap', schema=None) as batch_op:
+        batch_op.drop_column('fingerprint')
@@ -0,0 +1,69 @@
+"""Add derived metadata columns to snap
+
+Revision ID: 5c7e2f9a1d38
+Revises: 8e4d2a6c9f13
+Create Date: 2026-10-18 11:26:42.519307
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c7e2f9a1d38'
+down_revision = '8e4d2a6c9f13'
+branch_labels = None
+depends_on = None
+
+MEDIA_TYPES = ['icon', 'screenshot', 'video', 'banner', 'logo']
+
+INTEGER_COLUMNS = ['media_count'] + [
+    f'{media_type}_count' for media_type in MEDIA_TYPES
+] + ['link_count', 'description_length']
+
+BOOLEAN_COLUMNS = [
+    'has_icon', 'has_contact_link', 'has_issues_link', 'license_set'
+]
+
+
+def non_empty(value):
+    return (
+        f"CASE WHEN {value} IS NULL OR json_typeof({value}) = 'null' "
+        f"THEN false WHEN json_typeof({value}) = 'array' "
+        f"THEN json_array_length({value}) > 0 ELSE true END"
+    )
+
+
+def upgrade():
+    with op.batch_alter_table('snap', schema=None) as batch_op:
+        for name in INTEGER_COLUMNS:
+            batch_op.add_column(sa.Column(name, sa.Integer(), nullable=True))
+        for name in BOOLEAN_COLUMNS:
+            batch_op.add_column(sa.Column(name, sa.Boolean(), nullable=True))
+
+    # Backfill existing snaps, the collect step keeps them up to date
+    media_type_counts = ', '.join(
+        f"{media_type}_count = (SELECT count(*) FROM "
+        f"json_array_elements(media) AS m WHERE m->>'type' = '{media_type}')"
+        for media_type in MEDIA_TYPES
+    )
+    op.execute(f"""
+        UPDATE snap SET
+            media_count = coalesce(json_array_length(media), 0),
+            {media_type_counts},
+            has_icon = icon IS NOT NULL,
+            link_count = (
+                SELECT count(*) FROM json_each(links) AS l
+                WHERE {non_empty('l.value')}
+            ),
+            has_contact_link = {non_empty("links->'contact'")},
+            has_issues_link = {non_empty("links->'issues'")},
+            description_length = coalesce(length(description), 0),
+            license_set = license IS DISTINCT FROM 'unset'
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('snap', schema=None) as batch_op:
+        for name in reversed(INTEGER_COLUMNS + BOOLEAN_COLUMNS):
+            batch_op.drop_column(name)
@@ -0,0 +1,26 @@
+"""Add delisted_at to snap
+
+Revision ID: 8e4d2a6c9f13
+Revises: 3f9c1e7a2b4d
+Create Date: 2026-10-18 10:03:17.228940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4d2a6c9f13'
+down_revision = '3f9c1e7a2b4d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('snap', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('delisted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('snap', schema=None) as batch_op:
+        batch_op.drop_column('delisted_at')
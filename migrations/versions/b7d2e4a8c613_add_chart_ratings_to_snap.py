@@ -0,0 +1,38 @@
+"""Add chart rating columns to snap
+
+Revision ID: b7d2e4a8c613
+Revises: f3b8c1d5e29a
+Create Date: 2026-10-18 15:02:37.416820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e4a8c613'
+down_revision = 'f3b8c1d5e29a'
+branch_labels = None
+depends_on = None
+
+TIMEFRAMES = ['weekly', 'monthly']
+
+
+def upgrade():
+    with op.batch_alter_table('snap', schema=None) as batch_op:
+        for timeframe in TIMEFRAMES:
+            batch_op.add_column(
+                sa.Column(f'{timeframe}_raw_rating', sa.Float(), nullable=True)
+            )
+            batch_op.add_column(
+                sa.Column(
+                    f'{timeframe}_total_votes', sa.Integer(), nullable=True
+                )
+            )
+
+
+def downgrade():
+    with op.batch_alter_table('snap', schema=None) as batch_op:
+        for timeframe in reversed(TIMEFRAMES):
+            batch_op.drop_column(f'{timeframe}_total_votes')
+            batch_op.drop_column(f'{timeframe}_raw_rating')
@@ -0,0 +1,49 @@
+"""Store snap JSON columns as JSONB and index categories
+
+Revision ID: d4a91b6e7c25
+Revises: 5c7e2f9a1d38
+Create Date: 2026-10-18 12:08:51.664102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a91b6e7c25'
+down_revision = '5c7e2f9a1d38'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ['links', 'media', 'categories']
+
+
+def upgrade():
+    with op.batch_alter_table('snap', schema=None) as batch_op:
+        for name in COLUMNS:
+            batch_op.alter_column(
+                name,
+                existing_type=sa.JSON(),
+                type_=postgresql.JSONB(astext_type=sa.Text()),
+                postgresql_using=f'{name}::jsonb',
+            )
+        batch_op.create_index(
+            'ix_snap_categories',
+            ['categories'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={'categories': 'jsonb_path_ops'},
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('snap', schema=None) as batch_op:
+        batch_op.drop_index('ix_snap_categories')
+        for name in COLUMNS:
+            batch_op.alter_column(
+                name,
+                existing_type=postgresql.JSONB(astext_type=sa.Text()),
+                type_=sa.JSON(),
+                postgresql_using=f'{name}::json',
+            )
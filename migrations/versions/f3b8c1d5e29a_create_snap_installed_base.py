@@ -0,0 +1,33 @@
+"""Create snap_installed_base table
+
+Revision ID: f3b8c1d5e29a
+Revises: d4a91b6e7c25
+Create Date: 2026-10-18 13:41:09.802113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8c1d5e29a'
+down_revision = 'd4a91b6e7c25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "snap_installed_base",
+        sa.Column("snap_id", sa.String(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("installed_base", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["snap_id"], ["snap.snap_id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("snap_id", "day"),
+    )
+
+
+def downgrade():
+    op.drop_table("snap_installed_base")
@@ -0,0 +1,70 @@
+"""
+Compares the batched active devices extraction of the extra fields step
+with the per-snap implementation it replaced, on synthetic metrics
+responses from scripts/store_api_standin.py.
+
+Usage: python -m scripts.benchmark_active_devices [snaps] [series] [days]
+"""
+import copy
+import sys
+from timeit import repeat
+from scripts.store_api_standin import synthetic_metrics
+
+
+def legacy_latest_active_devices(metrics_data: dict) -> int:
+    """
+    The previous `calculate_latest_active_devices`, which sorts the series
+    and replaces missing values in place.
+    """
+    latest_active_devices = 0
+    metrics_data["series"] = sorted(
+        metrics_data["series"], key=lambda x: x["name"]
+    )
+
+    for series_index, series in enumerate(metrics_data["series"]):
+        for index, value in enumerate(series["values"]):
+            if value is None:
+                metrics_data["series"][series_index]["values"][index] = 0
+        values = series["values"]
+        if len(values) == len(metrics_data["buckets"]):
+            for i in range(len(values) - 1, -1, -1):
+                if values[i] != 0:
+                    latest_active_devices += values[i]
+                    break
+
+    return latest_active_devices
+
+
+def best_of(function, repeats: int = 5) -> float:
+    return min(repeat(function, number=1, repeat=repeats))
+
+
+if __name__ == "__main__":
+    snaps = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    series = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    days = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+
+    # The app has to be created before the collector modules are imported
+    from snaprecommend import app  # noqa: F401
+    from collector.extra_fields import latest_active_devices
+
+    start, end = "2026-09-01", f"2026-09-{days:02d}"
+    metrics = [
+        synthetic_metrics(f"snap-{index}", start, end, series)
+        for index in range(snaps)
+    ]
+    # The legacy implementation mutates its input, so each run gets a copy
+    copies = [copy.deepcopy(metrics) for _ in range(6)]
+
+    expected = [legacy_latest_active_devices(m) for m in copies.pop()]
+    assert latest_active_devices(metrics) == expected
+
+    legacy = best_of(
+        lambda: [legacy_latest_active_devices(m) for m in copies.pop()]
+    )
+    batched = best_of(lambda: latest_active_devices(metrics))
+    print(
+        f"{snaps} snaps, {series} series, {days} days: "
+        f"legacy {legacy * 1000:.1f} ms, batched {batched * 1000:.1f} ms "
+        f"({legacy / batched:.1f}x)"
+    )
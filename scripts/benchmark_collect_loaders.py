@@ -0,0 +1,50 @@
+"""
+Benchmarks the collect step loaders ("upsert" and "copy") against the
+database configured in POSTGRESQL_DB_CONNECT_STRING.
+
+Synthetic snaps from scripts/store_api_standin.py are written with a
+"standin-" snap_id prefix and deleted afterwards. Only run this against a
+development database.
+
+Usage: python -m scripts.benchmark_collect_loaders [snaps] [page size]
+"""
+import sys
+from time import perf_counter
+from snaprecommend import app, db
+from snaprecommend.models import Snap
+from collector.collect import insert_snaps
+from scripts.store_api_standin import SNAP_ID_PREFIX, synthetic_pages
+
+
+def delete_benchmark_snaps():
+    db.session.query(Snap).filter(
+        Snap.snap_id.startswith(SNAP_ID_PREFIX)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def run(loader: str, snaps: int, page_size: int):
+    delete_benchmark_snaps()
+    for label, revision in (("insert", 1), ("unchanged", 1), ("changed", 2)):
+        start = perf_counter()
+        insert_snaps(
+            pipeline_depth=0,
+            loader=loader,
+            pages=synthetic_pages(snaps, page_size, revision),
+            sweep=False,
+        )
+        elapsed = perf_counter() - start
+        print(
+            f"{loader:>6} {label:>9}: {elapsed:8.2f}s "
+            f"({snaps / elapsed:,.0f} snaps/s)"
+        )
+    delete_benchmark_snaps()
+
+
+if __name__ == "__main__":
+    snaps = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    with app.app_context():
+        for loader in ("upsert", "copy"):
+            run(loader, snaps, page_size)
@@ -0,0 +1,92 @@
+"""
+Measures the collector pipeline end to end against the local store API
+stand-in (scripts/store_api_standin.py), by default for catalogs of 10k,
+50k and 200k snaps.
+
+Each run empties the snap table of the database configured in
+POSTGRESQL_DB_CONNECT_STRING first: only run this against a disposable
+database.
+
+Usage: python -m scripts.benchmark_pipeline [snaps ...] [--latency SECONDS]
+    [--error-rate RATE] [--series N] [--port PORT]
+"""
+import argparse
+import os
+from time import perf_counter
+from scripts.store_api_standin import StoreAPIStandIn
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "snaps", type=int, nargs="*", default=[10000, 50000, 200000]
+    )
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--series", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8090)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # The collector reads its API URLs when it is imported
+    standin_url = f"http://127.0.0.1:{args.port}"
+    os.environ["FLASK_COLLECTOR_STORE_API_URL"] = standin_url
+    os.environ["FLASK_COLLECTOR_DASHBOARD_API_URL"] = standin_url
+
+    from snaprecommend import app, db
+    from snaprecommend.models import Snap
+    from snaprecommend.settings import set_setting
+    from collector.collect import (
+        collect_initial_snap_data,
+        COLLECT_CHECKPOINT_KEY,
+    )
+    from collector.filter import filter_snaps_meeting_minimum_criteria
+    from collector.extra_fields import update_snap_metrics
+    from collector.score import calculate_scores
+    from collector.http_client import http_session
+
+    steps = (
+        ("collect", collect_initial_snap_data),
+        ("filter", filter_snaps_meeting_minimum_criteria),
+        ("metrics", update_snap_metrics),
+        ("score", calculate_scores),
+    )
+
+    with app.app_context():
+        for snaps in args.snaps:
+            db.session.query(Snap).delete()
+            set_setting(COLLECT_CHECKPOINT_KEY, None)
+            # Start every catalog cold: pages of the previous catalog would
+            # be revalidated as not modified, and its keep-alive
+            # connections still be answered by the previous stand-in
+            http_session.forget()
+            http_session.close()
+            http_session.reset_stats()
+
+            standin = StoreAPIStandIn(
+                snaps=snaps,
+                latency=args.latency,
+                error_rate=args.error_rate,
+                series=args.series,
+                port=args.port,
+            )
+            standin.start()
+            try:
+                timings = []
+                for name, step in steps:
+                    start = perf_counter()
+                    step()
+                    timings.append((name, perf_counter() - start))
+            finally:
+                standin.stop()
+
+            total = sum(seconds for _, seconds in timings)
+            print(
+                f"{snaps:>7} snaps: {total:8.2f}s total ("
+                + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings)
+                + f"), {standin.requests} requests"
+            )
+            http_session.log_stats()
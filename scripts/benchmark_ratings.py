@@ -0,0 +1,71 @@
+"""
+Times ratings collection against the local ratings service stand-in
+(scripts/ratings_standin.py), requesting every snap by id ("bulk") and
+from the charts with a bulk fallback ("chart").
+
+Usage: python -m scripts.benchmark_ratings [snaps] [--latency SECONDS]
+    [--snap-latency SECONDS] [--error-rate RATE] [--batch-size N]
+    [--concurrency N ...]
+"""
+import argparse
+import asyncio
+from time import perf_counter
+from collector.ratings.collect_ratings import RatingsClient
+from scripts.ratings_standin import RatingsStandIn
+from scripts.store_api_standin import SNAP_ID_PREFIX
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("snaps", type=int, nargs="?", default=100000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--snap-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 16, 64]
+    )
+    return parser.parse_args()
+
+
+async def collect(address: str, source: str, snap_ids, batch_size, concurrency):
+    async with RatingsClient(address, insecure=True) as client:
+        if source == "chart":
+            ratings, _, _ = await client.get_chart_ratings(
+                snap_ids, batch_size, concurrency
+            )
+            return ratings
+        return await client.get_all_ratings(snap_ids, batch_size, concurrency)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    standin = RatingsStandIn(
+        snaps=args.snaps,
+        latency=args.latency,
+        snap_latency=args.snap_latency,
+        error_rate=args.error_rate,
+    )
+    address = standin.start()
+    snap_ids = [f"{SNAP_ID_PREFIX}{index:08d}" for index in range(args.snaps)]
+
+    try:
+        for source in ("bulk", "chart"):
+            for concurrency in args.concurrency:
+                standin.calls.clear()
+                start = perf_counter()
+                ratings = asyncio.run(
+                    collect(
+                        address, source, snap_ids, args.batch_size, concurrency
+                    )
+                )
+                elapsed = perf_counter() - start
+                print(
+                    f"{source:>5} x{concurrency:<3}: {elapsed:7.2f}s "
+                    f"({len(snap_ids) / elapsed:,.0f} snaps/s), "
+                    f"{len(ratings)} rated, "
+                    f"{sum(standin.calls.values())} calls"
+                )
+    finally:
+        standin.stop()
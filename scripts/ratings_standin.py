@@ -0,0 +1,290 @@
+"""
+A local stand-in for the ratings service used by the collector, for
+benchmarks and offline testing.
+
+It implements the User (Authenticate only), App and Chart gRPC services
+of the vendored protos over a plaintext channel. Ratings are generated
+deterministically for a synthetic catalog of snaps with the snap ids of
+scripts/store_api_standin.py. Latency, failures and token expiry are
+configurable.
+
+Usage:
+    python -m scripts.ratings_standin [--snaps N] [--rated-share RATE]
+        [--chart-size N] [--latency SECONDS] [--snap-latency SECONDS]
+        [--error-rate RATE] [--token-max-uses N] [--port PORT]
+
+Point the collector at a running stand-in with:
+    FLASK_RATINGS_BACKEND=127.0.0.1:50051
+    FLASK_RATINGS_INSECURE=true
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import grpc
+from collector.ratings.generated import (
+    ratings_features_app_pb2 as ratings_features_app,
+    ratings_features_app_pb2_grpc as ratings_features_app_grpc,
+    ratings_features_chart_pb2 as ratings_features_chart,
+    ratings_features_chart_pb2_grpc as ratings_features_chart_grpc,
+    ratings_features_common_pb2 as ratings_features_common,
+    ratings_features_user_pb2 as ratings_features_user,
+    ratings_features_user_pb2_grpc as ratings_features_user_grpc,
+)
+from scripts.store_api_standin import SNAP_ID_PREFIX
+
+# Share of a snap's votes cast within each chart timeframe
+TIMEFRAME_SHARES = {
+    ratings_features_chart.TIMEFRAME_WEEK: 0.05,
+    ratings_features_chart.TIMEFRAME_MONTH: 0.2,
+}
+
+
+def synthetic_rating(index: int, rated_share: float):
+    """
+    Returns the (raw_rating, total_votes) of the `index`th synthetic snap,
+    or None when it has no votes.
+    """
+    rng = random.Random(f"rating-{index}")
+    if rng.random() >= rated_share:
+        return None
+    return rng.random(), int(rng.paretovariate(1.2) * 5)
+
+
+class RatingsStandIn:
+    """
+    Serves the User, App and Chart services on a background thread pool.
+
+    :param snaps: Number of snaps in the synthetic catalog.
+    :param rated_share: Share of the snaps with votes.
+    :param chart_size: Number of snaps per category chart.
+    :param latency: Seconds added to every call.
+    :param snap_latency: Seconds added to GetBulkRatings calls per snap.
+    :param error_rate: Share of calls failing with UNAVAILABLE.
+    :param token_max_uses: Calls a token is accepted for before it is
+                           rejected as UNAUTHENTICATED, 0 for no limit.
+    """
+
+    def __init__(
+        self,
+        snaps: int = 10000,
+        rated_share: float = 0.7,
+        chart_size: int = 100,
+        latency: float = 0.0,
+        snap_latency: float = 0.0,
+        error_rate: float = 0.0,
+        token_max_uses: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        workers: int = 32,
+        seed: int = 0,
+    ):
+        self.snaps = snaps
+        self.rated_share = rated_share
+        self.chart_size = chart_size
+        self.latency = latency
+        self.snap_latency = snap_latency
+        self.error_rate = error_rate
+        self.token_max_uses = token_max_uses
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._token_uses = {}
+        self._charts = self._build_charts()
+
+        self._server = grpc.server(ThreadPoolExecutor(max_workers=workers))
+        ratings_features_user_grpc.add_UserServicer_to_server(
+            self._user_servicer(), self._server
+        )
+        ratings_features_app_grpc.add_AppServicer_to_server(
+            self._app_servicer(), self._server
+        )
+        ratings_features_chart_grpc.add_ChartServicer_to_server(
+            self._chart_servicer(), self._server
+        )
+        self.port = self._server.add_insecure_port(f"{host}:{port}")
+        self.host = host
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def start(self) -> str:
+        self._server.start()
+        return self.address
+
+    def stop(self):
+        self._server.stop(grace=None)
+
+    def rating(self, snap_id: str):
+        """
+        Returns the (raw_rating, total_votes) of a snap id of the catalog,
+        or None for unknown and unrated snaps.
+        """
+        if not snap_id.startswith(SNAP_ID_PREFIX):
+            return None
+        try:
+            index = int(snap_id[len(SNAP_ID_PREFIX) :])
+        except ValueError:
+            return None
+        if index >= self.snaps:
+            return None
+        return synthetic_rating(index, self.rated_share)
+
+    def _build_charts(self) -> dict:
+        """
+        Ranks the rated snaps of each category (snaps are spread over the
+        categories by index) by their votes in each timeframe.
+        """
+        categories = ratings_features_chart.Category.values()
+        by_category = {category: [] for category in categories}
+        for index in range(self.snaps):
+            rating = synthetic_rating(index, self.rated_share)
+            if rating:
+                category = categories[index % len(categories)]
+                by_category[category].append(
+                    (f"{SNAP_ID_PREFIX}{index:08d}", *rating)
+                )
+
+        charts = {}
+        for timeframe, share in TIMEFRAME_SHARES.items():
+            for category, ratings in by_category.items():
+                chart = [
+                    (snap_id, raw_rating, int(total_votes * share))
+                    for snap_id, raw_rating, total_votes in ratings
+                ]
+                chart = [entry for entry in chart if entry[2] > 0]
+                chart.sort(key=lambda entry: (-entry[2], entry[0]))
+                charts[timeframe, category] = chart[: self.chart_size]
+        return charts
+
+    def before_call(self, method: str, context, authenticated: bool = True):
+        """
+        Counts a call and applies the configured latency, failures and
+        token checks, aborting the call when it should fail.
+        """
+        with self._lock:
+            self.calls[method] += 1
+            fail = self._rng.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "injected failure")
+        if not authenticated:
+            return
+
+        metadata = dict(context.invocation_metadata())
+        token = metadata.get("authorization", "").removeprefix("Bearer ")
+        with self._lock:
+            uses = self._token_uses.get(token)
+            if uses is not None:
+                self._token_uses[token] = uses + 1
+        if uses is None or (
+            self.token_max_uses and uses >= self.token_max_uses
+        ):
+            context.abort(grpc.StatusCode.UNAUTHENTICATED, "invalid token")
+
+    def chart_data(self, ratings) -> list:
+        return [
+            ratings_features_common.ChartData(
+                raw_rating=raw_rating,
+                rating=ratings_features_common.Rating(
+                    snap_id=snap_id, total_votes=total_votes
+                ),
+            )
+            for snap_id, raw_rating, total_votes in ratings
+        ]
+
+    def _user_servicer(self):
+        standin = self
+
+        class UserServicer(ratings_features_user_grpc.UserServicer):
+            def Authenticate(self, request, context):
+                standin.before_call("Authenticate", context, False)
+                with standin._lock:
+                    token = f"standin-token-{len(standin._token_uses)}"
+                    standin._token_uses[token] = 0
+                return ratings_features_user.AuthenticateResponse(
+                    token=token
+                )
+
+        return UserServicer()
+
+    def _app_servicer(self):
+        standin = self
+
+        class AppServicer(ratings_features_app_grpc.AppServicer):
+            def GetRating(self, request, context):
+                standin.before_call("GetRating", context)
+                rating = standin.rating(request.snap_id)
+                if not rating:
+                    return ratings_features_app.GetRatingResponse()
+                (chart_data,) = standin.chart_data(
+                    [(request.snap_id, *rating)]
+                )
+                return ratings_features_app.GetRatingResponse(
+                    rating=chart_data.rating
+                )
+
+            def GetBulkRatings(self, request, context):
+                standin.before_call("GetBulkRatings", context)
+                if standin.snap_latency:
+                    time.sleep(standin.snap_latency * len(request.snap_ids))
+                ratings = [
+                    (snap_id, *rating)
+                    for snap_id in request.snap_ids
+                    if (rating := standin.rating(snap_id))
+                ]
+                return ratings_features_app.GetBulkRatingsResponse(
+                    ratings=standin.chart_data(ratings)
+                )
+
+        return AppServicer()
+
+    def _chart_servicer(self):
+        standin = self
+
+        class ChartServicer(ratings_features_chart_grpc.ChartServicer):
+            def GetChart(self, request, context):
+                standin.before_call("GetChart", context)
+                chart = standin._charts.get(
+                    (request.timeframe, request.category), []
+                )
+                return ratings_features_chart.GetChartResponse(
+                    timeframe=request.timeframe,
+                    category=request.category,
+                    ordered_chart_data=standin.chart_data(chart),
+                )
+
+        return ChartServicer()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--snaps", type=int, default=10000)
+    parser.add_argument("--rated-share", type=float, default=0.7)
+    parser.add_argument("--chart-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--snap-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--token-max-uses", type=int, default=0)
+    parser.add_argument("--port", type=int, default=50051)
+    args = parser.parse_args()
+
+    standin = RatingsStandIn(
+        snaps=args.snaps,
+        rated_share=args.rated_share,
+        chart_size=args.chart_size,
+        latency=args.latency,
+        snap_latency=args.snap_latency,
+        error_rate=args.error_rate,
+        token_max_uses=args.token_max_uses,
+        port=args.port,
+    )
+    print(f"Serving ratings for {standin.snaps} snaps on {standin.start()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        standin.stop()
@@ -0,0 +1,384 @@
+"""
+A local stand-in for the store search API and the dashboard metrics API
+used by the collector, for benchmarks and offline testing.
+
+Search pages are generated from a deterministic synthetic catalog, or
+served from recorded fixtures (see the `record` command). Metrics are
+always synthetic. Latency, error injection and a rate limit on the
+metrics endpoint are configurable.
+
+Usage:
+    python -m scripts.store_api_standin serve [--snaps N] [--page-size N]
+        [--latency SECONDS] [--error-rate RATE] [--snap-latency SECONDS]
+        [--rate-limit N] [--series N] [--fixtures DIR] [--port PORT]
+    python -m scripts.store_api_standin record DIR [--pages N]
+
+Point the collector at a running stand-in with:
+    FLASK_COLLECTOR_STORE_API_URL=http://127.0.0.1:8090
+    FLASK_COLLECTOR_DASHBOARD_API_URL=http://127.0.0.1:8090
+"""
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SNAP_ID_PREFIX = "standin-"
+
+SEARCH_PATH = "/api/v1/snaps/search"
+METRICS_PATH = "/dev/api/snaps/metrics"
+
+SECTIONS = ["development", "games", "productivity", "utilities", "social"]
+
+
+def synthetic_snap(index: int, revision: int = 1) -> dict:
+    """
+    Returns a store search result for the `index`th synthetic snap.
+
+    Snaps vary deterministically with `index`, so that only part of the
+    catalog meets the collector's minimum criteria.
+    """
+    rng = random.Random(index)
+    last_updated = datetime.datetime(2026, 10, 1) - datetime.timedelta(
+        days=rng.randint(0, 720)
+    )
+    media = [
+        {"type": "screenshot", "url": f"https://example.com/{index}/{n}.png"}
+        for n in range(rng.randint(0, 4))
+    ]
+    if rng.random() < 0.8:
+        media.insert(
+            0, {"type": "icon", "url": f"https://example.com/{index}/icon.png"}
+        )
+    links = {"website": [f"https://example.com/{index}"]}
+    if rng.random() < 0.6:
+        links["contact"] = [f"mailto:snap-{index}@example.com"]
+    if rng.random() < 0.5:
+        links["issues"] = [f"https://example.com/{index}/issues"]
+
+    return {
+        "snap_id": f"{SNAP_ID_PREFIX}{index:08d}",
+        "package_name": f"standin-snap-{index}",
+        "last_updated": last_updated.isoformat() + "Z",
+        "date_published": "2024-01-01T00:00:00.000000Z",
+        "summary": f"Synthetic snap {index}",
+        "description": "A synthetic snap. " * rng.randint(0, 40),
+        "title": f"Synthetic snap {index}",
+        "version": f"1.{revision}.{rng.randint(0, 9)}",
+        "publisher": f"Publisher {index % 500}",
+        "revision": revision,
+        "links": links,
+        "media": media,
+        "developer_validation": rng.choice(
+            ["unproven", "unproven", "verified", "starred"]
+        ),
+        "license": rng.choice(["MIT", "GPL-3.0", "Apache-2.0", "unset"]),
+        "sections": [{"name": rng.choice(SECTIONS), "featured": False}],
+    }
+
+
+def synthetic_pages(snaps: int, page_size: int, revision: int = 1):
+    """
+    Yields (page number, list of snaps) tuples for a synthetic catalog.
+    """
+    for page, start in enumerate(range(0, snaps, page_size), start=1):
+        yield page, [
+            synthetic_snap(index, revision)
+            for index in range(start, min(start + page_size, snaps))
+        ]
+
+
+def synthetic_metrics(snap_id: str, start: str, end: str, series: int) -> dict:
+    """
+    Returns a weekly_installed_base_by_version metric for a snap, with
+    `series` version series over the requested days.
+    """
+    rng = random.Random(snap_id)
+    start_date = datetime.date.fromisoformat(start)
+    end_date = datetime.date.fromisoformat(end)
+    days = (end_date - start_date).days + 1
+    buckets = [
+        (start_date + datetime.timedelta(days=day)).isoformat()
+        for day in range(days)
+    ]
+    base = rng.randint(0, 100000)
+    return {
+        "buckets": buckets,
+        "metric_name": "weekly_installed_base_by_version",
+        "series": [
+            {
+                "name": f"1.{version}",
+                "values": [
+                    # Older versions fade out, the occasional gap is None
+                    None if rng.random() < 0.05
+                    else max(0, base // (version + 1) - day)
+                    for day in range(days)
+                ],
+            }
+            for version in range(series)
+        ],
+        "snap_id": snap_id,
+        "status": "OK",
+    }
+
+
+class StoreAPIStandIn:
+    """
+    Serves the search and metrics endpoints on a background thread.
+
+    :param snaps: Number of snaps in the synthetic catalog.
+    :param page_size: Number of snaps per search page.
+    :param latency: Seconds added to every response.
+    :param error_rate: Share of requests answered with a 503.
+    :param snap_latency: Seconds added to metrics responses per snap.
+    :param rate_limit: Metrics requests accepted per second, others are
+                       answered with a 429 and a Retry-After. 0 for no limit.
+    :param series: Number of version series per metrics response.
+    :param fixtures: Directory of recorded search pages to serve instead
+                     of the synthetic catalog.
+    """
+
+    def __init__(
+        self,
+        snaps: int = 10000,
+        page_size: int = 100,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        snap_latency: float = 0.0,
+        rate_limit: int = 0,
+        series: int = 5,
+        fixtures: str = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int = 0,
+    ):
+        self.snaps = snaps
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.snap_latency = snap_latency
+        self.rate_limit = rate_limit
+        self.series = series
+        self.fixtures = fixtures
+        self.pages = -(-snaps // page_size)
+        if fixtures:
+            self.pages = len(
+                [name for name in os.listdir(fixtures) if name.endswith(".json")]
+            )
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self._window = (0, 0)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            return self._rng.random() < self.error_rate
+
+    def is_rate_limited(self) -> bool:
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            second = int(time.time())
+            window, count = self._window
+            count = count + 1 if window == second else 1
+            self._window = (second, count)
+            if count > self.rate_limit:
+                self.rate_limited += 1
+                return True
+            return False
+
+    def search_page(self, page: int) -> dict:
+        if self.fixtures:
+            path = os.path.join(self.fixtures, f"search-{page:05d}.json")
+            with open(path) as f:
+                snaps = json.load(f)
+        else:
+            start = (page - 1) * self.page_size
+            snaps = [
+                synthetic_snap(index)
+                for index in range(
+                    start, min(start + self.page_size, self.snaps)
+                )
+            ]
+
+        links = {"self": {"href": f"{SEARCH_PATH}?page={page}"}}
+        if page < self.pages:
+            links["next"] = {"href": f"{SEARCH_PATH}?page={page + 1}"}
+        return {"_embedded": {"clickindex:package": snaps}, "_links": links}
+
+    def metrics(self, request_body: dict) -> dict:
+        return {
+            "metrics": [
+                synthetic_metrics(
+                    f["snap_id"], f["start"], f["end"], self.series
+                )
+                for f in request_body.get("filters", [])
+            ]
+        }
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(
+                self, status: int, data, etag: str = None, headers=None
+            ):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if etag:
+                    self.send_header("ETag", etag)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=1)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def before_response(self) -> bool:
+                if standin.latency:
+                    time.sleep(standin.latency)
+                if standin.should_fail():
+                    self.send_json(503, {"error": "injected failure"})
+                    return False
+                return True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != SEARCH_PATH:
+                    return self.send_json(404, {"error": "not found"})
+                if not self.before_response():
+                    return
+
+                page = int(parse_qs(url.query).get("page", ["1"])[0])
+                if page < 1 or page > standin.pages:
+                    return self.send_json(404, {"error": "page not found"})
+
+                data = standin.search_page(page)
+                etag = '"{}"'.format(
+                    hashlib.sha256(
+                        json.dumps(data, sort_keys=True).encode("utf-8")
+                    ).hexdigest()[:32]
+                )
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_json(200, data, etag)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request_body = json.loads(self.rfile.read(length) or b"{}")
+                if urlparse(self.path).path != METRICS_PATH:
+                    return self.send_json(404, {"error": "not found"})
+                if standin.is_rate_limited():
+                    return self.send_json(
+                        429,
+                        {"error": "rate limited"},
+                        headers={"Retry-After": "1"},
+                    )
+                if not self.before_response():
+                    return
+                if standin.snap_latency:
+                    filters = request_body.get("filters", [])
+                    time.sleep(standin.snap_latency * len(filters))
+                self.send_json(200, standin.metrics(request_body))
+
+        return Handler
+
+
+def record(directory: str, pages: int):
+    """
+    Records the first `pages` search pages of the real store API as
+    fixtures for `serve --fixtures`.
+    """
+    # The app has to be created before the collector modules are imported
+    from snaprecommend import app  # noqa: F401
+    from collector.collect import get_snap_page
+
+    os.makedirs(directory, exist_ok=True)
+    for page in range(1, pages + 1):
+        snaps, has_next = get_snap_page(page)
+        path = os.path.join(directory, f"search-{page:05d}.json")
+        with open(path, "w") as f:
+            json.dump(snaps, f)
+        print(f"Recorded page {page} with {len(snaps)} snaps")
+        if not has_next:
+            break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve")
+    serve_parser.add_argument("--snaps", type=int, default=10000)
+    serve_parser.add_argument("--page-size", type=int, default=100)
+    serve_parser.add_argument("--latency", type=float, default=0.0)
+    serve_parser.add_argument("--error-rate", type=float, default=0.0)
+    serve_parser.add_argument("--snap-latency", type=float, default=0.0)
+    serve_parser.add_argument("--rate-limit", type=int, default=0)
+    serve_parser.add_argument("--series", type=int, default=5)
+    serve_parser.add_argument("--fixtures")
+    serve_parser.add_argument("--port", type=int, default=8090)
+
+    record_parser = commands.add_parser("record")
+    record_parser.add_argument("directory")
+    record_parser.add_argument("--pages", type=int, default=10)
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.directory, args.pages)
+    else:
+        standin = StoreAPIStandIn(
+            snaps=args.snaps,
+            page_size=args.page_size,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            snap_latency=args.snap_latency,
+            rate_limit=args.rate_limit,
+            series=args.series,
+            fixtures=args.fixtures,
+            port=args.port,
+        )
+        print(f"Serving {standin.pages} pages on {standin.start()}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            standin.stop()
@@ -37,6 +37,13 @@ from collector.main import (
     fetch_extra_fields,
     calculate_scores,
 )
+from collector.filter import (
+    evaluate_filter_criteria,
+    get_filter_criteria,
+    set_filter_criteria,
+    validate_filter_criteria,
+)
+from snaprecommend import db
 
 api_blueprint = Blueprint("api", __name__)
 
@@ -125,8 +132,11 @@ def slice(id: str):
 def popular_snaps():
     limit = flask.request.args.get("limit", 10)
     category = flask.request.args.get("category")
+    section = flask.request.args.get("section")
 
-    popular_snaps = get_category_top_snaps(category, limit=limit)
+    popular_snaps = get_category_top_snaps(
+        category, limit=limit, section=section
+    )
     response = {
         "snaps": [serialize_snap(snap) for snap in popular_snaps],
     }
@@ -320,6 +330,39 @@ def run_pipeline_step():
     }, 200
 
 
+@api_blueprint.route("/filter_criteria")
+@login_required
+def filter_criteria():
+    return flask.jsonify(get_filter_criteria()), 200
+
+
+@api_blueprint.route("/filter_criteria", methods=["PUT"])
+@login_required
+def update_filter_criteria():
+    data = flask.request.get_json() or {}
+    try:
+        criteria = set_filter_criteria(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return flask.jsonify(criteria), 200
+
+
+@api_blueprint.route("/filter_criteria/dry_run", methods=["POST"])
+@login_required
+def dry_run_filter_criteria():
+    """
+    Counts the snaps that would pass the stored criteria with the given
+    changes applied, without storing them or running the filter step.
+    """
+    data = flask.request.get_json() or {}
+    try:
+        criteria = validate_filter_criteria(data, get_filter_criteria())
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    counts = evaluate_filter_criteria(db.session, criteria)
+    return flask.jsonify({"criteria": criteria, **counts}), 200
+
+
 @api_blueprint.route("/exclude_snap", methods=["POST"])
 @login_required
 def exclude_snap():
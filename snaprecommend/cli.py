@@ -31,6 +31,20 @@ def initial():
     collect_initial_snap_data()
 
 
+@collector.command()
+@click.argument(
+    "archives",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False),
+)
+def ingest(archives):
+    """Collect snap data from search page archives instead of the store"""
+    from collector.collect import collect_initial_snap_data
+
+    collect_initial_snap_data(archives=sorted(archives))
+
+
 @collector.command()
 def filter():
     """Filter snaps meeting minimum criteria"""
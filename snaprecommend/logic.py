@@ -1,4 +1,7 @@
 from datetime import datetime
+from typing import Optional
+from sqlalchemy import type_coerce
+from sqlalchemy.dialects.postgresql import JSONB
 from snaprecommend.models import (
     Snap,
     SnapRecommendationScore,
@@ -17,12 +20,24 @@ def get_snap_by_name(name: str) -> Snap | None:
     return snap
 
 
-def get_category_top_snaps(category: str, limit: int = 50) -> list[Snap]:
+def snap_in_section(section: str):
     """
-    Returns the top snaps for a given category.
+    Returns a filter condition matching snaps in the given store section.
+
+    The containment (@>) test is served by the GIN index on categories.
     """
+    return type_coerce(Snap.categories, JSONB).contains([{"name": section}])
 
-    snaps = (
+
+def get_category_top_snaps(
+    category: str, limit: int = 50, section: Optional[str] = None
+) -> list[Snap]:
+    """
+    Returns the top snaps for a given category, optionally limited to a
+    store section.
+    """
+
+    query = (
         db.session.query(Snap)
         .join(
             SnapRecommendationScore,
@@ -31,8 +46,12 @@ def get_category_top_snaps(category: str, limit: int = 50) -> list[Snap]:
         .filter(Snap.reaches_min_threshold.is_(True))
         .filter(Snap.excluded.is_(False))
         .filter(SnapRecommendationScore.category == category)
-        .order_by(SnapRecommendationScore.score.desc())
-        .limit(limit)
+    )
+    if section:
+        query = query.filter(snap_in_section(section))
+
+    snaps = (
+        query.order_by(SnapRecommendationScore.score.desc()).limit(limit)
     ).all()
 
     return snaps
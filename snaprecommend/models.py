@@ -1,16 +1,18 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional, List
 from sqlalchemy import (
     Boolean,
     Integer,
     Float,
     String,
+    Date,
     DateTime,
     ForeignKey,
     JSON,
     Enum,
     Index,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 import enum
 
@@ -18,6 +20,9 @@ from snaprecommend import db
 
 ALL_MEDIA_TYPES: List[str] = ["icon", "screenshot", "video", "banner", "logo"]
 
+# JSONB on Postgres, plain JSON elsewhere (e.g. sqlite in tests)
+JSONBVariant = JSON().with_variant(JSONB(), "postgresql")
+
 
 class Snap(db.Model):
     __tablename__: str = "snap"
@@ -33,18 +38,72 @@ class Snap(db.Model):
     contact: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     publisher: Mapped[str] = mapped_column(String)
     revision: Mapped[int] = mapped_column(Integer)
-    links: Mapped[JSON] = mapped_column(JSON)
-    media: Mapped[JSON] = mapped_column(JSON)
+    links: Mapped[JSON] = mapped_column(JSONBVariant)
+    media: Mapped[JSON] = mapped_column(JSONBVariant)
     developer_validation: Mapped[str] = mapped_column(String)
     license: Mapped[str] = mapped_column(String)
     last_updated: Mapped[datetime] = mapped_column(DateTime)
     active_devices: Mapped[int] = mapped_column(Integer, default=0)
     raw_rating: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     total_votes: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # Ratings over the last week and month, from the ratings service charts
+    weekly_raw_rating: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    weekly_total_votes: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    monthly_raw_rating: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    monthly_total_votes: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     reaches_min_threshold: Mapped[bool] = mapped_column(Boolean, default=False)
     excluded: Mapped[bool] = mapped_column(Boolean, default=False)
     date_published: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
-    categories: Mapped[Optional[JSON]] = mapped_column(JSON, nullable=True)
+    categories: Mapped[Optional[JSON]] = mapped_column(
+        JSONBVariant, nullable=True
+    )
+    # Hash of the parsed store payload, used to skip rewriting unchanged snaps
+    fingerprint: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    # Set when a complete crawl of the store no longer returns the snap
+    delisted_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime, nullable=True
+    )
+    # Derived from links, media, description and license by the collect
+    # step, so filtering and scoring don't need to walk the JSON columns
+    media_count: Mapped[int] = mapped_column(Integer, default=0)
+    icon_count: Mapped[int] = mapped_column(Integer, default=0)
+    screenshot_count: Mapped[int] = mapped_column(Integer, default=0)
+    video_count: Mapped[int] = mapped_column(Integer, default=0)
+    banner_count: Mapped[int] = mapped_column(Integer, default=0)
+    logo_count: Mapped[int] = mapped_column(Integer, default=0)
+    has_icon: Mapped[bool] = mapped_column(Boolean, default=False)
+    link_count: Mapped[int] = mapped_column(Integer, default=0)
+    has_contact_link: Mapped[bool] = mapped_column(Boolean, default=False)
+    has_issues_link: Mapped[bool] = mapped_column(Boolean, default=False)
+    description_length: Mapped[int] = mapped_column(Integer, default=0)
+    license_set: Mapped[bool] = mapped_column(Boolean, default=False)
+
+    __table_args__ = (
+        # Serves containment (@>) queries on store sections
+        Index(
+            "ix_snap_categories",
+            "categories",
+            postgresql_using="gin",
+            postgresql_ops={"categories": "jsonb_path_ops"},
+        ),
+    )
+
+
+class SnapInstalledBase(db.Model):
+    """
+    This table is used to store the daily installed base of each snap,
+    summed across its version series, for a limited number of days.
+    """
+
+    __tablename__: str = "snap_installed_base"
+
+    snap_id: Mapped[str] = mapped_column(
+        String,
+        ForeignKey("snap.snap_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    installed_base: Mapped[int] = mapped_column(Integer)
 
 
 class RecommendationCategory(db.Model):
@@ -6,7 +6,9 @@ from snaprecommend.api import (
     get_category_top_snaps,
     format_response,
 )
+from snaprecommend.logic import snap_in_section
 from snaprecommend.models import Snap, RecommendationCategory, EditorialSlice
+from sqlalchemy.dialects import postgresql
 from tests.mock_data import mock_snap
 
 
@@ -47,6 +49,33 @@ def test_get_category_top_snaps(mock_query):
     mock_query.assert_called_once()
 
 
+@patch("snaprecommend.db.session.query")
+def test_get_category_top_snaps_in_section(mock_query):
+    mock_snap_query = MagicMock()
+    mock_query.return_value = mock_snap_query
+
+    mock_snap_query.filter.return_value = mock_snap_query
+    mock_snap_query.join.return_value = mock_snap_query
+    mock_snap_query.order_by.return_value = mock_snap_query
+    mock_snap_query.limit.return_value = mock_snap_query
+    mock_snap_query.all.return_value = []
+
+    get_category_top_snaps("popular", limit=1, section="games")
+
+    conditions = [
+        str(call.args[0].compile(dialect=postgresql.dialect()))
+        for call in mock_snap_query.filter.call_args_list
+    ]
+    assert "snap.categories @> %(param_1)s::JSONB" in conditions
+
+
+def test_snap_in_section():
+    condition = snap_in_section("games").compile(dialect=postgresql.dialect())
+
+    assert str(condition) == "snap.categories @> %(param_1)s::JSONB"
+    assert condition.params["param_1"] == [{"name": "games"}]
+
+
 def test_format_response():
     snap1 = mock_snap()
     snap2 = mock_snap()
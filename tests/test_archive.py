@@ -0,0 +1,52 @@
+import gzip
+from collector.archive import (
+    get_archive_path,
+    iter_archived_pages,
+    iter_archiving,
+)
+
+
+def test_archive_round_trip(tmp_path):
+    path = str(tmp_path / "run" / "snaps.ndjson.gz")
+    pages = [(1, [{"snap_id": "snap1"}]), (2, None), (3, [])]
+
+    assert list(iter_archiving(iter(pages), path)) == pages
+
+    # Pages answered with 304 have no payload to archive
+    assert list(iter_archived_pages(path)) == [
+        (1, [{"snap_id": "snap1"}]),
+        (3, []),
+    ]
+
+
+def test_archived_pages_from_several_parts(tmp_path):
+    first = str(tmp_path / "first.ndjson.gz")
+    second = str(tmp_path / "second.ndjson.gz")
+    list(iter_archiving([(1, [{"snap_id": "snap1"}])], first))
+    list(iter_archiving([(2, [{"snap_id": "snap2"}])], second))
+
+    pages = list(iter_archived_pages(first, second))
+
+    assert [page for page, _ in pages] == [1, 2]
+
+
+def test_truncated_archive(tmp_path):
+    path = tmp_path / "snaps.ndjson.gz"
+    with gzip.open(path, "wt") as archive:
+        archive.write('{"page": 1, "snaps": []}\n{"page": 2, "sna')
+    data = path.read_bytes()
+    path.write_bytes(data[: len(data) - 8])
+
+    assert list(iter_archived_pages(str(path))) == [(1, [])]
+
+
+def test_get_archive_path():
+    checkpoint = {
+        "run_id": "abc",
+        "page": 180,
+        "started_at": "2026-10-18T09:30:00",
+    }
+
+    assert get_archive_path("/archives", checkpoint) == (
+        "/archives/snaps-20261018T093000-abc-p00181.ndjson.gz"
+    )
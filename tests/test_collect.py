@@ -1,13 +1,26 @@
 import pytest
 import requests
 from datetime import datetime
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, MagicMock, patch
 from collector.collect import (
     get_snap_page,
+    iter_snap_pages,
+    insert_snaps,
     upsert_snap,
     bulk_upsert_snaps,
+    upsert_snap_rows,
+    copy_rows_to_staging,
+    create_staging_table,
+    sweep_delisted_snaps,
+    get_resumable_checkpoint,
+    COLLECT_CHECKPOINT_KEY,
+    parse_snap_from_response,
+    get_unchanged_page_snap_ids,
     collect_initial_snap_data,
+    get_peak_rss_mib,
+    reset_peak_rss,
 )
+from collector.archive import iter_archived_pages, iter_archiving
 from snaprecommend.models import PipelineSteps
 from sqlalchemy.orm import Session
 
@@ -18,6 +31,15 @@ def mock_session():
     return MagicMock(spec=Session)
 
 
+@pytest.fixture(autouse=True)
+def mock_settings():
+    """Fixture to keep collect checkpoints out of the database."""
+    with patch("collector.collect.get_setting", return_value=None), patch(
+        "collector.collect.set_setting"
+    ) as mock_set_setting:
+        yield mock_set_setting
+
+
 @pytest.fixture
 def sample_snap():
     """Fixture to provide a sample snap."""
@@ -42,10 +64,10 @@ def sample_snap():
     }
 
 
-@patch("collector.collect.requests.get")
-def test_get_snap_page(mock_get):
+@patch("collector.collect.http_session")
+def test_get_snap_page(mock_http_session):
     """Test fetching a page of snaps."""
-    mock_response = MagicMock()
+    mock_response = MagicMock(status_code=200)
     mock_response.json.return_value = {
         "_embedded": {
             "clickindex:package": [
@@ -55,22 +77,24 @@ def test_get_snap_page(mock_get):
         },
         "_links": {"next": {"href": "next_page"}},
     }
-    mock_get.return_value = mock_response
+    mock_http_session.get_conditional.return_value = mock_response
 
     snaps, has_next = get_snap_page(1)
 
     assert len(snaps) == 2
     assert has_next is True
-    mock_get.assert_called_once_with(
+    mock_http_session.get_conditional.assert_called_once_with(
         "http://api.snapcraft.io/api/v1/snaps/search?fields=snap_id,package_name,last_updated,date_published,summary,description,title,version,publisher,revision,links,media,developer_validation,license,sections&scope=wide&confinement=strict,classic&page=1"
     )
 
 
-@patch("collector.collect.requests.get")
-def test_no_next_page(mock_get):
+@patch("collector.collect.http_session")
+def test_no_next_page(mock_http_session):
     mock_response = {"_embedded": {"clickindex:package": []}, "_links": {}}
-    mock_get.return_value.status_code = 200
-    mock_get.return_value.json.return_value = mock_response
+    mock_http_session.get_conditional.return_value.status_code = 200
+    mock_http_session.get_conditional.return_value.json.return_value = (
+        mock_response
+    )
 
     snaps, has_next = get_snap_page(1)
 
@@ -78,17 +102,350 @@ def test_no_next_page(mock_get):
     assert has_next is False
 
 
-@patch("collector.collect.requests.get")
-def test_api_error(mock_get):
-    mock_get.return_value.status_code = 500
-    mock_get.side_effect = requests.exceptions.HTTPError(
-        "Internal Server Error"
+@patch("collector.collect.http_session")
+def test_api_error(mock_http_session):
+    mock_http_session.get_conditional.side_effect = (
+        requests.exceptions.HTTPError("Internal Server Error")
     )
 
     with pytest.raises(requests.exceptions.HTTPError):
         get_snap_page(1)
 
 
+@patch("collector.collect.http_session")
+def test_get_snap_page_not_modified(mock_http_session):
+    """Pages answered with 304 are reported as unchanged."""
+    full_response = MagicMock(status_code=200)
+    full_response.json.return_value = {
+        "_embedded": {"clickindex:package": [{"snap_id": "snap1"}]},
+        "_links": {"next": {"href": "next_page"}},
+    }
+    mock_http_session.get_conditional.side_effect = [
+        full_response,
+        MagicMock(status_code=304),
+    ]
+
+    assert get_snap_page(7) == ([{"snap_id": "snap1"}], True)
+    assert get_snap_page(7) == (None, True)
+    assert get_unchanged_page_snap_ids(7) == ["snap1"]
+
+
+@patch("collector.collect.get_snap_page")
+def test_iter_snap_pages_in_order(mock_get_snap_page):
+    """Pages fetched concurrently are yielded in page order."""
+
+    def fake_page(page, conditional):
+        if page > 3:
+            raise requests.exceptions.HTTPError("Not Found")
+        return [{"snap_id": f"snap{page}"}], page < 3
+
+    mock_get_snap_page.side_effect = fake_page
+
+    pages = list(iter_snap_pages(workers=4))
+
+    assert [page for page, _ in pages] == [1, 2, 3]
+    assert [snaps[0]["snap_id"] for _, snaps in pages] == [
+        "snap1",
+        "snap2",
+        "snap3",
+    ]
+
+
+@patch("collector.collect.get_snap_page")
+def test_iter_snap_pages_raises_page_error(mock_get_snap_page):
+    mock_get_snap_page.side_effect = requests.exceptions.HTTPError(
+        "Internal Server Error"
+    )
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        list(iter_snap_pages(workers=2))
+
+
+@patch("collector.collect.db")
+@patch("collector.collect.sweep_delisted_snaps")
+@patch(
+    "collector.collect.upsert_snap_rows",
+    return_value={"inserted": 1, "changed": 0, "unchanged": 0},
+)
+@patch("collector.collect.iter_snap_pages")
+@pytest.mark.parametrize("pipeline_depth", [0, 2])
+def test_insert_snaps(
+    mock_iter_snap_pages,
+    mock_upsert_snap_rows,
+    mock_sweep_delisted_snaps,
+    mock_db,
+    pipeline_depth,
+    sample_snap,
+):
+    second_snap = dict(sample_snap, snap_id="snap2")
+    mock_iter_snap_pages.return_value = iter(
+        [(1, [sample_snap]), (2, [second_snap]), (3, []), (4, None)]
+    )
+
+    with patch(
+        "collector.collect.get_unchanged_page_snap_ids",
+        return_value=["snap3", "snap4"],
+    ):
+        assert insert_snaps(workers=2, pipeline_depth=pipeline_depth) == 4
+    mock_iter_snap_pages.assert_called_once_with(
+        2, first_page=1, conditional=True
+    )
+    written = [call.args[1] for call in mock_upsert_snap_rows.call_args_list]
+    assert [[row["snap_id"] for row in rows] for rows in written] == [
+        ["snap1"],
+        ["snap2"],
+        [],
+    ]
+    mock_sweep_delisted_snaps.assert_called_once_with(
+        mock_db.session, {"snap1", "snap2", "snap3", "snap4"}
+    )
+    assert mock_db.session.commit.call_count == 4
+
+
+@patch("collector.collect.db")
+@patch("collector.collect.sweep_delisted_snaps")
+@patch(
+    "collector.collect.merge_staging_table",
+    return_value={"inserted": 1, "changed": 1, "unchanged": 0},
+)
+@patch("collector.collect.copy_rows_to_staging")
+@patch("collector.collect.create_staging_table")
+@patch("collector.collect.upsert_snap_rows")
+@patch("collector.collect.iter_snap_pages")
+def test_insert_snaps_copy_loader(
+    mock_iter_snap_pages,
+    mock_upsert_snap_rows,
+    mock_create_staging_table,
+    mock_copy_rows_to_staging,
+    mock_merge_staging_table,
+    mock_sweep_delisted_snaps,
+    mock_db,
+    sample_snap,
+):
+    mock_iter_snap_pages.return_value = iter(
+        [(1, [sample_snap]), (2, [dict(sample_snap, snap_id="snap2")])]
+    )
+
+    assert insert_snaps(workers=1, pipeline_depth=0, loader="copy") == 2
+    mock_create_staging_table.assert_called_once()
+    assert mock_copy_rows_to_staging.call_count == 2
+    mock_merge_staging_table.assert_called_once()
+    mock_upsert_snap_rows.assert_not_called()
+    mock_sweep_delisted_snaps.assert_called_once()
+
+
+@patch("collector.collect.db")
+@patch("collector.collect.sweep_delisted_snaps")
+@patch(
+    "collector.collect.upsert_snap_rows",
+    return_value={"inserted": 1, "changed": 0, "unchanged": 0},
+)
+@patch("collector.collect.iter_snap_pages")
+@patch("collector.collect.get_resumable_checkpoint")
+def test_insert_snaps_resumes_from_checkpoint(
+    mock_get_resumable_checkpoint,
+    mock_iter_snap_pages,
+    mock_upsert_snap_rows,
+    mock_sweep_delisted_snaps,
+    mock_db,
+    mock_settings,
+    sample_snap,
+):
+    mock_get_resumable_checkpoint.return_value = {
+        "run_id": "run",
+        "page": 180,
+        "started_at": datetime.now().isoformat(),
+        "loader": "upsert",
+    }
+    mock_iter_snap_pages.return_value = iter([(181, [sample_snap])])
+
+    insert_snaps(workers=1, pipeline_depth=0)
+
+    mock_iter_snap_pages.assert_called_once_with(
+        1, first_page=181, conditional=True
+    )
+    # Pages before the checkpoint were not seen, so nothing is delisted
+    mock_sweep_delisted_snaps.assert_not_called()
+    saved = [call.args for call in mock_settings.call_args_list]
+    assert saved[0] == (COLLECT_CHECKPOINT_KEY, {
+        "run_id": "run",
+        "page": 181,
+        "started_at": mock_get_resumable_checkpoint.return_value["started_at"],
+        "loader": "upsert",
+    })
+    assert saved[-1] == (COLLECT_CHECKPOINT_KEY, None)
+
+
+@patch("collector.collect.db")
+@patch("collector.collect.sweep_delisted_snaps")
+@patch(
+    "collector.collect.merge_staging_table",
+    return_value={"inserted": 1, "changed": 0, "unchanged": 0},
+)
+@patch("collector.collect.create_staging_table")
+@patch("collector.collect.iter_snap_pages")
+@patch("collector.collect.get_resumable_checkpoint")
+def test_insert_snaps_resumes_after_last_page(
+    mock_get_resumable_checkpoint,
+    mock_iter_snap_pages,
+    mock_create_staging_table,
+    mock_merge_staging_table,
+    mock_sweep_delisted_snaps,
+    mock_db,
+    mock_settings,
+):
+    # The run failed after its last page was written, e.g. in the merge
+    mock_get_resumable_checkpoint.return_value = {
+        "run_id": "run",
+        "page": 3,
+        "started_at": datetime.now().isoformat(),
+        "loader": "copy",
+        "crawled": True,
+    }
+
+    insert_snaps(workers=1, pipeline_depth=0, loader="copy")
+
+    # Page 4 is past the end of the catalog
+    mock_iter_snap_pages.assert_not_called()
+    mock_create_staging_table.assert_called_once_with(
+        mock_db.session, reset=False
+    )
+    mock_merge_staging_table.assert_called_once()
+    mock_sweep_delisted_snaps.assert_not_called()
+    mock_settings.assert_called_once_with(COLLECT_CHECKPOINT_KEY, None)
+
+
+@patch("collector.collect.db")
+@patch("collector.collect.sweep_delisted_snaps")
+@patch(
+    "collector.collect.upsert_snap_rows",
+    return_value={"inserted": 1, "changed": 0, "unchanged": 0},
+)
+@patch("collector.collect.iter_snap_pages")
+def test_insert_snaps_marks_crawled_checkpoint(
+    mock_iter_snap_pages,
+    mock_upsert_snap_rows,
+    mock_sweep_delisted_snaps,
+    mock_db,
+    mock_settings,
+    sample_snap,
+):
+    mock_iter_snap_pages.return_value = iter([(1, [sample_snap])])
+    mock_sweep_delisted_snaps.side_effect = RuntimeError("sweep failed")
+
+    with pytest.raises(RuntimeError):
+        insert_snaps(workers=1, pipeline_depth=0)
+
+    # The checkpoint is left for the next run to finish without crawling
+    checkpoint = mock_settings.call_args.args[1]
+    assert checkpoint["page"] == 1
+    assert checkpoint["crawled"]
+
+
+@patch("collector.collect.db")
+@patch("collector.collect.sweep_delisted_snaps")
+@patch(
+    "collector.collect.upsert_snap_rows",
+    return_value={"inserted": 1, "changed": 0, "unchanged": 0},
+)
+@patch("collector.collect.iter_snap_page_chunks")
+def test_insert_snaps_streams_page_chunks(
+    mock_iter_snap_page_chunks,
+    mock_upsert_snap_rows,
+    mock_sweep_delisted_snaps,
+    mock_db,
+    mock_settings,
+    sample_snap,
+):
+    mock_iter_snap_page_chunks.return_value = iter(
+        [(1, [sample_snap]), (1, [sample_snap]), (2, [sample_snap])]
+    )
+
+    assert insert_snaps(pipeline_depth=0, stream_chunk_size=1) == 3
+
+    mock_iter_snap_page_chunks.assert_called_once_with(
+        1, first_page=1, conditional=True
+    )
+    assert mock_upsert_snap_rows.call_count == 3
+    # A page is only checkpointed once a chunk of the next one is written
+    saved = [call.args[1] for call in mock_settings.call_args_list]
+    assert [checkpoint["page"] for checkpoint in saved[:-2]] == [0, 0, 1]
+    assert saved[-2]["crawled"]
+    assert saved[-1] is None
+
+
+@patch("collector.collect.get_setting")
+def test_get_resumable_checkpoint(mock_get_setting):
+    checkpoint = {
+        "run_id": "run",
+        "page": 3,
+        "started_at": datetime.now().isoformat(),
+        "loader": "upsert",
+    }
+    mock_get_setting.return_value = MagicMock(value=checkpoint)
+
+    assert get_resumable_checkpoint("upsert") == checkpoint
+    assert get_resumable_checkpoint("copy") is None
+
+    checkpoint["started_at"] = "2020-01-01T00:00:00"
+    assert get_resumable_checkpoint("upsert") is None
+
+    mock_get_setting.return_value = MagicMock(value=None)
+    assert get_resumable_checkpoint("upsert") is None
+
+
+def test_insert_snaps_unknown_loader():
+    with pytest.raises(ValueError):
+        insert_snaps(loader="nope")
+
+
+@patch("collector.collect.db")
+@patch("collector.collect.sweep_delisted_snaps")
+@patch(
+    "collector.collect.upsert_snap_rows",
+    return_value={"inserted": 1, "changed": 0, "unchanged": 0},
+)
+@patch("collector.collect.iter_snap_pages")
+def test_insert_snaps_pipeline_propagates_fetch_error(
+    mock_iter_snap_pages,
+    mock_upsert_snap_rows,
+    mock_sweep_delisted_snaps,
+    mock_db,
+    sample_snap,
+):
+    def failing_pages(workers, first_page, conditional):
+        yield 1, [sample_snap]
+        raise requests.exceptions.HTTPError("Internal Server Error")
+
+    mock_iter_snap_pages.side_effect = failing_pages
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        insert_snaps(workers=1, pipeline_depth=1)
+    mock_upsert_snap_rows.assert_called_once()
+    # A partial crawl never delists snaps
+    mock_sweep_delisted_snaps.assert_not_called()
+
+
+def test_sweep_delisted_snaps(mock_session):
+    mock_session.execute.return_value.scalar_one.return_value = 3
+    mock_session.execute.return_value.rowcount = 1
+
+    counts = sweep_delisted_snaps(mock_session, {"snap1", "snap2"})
+
+    assert counts == {"delisted": 1, "relisted": 1}
+    # one count, one delisting and one relisting statement
+    assert mock_session.execute.call_count == 3
+
+
+def test_sweep_delisted_snaps_skips_truncated_crawl(mock_session):
+    mock_session.execute.return_value.scalar_one.return_value = 100
+
+    counts = sweep_delisted_snaps(mock_session, {"snap1"})
+
+    assert counts == {"delisted": 0, "relisted": 0}
+    assert mock_session.execute.call_count == 1
+
+
 def test_upsert_snap(mock_session, sample_snap):
     """Test upserting a single snap."""
     upsert_snap(mock_session, sample_snap)
@@ -105,7 +462,7 @@ def test_upsert_snap(mock_session, sample_snap):
 def test_bulk_upsert_snaps(mock_insert, mock_session, sample_snap):
     """Test bulk upsert of snaps."""
     mock_stmt = MagicMock()
-    mock_insert.return_value.values.return_value.on_conflict_do_update.return_value = (
+    mock_insert.return_value.values.return_value.on_conflict_do_update.return_value.returning.return_value = (
         mock_stmt
     )
 
@@ -135,12 +492,119 @@ def test_bulk_upsert_snaps(mock_insert, mock_session, sample_snap):
                 ),
                 "date_published": None,
                 "categories": sample_snap["sections"],
+                "media_count": 1,
+                "icon_count": 1,
+                "screenshot_count": 0,
+                "video_count": 0,
+                "banner_count": 0,
+                "logo_count": 0,
+                "has_icon": True,
+                "link_count": 2,
+                "has_contact_link": True,
+                "has_issues_link": False,
+                "description_length": len(sample_snap["description"]),
+                "license_set": True,
+                "fingerprint": ANY,
             }
         ]
     )
     mock_session.execute.assert_called_once_with(mock_stmt)
 
 
+def test_create_staging_table(mock_session):
+    create_staging_table(mock_session)
+
+    drop, create = (
+        str(call.args[0]) for call in mock_session.execute.call_args_list
+    )
+    assert drop == "DROP TABLE IF EXISTS snap_staging"
+    # Only the copied columns, so no constraint applies to the others
+    assert create.startswith(
+        "CREATE UNLOGGED TABLE IF NOT EXISTS snap_staging "
+        "AS SELECT snap_id, name, icon, "
+    )
+    assert create.endswith(", fingerprint FROM snap WITH NO DATA")
+    assert "active_devices" not in create
+    mock_session.commit.assert_called_once()
+
+
+def test_copy_rows_to_staging(mock_session, sample_snap):
+    """Rows are escaped for COPY's text format."""
+    snap = dict(sample_snap, description="line one\nline\ttwo \\o/")
+    cursor = mock_session.connection.return_value.connection.cursor.return_value
+    copied = []
+    cursor.copy_expert.side_effect = lambda sql, buffer: copied.append(
+        (sql, buffer.read())
+    )
+
+    copy_rows_to_staging(mock_session, [parse_snap_from_response(snap)])
+
+    sql, data = copied[0]
+    assert sql.startswith("COPY snap_staging (snap_id, name, icon, ")
+    fields = data.rstrip("\n").split("\t")
+    assert fields[0] == "snap1"
+    assert "line one\\nline\\ttwo \\\\o/" in fields
+    # date_published is missing from the sample snap
+    assert "\\N" in fields
+    cursor.close.assert_called_once()
+
+
+def test_parse_snap_fingerprint(sample_snap):
+    """The fingerprint only changes when the store payload changes."""
+    fingerprint = parse_snap_from_response(sample_snap)["fingerprint"]
+
+    assert parse_snap_from_response(dict(sample_snap))["fingerprint"] == (
+        fingerprint
+    )
+    changed_snap = dict(sample_snap, revision=2)
+    assert parse_snap_from_response(changed_snap)["fingerprint"] != (
+        fingerprint
+    )
+
+
+def test_derive_snap_columns(sample_snap):
+    snap = dict(
+        sample_snap,
+        links={"website": [], "issues": ["https://example.com/issues"]},
+        media=[{"type": "screenshot", "url": "1"}, {"type": "screenshot", "url": "2"}],
+        description=None,
+        license="unset",
+    )
+
+    row = parse_snap_from_response(snap)
+
+    assert row["media_count"] == 2
+    assert row["screenshot_count"] == 2
+    assert row["icon_count"] == 0
+    assert row["has_icon"] is False
+    assert row["link_count"] == 1
+    assert row["has_contact_link"] is False
+    assert row["has_issues_link"] is True
+    assert row["description_length"] == 0
+    assert row["license_set"] is False
+
+
+@patch("collector.collect.insert")
+def test_upsert_snap_rows_counts(mock_insert, mock_session, sample_snap):
+    """Rows not returned by the upsert are counted as unchanged."""
+    rows = [
+        parse_snap_from_response(dict(sample_snap, snap_id=snap_id))
+        for snap_id in ("snap1", "snap2", "snap3")
+    ]
+    mock_session.execute.return_value.all.return_value = [
+        MagicMock(snap_id="snap1", inserted=True),
+        MagicMock(snap_id="snap2", inserted=False),
+    ]
+
+    counts = upsert_snap_rows(mock_session, rows)
+
+    assert counts == {"inserted": 1, "changed": 1, "unchanged": 1}
+    on_conflict = (
+        mock_insert.return_value.values.return_value.on_conflict_do_update
+    )
+    assert "where" in on_conflict.call_args.kwargs
+
+
 @patch("collector.collect.insert_snaps", return_value=5)
 @patch("collector.collect.logger")
 @patch(
@@ -162,3 +626,59 @@ def test_collect_initial_snap_data(
     mock_add_pipeline_step_log.assert_called_once_with(
         PipelineSteps.COLLECT, True
     )
+
+
+@patch("collector.collect.insert_snaps", return_value=2)
+@patch("collector.collect.add_pipeline_step_log")
+def test_collect_initial_snap_data_from_archives(
+    mock_add_pipeline_step_log, mock_insert_snaps, tmp_path, sample_snap
+):
+    archive = tmp_path / "snaps.ndjson.gz"
+    list(iter_archiving([(1, [sample_snap])], str(archive)))
+
+    collect_initial_snap_data(archives=[str(archive)])
+
+    kwargs = mock_insert_snaps.call_args.kwargs
+    assert kwargs["sweep"] is False
+    assert list(kwargs["pages"]) == [(1, [sample_snap])]
+
+
+@patch("collector.collect.db")
+@patch("collector.collect.sweep_delisted_snaps")
+@patch(
+    "collector.collect.upsert_snap_rows",
+    return_value={"inserted": 1, "changed": 0, "unchanged": 0},
+)
+@patch("collector.collect.iter_snap_pages")
+def test_insert_snaps_archives_pages(
+    mock_iter_snap_pages,
+    mock_upsert_snap_rows,
+    mock_sweep_delisted_snaps,
+    mock_db,
+    tmp_path,
+    sample_snap,
+):
+    mock_iter_snap_pages.return_value = iter([(1, [sample_snap])])
+
+    insert_snaps(workers=1, pipeline_depth=1, archive_dir=str(tmp_path))
+
+    # Archived crawls fetch every page in full
+    assert mock_iter_snap_pages.call_args.kwargs["conditional"] is False
+    (archive,) = tmp_path.iterdir()
+    assert archive.name.endswith("-p00001.ndjson.gz")
+    assert list(iter_archived_pages(str(archive))) == [(1, [sample_snap])]
+
+
+def test_reset_peak_rss():
+    if not reset_peak_rss():
+        pytest.skip("The peak RSS can only be reset on Linux")
+    baseline = get_peak_rss_mib()
+    # Zeroed memory is only resident once written to
+    allocation = bytearray(64 * 1024 * 1024)
+    for offset in range(0, len(allocation), 4096):
+        allocation[offset] = 1
+    assert get_peak_rss_mib() >= baseline + 60
+
+    del allocation
+    assert reset_peak_rss()
+    assert get_peak_rss_mib() < baseline + 60
@@ -0,0 +1,200 @@
+import asyncio
+import grpc
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from collector.ratings.collect_ratings import RatingsClient
+from collector.ratings.generated import (
+    ratings_features_app_pb2 as ratings_features_app,
+    ratings_features_chart_pb2 as ratings_features_chart,
+    ratings_features_common_pb2 as ratings_features_common,
+    ratings_features_user_pb2 as ratings_features_user,
+)
+
+
+class FakeRpcError(grpc.RpcError):
+    def __init__(self, code):
+        self._code = code
+
+    def code(self):
+        return self._code
+
+    def details(self):
+        return self._code.name
+
+
+def chart_data(ratings):
+    return [
+        ratings_features_common.ChartData(
+            raw_rating=raw_rating,
+            rating=ratings_features_common.Rating(
+                snap_id=snap_id, total_votes=total_votes
+            ),
+        )
+        for snap_id, raw_rating, total_votes in ratings
+    ]
+
+
+def bulk_ratings_response(ratings):
+    return ratings_features_app.GetBulkRatingsResponse(
+        ratings=chart_data(ratings)
+    )
+
+
+def run_with_client(test):
+    """
+    Runs the coroutine `test(client)` with a client whose stubs are mocks.
+    """
+
+    async def run():
+        # Channels only connect on the first RPC, which the stubs replace
+        async with RatingsClient("localhost:1") as client:
+            client.user_stub = MagicMock()
+            client.user_stub.Authenticate = AsyncMock(
+                side_effect=[
+                    ratings_features_user.AuthenticateResponse(token="token1"),
+                    ratings_features_user.AuthenticateResponse(token="token2"),
+                ]
+            )
+            client.app_stub = MagicMock()
+            client.app_stub.GetBulkRatings = AsyncMock()
+            client.chart_stub = MagicMock()
+            client.chart_stub.GetChart = AsyncMock()
+            await test(client)
+
+    asyncio.run(run())
+
+
+def test_get_ratings_reuses_token():
+    async def test(client):
+        client.app_stub.GetBulkRatings.return_value = bulk_ratings_response(
+            [("snap1", 4.5, 10)]
+        )
+
+        assert await client.get_ratings(["snap1"]) == {
+            "snap1": {"raw_rating": 4.5, "total_votes": 10}
+        }
+        await client.get_ratings(["snap2"])
+
+        client.user_stub.Authenticate.assert_called_once()
+        for call in client.app_stub.GetBulkRatings.call_args_list:
+            assert call.kwargs["metadata"] == [
+                ("authorization", "Bearer token1")
+            ]
+            assert call.kwargs["timeout"] == client.timeout
+
+    run_with_client(test)
+
+
+def test_get_ratings_renews_rejected_token():
+    async def test(client):
+        client.app_stub.GetBulkRatings.side_effect = [
+            FakeRpcError(grpc.StatusCode.UNAUTHENTICATED),
+            bulk_ratings_response([("snap1", 3.0, 2)]),
+        ]
+
+        assert await client.get_ratings(["snap1"]) == {
+            "snap1": {"raw_rating": 3.0, "total_votes": 2}
+        }
+
+        assert client.user_stub.Authenticate.call_count == 2
+        retry = client.app_stub.GetBulkRatings.call_args_list[1]
+        assert retry.kwargs["metadata"] == [("authorization", "Bearer token2")]
+
+    run_with_client(test)
+
+
+def test_get_ratings_errors():
+    async def test(client):
+        client.app_stub.GetBulkRatings.side_effect = FakeRpcError(
+            grpc.StatusCode.DEADLINE_EXCEEDED
+        )
+        assert await client.get_ratings(["snap1"]) == {}
+
+        client.invalidate_token("token1")
+        client.user_stub.Authenticate.side_effect = FakeRpcError(
+            grpc.StatusCode.UNAVAILABLE
+        )
+        with pytest.raises(ValueError):
+            await client.get_ratings(["snap1"])
+
+    run_with_client(test)
+
+
+def test_get_all_ratings_fans_out():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def get_bulk_ratings(request, metadata, timeout):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        if request.snap_ids[0] == "snap4":
+            raise FakeRpcError(grpc.StatusCode.UNAVAILABLE)
+        return bulk_ratings_response(
+            [(snap_id, 4.0, 1) for snap_id in request.snap_ids]
+        )
+
+    async def test(client):
+        client.app_stub.GetBulkRatings.side_effect = get_bulk_ratings
+        snap_ids = [f"snap{i}" for i in range(10)]
+
+        ratings = await client.get_all_ratings(
+            snap_ids, batch_size=2, concurrency=3
+        )
+
+        # The failed batch is left out
+        assert sorted(ratings) == sorted(set(snap_ids) - {"snap4", "snap5"})
+        assert client.app_stub.GetBulkRatings.call_count == 5
+        assert max_in_flight == 3
+        client.user_stub.Authenticate.assert_called_once()
+
+    run_with_client(test)
+
+
+def test_get_chart_ratings():
+    async def get_chart(request, metadata, timeout):
+        if request.category == ratings_features_chart.GAMES:
+            raise FakeRpcError(grpc.StatusCode.UNAVAILABLE)
+        if request.category == ratings_features_chart.DEVELOPMENT:
+            weekly = request.timeframe == ratings_features_chart.TIMEFRAME_WEEK
+            votes = 10 if weekly else 40
+            return ratings_features_chart.GetChartResponse(
+                timeframe=request.timeframe,
+                ordered_chart_data=chart_data(
+                    [("snap1", 4.0, votes), ("other", 3.0, votes)]
+                ),
+            )
+        return ratings_features_chart.GetChartResponse()
+
+    async def test(client):
+        client.chart_stub.GetChart.side_effect = get_chart
+        client.app_stub.GetBulkRatings.return_value = bulk_ratings_response(
+            [("snap2", 2.0, 3)]
+        )
+
+        ratings, charts, failed = await client.get_chart_ratings(
+            ["snap1", "snap2"], batch_size=20
+        )
+
+        # Every category for both timeframes
+        assert client.chart_stub.GetChart.call_count == 40
+        assert ratings == {
+            "snap1": {"raw_rating": 4.0, "total_votes": 40},
+            "snap2": {"raw_rating": 2.0, "total_votes": 3},
+        }
+        assert charts["weekly"]["snap1"] == {
+            "raw_rating": 4.0,
+            "total_votes": 10,
+        }
+        assert set(charts["monthly"]) == {"snap1", "other"}
+        assert failed == {
+            ("weekly", ratings_features_chart.GAMES),
+            ("monthly", ratings_features_chart.GAMES),
+        }
+        # Only the snaps missing from the charts are requested in bulk
+        bulk_request = client.app_stub.GetBulkRatings.call_args.args[0]
+        assert list(bulk_request.snap_ids) == ["snap2"]
+
+    run_with_client(test)
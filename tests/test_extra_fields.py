@@ -1,16 +1,28 @@
+import copy
 import pytest
+import requests
+import threading
+import time
 from unittest.mock import MagicMock, patch
 from collector.extra_fields import (
     calculate_latest_active_devices,
+    fetch_metrics_batch,
     fetch_metrics_from_api,
-    process_and_update_snap_metrics,
+    bulk_update_snaps,
+    write_snap_updates,
+    chart_rating_rows,
     fetch_and_update_metrics_for_snaps,
     get_metrics_time_range,
-    fetch_eligible_snaps,
+    fetch_eligible_snap_ids,
     update_snap_metrics,
+    update_snap_ratings,
     fetch_extra_fields,
+    latest_active_devices,
 )
-from snaprecommend.models import Snap
+from collector.http_client import AdaptiveBatchSize, RateLimiter
+from snaprecommend import app
+from snaprecommend.models import PipelineSteps, Snap
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 
@@ -43,51 +55,294 @@ def test_calculate_latest_active_devices():
     assert result == 22
 
 
-@patch("collector.extra_fields.requests.post")
+def test_latest_active_devices():
+    metrics = [
+        {
+            "buckets": ["2025-01-25", "2025-01-26", "2025-01-27"],
+            "series": [
+                {"name": "2.0", "values": [None, 5, 7]},
+                {"name": "1.0", "values": [10, 3, 0]},
+                {"name": "0.9", "values": [4, None, None]},
+                # Series not covering every bucket are ignored
+                {"name": "0.1", "values": [100]},
+            ],
+        },
+        {"buckets": ["2025-01-27"], "series": []},
+    ]
+    original = copy.deepcopy(metrics)
+
+    assert latest_active_devices(metrics) == [14, 0]
+    assert latest_active_devices(metrics, start_date="2025-01-26") == [10, 0]
+    assert latest_active_devices(metrics, start_date="2025-01-28") == [0, 0]
+    assert metrics == original
+
+
+@patch("collector.extra_fields.http_session.post")
 def test_fetch_metrics_from_api(mock_post, sample_snap):
     mock_response = MagicMock()
     mock_response.json.return_value = {"metrics": []}
     mock_post.return_value = mock_response
 
-    result = fetch_metrics_from_api([sample_snap], "2023-01-01", "2023-01-31")
+    result = fetch_metrics_from_api(["snap1"], "2023-01-01", "2023-01-31")
     assert result == {"metrics": []}
     mock_post.assert_called_once()
 
 
-def test_process_and_update_snap_metrics(mock_session, sample_snap):
-    metrics_data = {
-        "metrics": [
-            {
-                "buckets": ["2025-01-26", "2025-01-27"],
-                "metric_name": "weekly_installed_base_by_version",
-                "series": [{"name": "1.0.1", "values": [23, 22]}],
-                "snap_id": "bv9Q2i9CNAvTjt9wTx1cFC6SAT9YrEfG",
-                "status": "OK",
-            }
-        ]
-    }
+def test_bulk_update_snaps(mock_session):
+    mock_session.execute.return_value.rowcount = 1
+    rows = [
+        {"snap_id": "snap1", "raw_rating": 4.5, "total_votes": 10},
+        {"snap_id": "snap2", "raw_rating": 3.0, "total_votes": 2},
+    ]
+
+    assert bulk_update_snaps(mock_session, rows, ("raw_rating", "total_votes")) == 1
+
+    stmt = mock_session.execute.call_args.args[0]
+    compiled = stmt.compile(dialect=postgresql.dialect())
+    sql = " ".join(str(compiled).split())
+    assert sql == (
+        "UPDATE snap SET raw_rating=CAST(new_values.raw_rating AS FLOAT), "
+        "total_votes=CAST(new_values.total_votes AS INTEGER) "
+        "FROM (VALUES (%(param_1)s, %(param_2)s, %(param_3)s), "
+        "(%(param_4)s, %(param_5)s, %(param_6)s)) "
+        "AS new_values (snap_id, raw_rating, total_votes) "
+        "WHERE snap.snap_id = new_values.snap_id "
+        "AND (snap.raw_rating IS DISTINCT FROM "
+        "CAST(new_values.raw_rating AS FLOAT) "
+        "OR snap.total_votes IS DISTINCT FROM "
+        "CAST(new_values.total_votes AS INTEGER))"
+    )
+
+
+def test_bulk_update_snaps_casts_null_columns(mock_session):
+    # Snaps missing from the charts have no weekly ratings, a VALUES
+    # column of NULLs would otherwise be typed as text
+    rows = [
+        {"snap_id": "snap1", "weekly_raw_rating": None},
+        {"snap_id": "snap2", "weekly_raw_rating": None},
+    ]
+
+    bulk_update_snaps(mock_session, rows, ("weekly_raw_rating",))
+
+    stmt = mock_session.execute.call_args.args[0]
+    sql = str(stmt.compile(dialect=postgresql.psycopg2.dialect()))
+    assert sql.count("CAST(new_values.weekly_raw_rating AS FLOAT)") == 2
+
 
-    process_and_update_snap_metrics([sample_snap], metrics_data, mock_session)
-    assert sample_snap.active_devices == 22
-    mock_session.commit.assert_called_once()
+@patch("collector.extra_fields.UPDATE_CHUNK_SIZE", 2)
+def test_write_snap_updates_commits_chunks_in_order(mock_session):
+    mock_session.execute.return_value.rowcount = 1
+    rows = [
+        {"snap_id": snap_id, "active_devices": 1}
+        for snap_id in ("snap3", "snap1", "snap2")
+    ]
 
+    assert write_snap_updates(mock_session, rows, ("active_devices",)) == 2
 
+    # A lock and an update per chunk, locking the rows in snap_id order
+    locks = [
+        call.args[0]
+        for call in mock_session.execute.call_args_list[::2]
+    ]
+    sql = str(locks[0].compile(dialect=postgresql.dialect()))
+    assert sql.endswith("ORDER BY snap.snap_id FOR UPDATE")
+    assert [lock.compile().params["snap_id_1"] for lock in locks] == [
+        ["snap1", "snap2"],
+        ["snap3"],
+    ]
+    assert mock_session.commit.call_count == 2
+
+
+def test_bulk_update_snaps_without_rows(mock_session):
+    assert bulk_update_snaps(mock_session, [], ("active_devices",)) == 0
+    mock_session.execute.assert_not_called()
+
+
+@patch("collector.extra_fields.store_installed_base", return_value=0)
+@patch("collector.extra_fields.get_metrics_start_dates", return_value={})
 @patch("collector.extra_fields.fetch_metrics_from_api")
-@patch("collector.extra_fields.process_and_update_snap_metrics")
+@patch("collector.extra_fields.write_snap_updates", return_value=0)
 @patch("collector.extra_fields.get_metrics_time_range")
 def test_fetch_and_update_metrics_for_snaps(
     mock_get_metrics_time_range,
-    mock_process_and_update_snap_metrics,
+    mock_write_snap_updates,
     mock_fetch_metrics_from_api,
+    mock_get_metrics_start_dates,
+    mock_store_installed_base,
     mock_session,
     sample_snap,
 ):
     mock_get_metrics_time_range.return_value = ("2023-01-01", "2023-01-31")
     mock_fetch_metrics_from_api.return_value = {"metrics": []}
 
-    fetch_and_update_metrics_for_snaps([sample_snap], mock_session)
-    mock_fetch_metrics_from_api.assert_called_once()
-    mock_process_and_update_snap_metrics.assert_called_once()
+    fetch_and_update_metrics_for_snaps(["snap1"], mock_session)
+    mock_fetch_metrics_from_api.assert_called_once_with(
+        ["snap1"], "2023-01-01", "2023-01-31", {}
+    )
+    mock_write_snap_updates.assert_called_once_with(
+        mock_session, [], ("active_devices",)
+    )
+
+
+@patch("collector.extra_fields.store_installed_base", return_value=0)
+@patch("collector.extra_fields.get_metrics_start_dates", return_value={})
+@patch("collector.extra_fields.UPDATE_CHUNK_SIZE", 20)
+@patch("collector.extra_fields.fetch_metrics_from_api")
+@patch("collector.extra_fields.bulk_update_snaps", return_value=0)
+@patch("collector.extra_fields.get_metrics_time_range")
+def test_fetch_and_update_metrics_for_snaps_concurrently(
+    mock_get_metrics_time_range,
+    mock_bulk_update_snaps,
+    mock_fetch_metrics_from_api,
+    mock_get_metrics_start_dates,
+    mock_store_installed_base,
+    mock_session,
+):
+    mock_get_metrics_time_range.return_value = ("2023-01-01", "2023-01-31")
+    # Zero-padded, so that rows are written in snap_id order too
+    snap_ids = [f"snap{i:02d}" for i in range(40)]
+
+    def fetch_metrics(snap_ids, start_date, end_date, start_dates):
+        # The first batch answers last
+        time.sleep(0.05 if snap_ids[0] == "snap00" else 0)
+        return {
+            "metrics": [
+                {
+                    "buckets": ["2023-01-31"],
+                    "series": [{"name": "1.0", "values": [int(snap_id[4:])]}],
+                }
+                for snap_id in snap_ids
+            ]
+        }
+
+    mock_fetch_metrics_from_api.side_effect = fetch_metrics
+
+    fetch_and_update_metrics_for_snaps(snap_ids, mock_session, workers=3)
+
+    assert mock_fetch_metrics_from_api.call_count == 3
+    # Rows are written in order, 20 per statement once 20 are pending
+    written = [
+        call.args[1] for call in mock_bulk_update_snaps.call_args_list
+    ]
+    assert [len(rows) for rows in written] == [20, 10, 10]
+    assert [row["active_devices"] for rows in written for row in rows] == (
+        list(range(40))
+    )
+
+
+@patch("collector.extra_fields.store_installed_base", return_value=0)
+@patch("collector.extra_fields.get_metrics_start_dates", return_value={})
+@patch("collector.extra_fields.fetch_metrics_from_api")
+@patch("collector.extra_fields.write_snap_updates")
+@patch("collector.extra_fields.get_metrics_time_range")
+def test_fetch_and_update_metrics_for_snaps_batch_error(
+    mock_get_metrics_time_range,
+    mock_write_snap_updates,
+    mock_fetch_metrics_from_api,
+    mock_get_metrics_start_dates,
+    mock_store_installed_base,
+    mock_session,
+):
+    mock_get_metrics_time_range.return_value = ("2023-01-01", "2023-01-31")
+
+    def fetch_metrics(snap_ids, start_date, end_date, start_dates):
+        if snap_ids[0] == "snap15":
+            raise requests.HTTPError("Service Unavailable")
+        return {"metrics": []}
+
+    mock_fetch_metrics_from_api.side_effect = fetch_metrics
+    snap_ids = [f"snap{i}" for i in range(45)]
+
+    with pytest.raises(requests.HTTPError):
+        fetch_and_update_metrics_for_snaps(snap_ids, mock_session, workers=2)
+    # Nothing from the failed run is written
+    mock_write_snap_updates.assert_not_called()
+
+
+def http_error(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.HTTPError(f"{status_code} Error", response=response)
+
+
+@patch("collector.extra_fields.METRICS_RATE_LIMITER")
+@patch("collector.extra_fields.fetch_metrics_from_api")
+def test_fetch_metrics_batch_honours_retry_after(
+    mock_fetch_metrics_from_api, mock_rate_limiter
+):
+    mock_fetch_metrics_from_api.side_effect = [
+        http_error(429, {"Retry-After": "0"}),
+        {"metrics": ["snap1", "snap2"]},
+    ]
+    batch_size = AdaptiveBatchSize(2, maximum=4)
+
+    result = fetch_metrics_batch(
+        ["snap1", "snap2"], "2023-01-01", "2023-01-31", None, batch_size
+    )
+
+    assert result == {"metrics": ["snap1", "snap2"]}
+    assert mock_fetch_metrics_from_api.call_count == 2
+    mock_rate_limiter.pause.assert_called_once_with(0)
+    # Rate limiting doesn't shrink batches
+    assert batch_size.size == 3
+
+
+@patch("collector.extra_fields.backoff_delay", return_value=0)
+@patch("collector.extra_fields.fetch_metrics_from_api")
+def test_fetch_metrics_batch_splits_after_timeout(
+    mock_fetch_metrics_from_api, mock_backoff_delay
+):
+    def fetch_metrics(snap_ids, start_date, end_date, start_dates):
+        if len(snap_ids) > 4:
+            raise requests.Timeout("Read timed out")
+        return {"metrics": list(snap_ids)}
+
+    mock_fetch_metrics_from_api.side_effect = fetch_metrics
+    snap_ids = [f"snap{i}" for i in range(8)]
+
+    result = fetch_metrics_batch(
+        snap_ids, "2023-01-01", "2023-01-31", None, AdaptiveBatchSize(8)
+    )
+
+    assert result == {"metrics": snap_ids}
+    assert [
+        len(call.args[0]) for call in mock_fetch_metrics_from_api.call_args_list
+    ] == [8, 4, 4]
+
+
+@patch("collector.extra_fields.backoff_delay", return_value=0)
+@patch("collector.extra_fields.fetch_metrics_from_api")
+def test_fetch_metrics_batch_gives_up(
+    mock_fetch_metrics_from_api, mock_backoff_delay
+):
+    mock_fetch_metrics_from_api.side_effect = http_error(503)
+
+    with pytest.raises(requests.HTTPError):
+        fetch_metrics_batch(
+            ["snap1"], "2023-01-01", "2023-01-31", None,
+            AdaptiveBatchSize(1), retries=2,
+        )
+    assert mock_fetch_metrics_from_api.call_count == 3
+
+    # Client errors are not retried
+    mock_fetch_metrics_from_api.reset_mock()
+    mock_fetch_metrics_from_api.side_effect = http_error(401)
+    with pytest.raises(requests.HTTPError):
+        fetch_metrics_batch(
+            ["snap1"], "2023-01-01", "2023-01-31", None, AdaptiveBatchSize(1)
+        )
+    assert mock_fetch_metrics_from_api.call_count == 1
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=100)
+
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.wait()
+
+    assert time.monotonic() - start >= 0.05
 
 
 def test_get_metrics_time_range():
@@ -100,31 +355,204 @@ def test_get_metrics_time_range():
     )
 
 
-def test_fetch_eligible_snaps(mock_session):
-    mock_session.query().filter().all.return_value = [sample_snap]
-    result = fetch_eligible_snaps(mock_session)
-    assert result == [sample_snap]
-    mock_session.query().filter().all.assert_called_once()
+def test_fetch_eligible_snap_ids(mock_session):
+    mock_session.execute.return_value.scalars.return_value = iter(
+        ["snap1", "snap2"]
+    )
+
+    assert fetch_eligible_snap_ids(mock_session) == ["snap1", "snap2"]
+
+    stmt = mock_session.execute.call_args.args[0]
+    # Only the ids are selected, through a server-side cursor
+    assert [c.name for c in stmt.selected_columns] == ["snap_id"]
+    assert stmt.get_execution_options()["yield_per"] == 5000
 
 
-@patch("collector.extra_fields.fetch_eligible_snaps")
+@patch("collector.extra_fields.db")
+@patch("collector.extra_fields.delete_expired_installed_base")
+@patch("collector.extra_fields.fetch_eligible_snap_ids")
 @patch("collector.extra_fields.fetch_and_update_metrics_for_snaps")
 def test_update_snap_metrics(
     mock_fetch_and_update_metrics_for_snaps,
-    mock_fetch_eligible_snaps,
+    mock_fetch_eligible_snap_ids,
+    mock_delete_expired_installed_base,
+    mock_db,
 ):
-    mock_fetch_eligible_snaps.return_value = [sample_snap]
+    mock_fetch_eligible_snap_ids.return_value = ["snap1"]
 
     update_snap_metrics()
-    mock_fetch_eligible_snaps.assert_called_once()
-    mock_fetch_and_update_metrics_for_snaps.assert_called_once()
+    mock_fetch_eligible_snap_ids.assert_called_once()
+    mock_fetch_and_update_metrics_for_snaps.assert_called_once_with(
+        ["snap1"], mock_db.session
+    )
+    mock_delete_expired_installed_base.assert_called_once_with(mock_db.session)
+
+
+@patch("collector.extra_fields.db")
+@patch("collector.extra_fields.write_snap_updates", return_value=1)
+@patch("collector.extra_fields.fetch_ratings")
+@patch("collector.extra_fields.fetch_eligible_snap_ids")
+def test_update_snap_ratings(
+    mock_fetch_eligible_snap_ids,
+    mock_fetch_ratings,
+    mock_write_snap_updates,
+    mock_db,
+):
+    mock_fetch_eligible_snap_ids.return_value = ["snap1", "snap2"]
+    mock_fetch_ratings.return_value = {
+        "snap2": {"raw_rating": 4.5, "total_votes": 10}
+    }
+
+    update_snap_ratings()
+
+    mock_fetch_ratings.assert_called_once_with(["snap1", "snap2"], 20)
+    mock_write_snap_updates.assert_called_once_with(
+        mock_db.session,
+        [{"snap_id": "snap2", "raw_rating": 4.5, "total_votes": 10}],
+        ("raw_rating", "total_votes"),
+    )
+
+
+@patch("collector.extra_fields.db")
+@patch("collector.extra_fields.write_snap_updates", return_value=1)
+@patch("collector.extra_fields.fetch_chart_ratings")
+@patch("collector.extra_fields.fetch_eligible_snap_ids")
+def test_update_snap_ratings_from_charts(
+    mock_fetch_eligible_snap_ids,
+    mock_fetch_chart_ratings,
+    mock_write_snap_updates,
+    mock_db,
+):
+    mock_fetch_eligible_snap_ids.return_value = ["snap1", "snap2"]
+    rating = {"raw_rating": 4.5, "total_votes": 10}
+    mock_fetch_chart_ratings.return_value = (
+        {"snap1": rating},
+        {"weekly": {}, "monthly": {"snap1": rating}},
+        set(),
+    )
+
+    update_snap_ratings(source="chart")
+
+    mock_fetch_chart_ratings.assert_called_once_with(["snap1", "snap2"], 20)
+    chart_rows, rating_rows = (
+        call.args[1:] for call in mock_write_snap_updates.call_args_list
+    )
+    assert chart_rows == (
+        [
+            {
+                "snap_id": "snap1",
+                "weekly_raw_rating": None,
+                "weekly_total_votes": None,
+                "monthly_raw_rating": 4.5,
+                "monthly_total_votes": 10,
+            },
+            {
+                "snap_id": "snap2",
+                "weekly_raw_rating": None,
+                "weekly_total_votes": None,
+                "monthly_raw_rating": None,
+                "monthly_total_votes": None,
+            },
+        ],
+        (
+            "weekly_raw_rating",
+            "weekly_total_votes",
+            "monthly_raw_rating",
+            "monthly_total_votes",
+        ),
+    )
+    assert rating_rows == (
+        [{"snap_id": "snap1", "raw_rating": 4.5, "total_votes": 10}],
+        ("raw_rating", "total_votes"),
+    )
+
+
+def test_chart_rating_rows_leave_out_failed_charts():
+    rating = {"raw_rating": 4.5, "total_votes": 10}
+    charts = {
+        "weekly": {"snap1": rating},
+        "monthly": {"snap1": rating, "snap2": rating},
+    }
+
+    rows = chart_rating_rows(
+        ["snap1", "snap2", "snap3"], charts, {("weekly", 9)}
+    )
+
+    # snap2 and snap3 may be in the failed weekly chart, so their weekly
+    # ratings are kept as they are
+    assert rows == {
+        (
+            "weekly_raw_rating",
+            "weekly_total_votes",
+            "monthly_raw_rating",
+            "monthly_total_votes",
+        ): [
+            {
+                "snap_id": "snap1",
+                "weekly_raw_rating": 4.5,
+                "weekly_total_votes": 10,
+                "monthly_raw_rating": 4.5,
+                "monthly_total_votes": 10,
+            }
+        ],
+        ("monthly_raw_rating", "monthly_total_votes"): [
+            {
+                "snap_id": "snap2",
+                "monthly_raw_rating": 4.5,
+                "monthly_total_votes": 10,
+            },
+            {
+                "snap_id": "snap3",
+                "monthly_raw_rating": None,
+                "monthly_total_votes": None,
+            },
+        ],
+    }
 
 
-@patch("collector.extra_fields.update_snap_metrics")
 @patch("collector.extra_fields.add_pipeline_step_log")
+@patch("collector.extra_fields.update_snap_ratings")
+@patch("collector.extra_fields.update_snap_metrics")
+@patch("collector.extra_fields.fetch_eligible_snap_ids")
 def test_fetch_extra_fields(
-    mock_add_pipeline_step_log, mock_update_snap_metrics
+    mock_fetch_eligible_snap_ids,
+    mock_update_snap_metrics,
+    mock_update_snap_ratings,
+    mock_add_pipeline_step_log,
 ):
-    fetch_extra_fields()
-    mock_update_snap_metrics.assert_called_once()
-    mock_add_pipeline_step_log.assert_called_once()
+    mock_fetch_eligible_snap_ids.return_value = ["snap1", "snap2"]
+    # Both sub-steps have to be running for either to finish
+    barrier = threading.Barrier(2, timeout=5)
+    mock_update_snap_metrics.side_effect = lambda snap_ids: barrier.wait()
+    mock_update_snap_ratings.side_effect = lambda snap_ids: barrier.wait()
+
+    with app.app_context():
+        fetch_extra_fields()
+
+    mock_update_snap_metrics.assert_called_once_with(["snap1", "snap2"])
+    mock_update_snap_ratings.assert_called_once_with(["snap1", "snap2"])
+    mock_add_pipeline_step_log.assert_called_once_with(
+        PipelineSteps.EXTRA_FIELDS, True
+    )
+
+
+@patch("collector.extra_fields.add_pipeline_step_log")
+@patch("collector.extra_fields.update_snap_ratings")
+@patch("collector.extra_fields.update_snap_metrics")
+@patch("collector.extra_fields.fetch_eligible_snap_ids", return_value=[])
+def test_fetch_extra_fields_sub_step_fails(
+    mock_fetch_eligible_snap_ids,
+    mock_update_snap_metrics,
+    mock_update_snap_ratings,
+    mock_add_pipeline_step_log,
+):
+    mock_update_snap_metrics.side_effect = requests.HTTPError("Unavailable")
+
+    with app.app_context():
+        fetch_extra_fields()
+
+    # Ratings are still updated
+    mock_update_snap_ratings.assert_called_once_with([])
+    mock_add_pipeline_step_log.assert_called_once_with(
+        PipelineSteps.EXTRA_FIELDS, False, "metrics: Unavailable"
+    )
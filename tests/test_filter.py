@@ -0,0 +1,213 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+from flask import Flask
+from sqlalchemy.pool import StaticPool
+from collector.filter import (
+    DEFAULT_FILTER_CRITERIA,
+    FILTER_CRITERIA_KEY,
+    evaluate_filter_criteria,
+    filter_snaps_meeting_minimum_criteria,
+    get_filter_criteria,
+    set_filter_criteria,
+    update_min_threshold_flags,
+    validate_filter_criteria,
+)
+from snaprecommend import db
+from snaprecommend.api import api_blueprint
+from snaprecommend.models import PipelineSteps, Settings, Snap
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "poolclass": StaticPool,
+        "connect_args": {"check_same_thread": False},
+    }
+    app.config["TESTING"] = True
+    app.secret_key = "test"
+    db.init_app(app)
+    app.register_blueprint(api_blueprint, url_prefix="/api")
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def snaps(app):
+    now = datetime.now()
+    db.session.add_all(
+        [
+            make_snap("complete", now),
+            make_snap("short", now, description_length=20),
+            make_snap("stale", now - timedelta(days=365), has_icon=False),
+        ]
+    )
+    db.session.commit()
+
+
+def make_snap(snap_id: str, last_updated: datetime, **derived) -> Snap:
+    columns = {
+        "media_count": 2,
+        "has_icon": True,
+        "has_contact_link": True,
+        "has_issues_link": False,
+        "description_length": 100,
+    }
+    columns.update(derived)
+    return Snap(
+        snap_id=snap_id,
+        title=snap_id,
+        name=snap_id,
+        version="1.0",
+        summary="",
+        description="",
+        publisher="publisher",
+        revision=1,
+        links={},
+        media=[],
+        developer_validation="unproven",
+        license="MIT",
+        last_updated=last_updated,
+        **columns,
+    )
+
+
+@patch("collector.filter.get_setting", return_value=None)
+def test_update_min_threshold_flags(mock_get_setting):
+    session = MagicMock(spec=Session)
+    session.execute.return_value.scalars.return_value.all.return_value = [
+        True,
+        False,
+        True,
+    ]
+
+    assert update_min_threshold_flags(session) == {"passing": 2, "failing": 1}
+
+    session.execute.assert_called_once()
+    sql = str(
+        session.execute.call_args.args[0].compile(dialect=postgresql.dialect())
+    )
+    # One statement, only touching snaps whose flag changes
+    assert sql.startswith("UPDATE snap SET reaches_min_threshold=coalesce(")
+    assert "WHERE snap.reaches_min_threshold IS DISTINCT FROM coalesce(" in sql
+    assert sql.endswith("RETURNING snap.reaches_min_threshold")
+
+
+@patch("collector.filter.add_pipeline_step_log")
+@patch(
+    "collector.filter.update_min_threshold_flags",
+    return_value={"passing": 3, "failing": 0},
+)
+@patch("collector.filter.db")
+def test_filter_snaps_meeting_minimum_criteria(
+    mock_db, mock_update_min_threshold_flags, mock_add_pipeline_step_log
+):
+    filter_snaps_meeting_minimum_criteria()
+
+    mock_update_min_threshold_flags.assert_called_once_with(mock_db.session)
+    mock_db.session.commit.assert_called_once()
+    mock_add_pipeline_step_log.assert_called_once_with(
+        PipelineSteps.FILTER, True
+    )
+
+
+def test_validate_filter_criteria():
+    criteria = validate_filter_criteria({"minimum_media_items": 3})
+
+    assert criteria == dict(DEFAULT_FILTER_CRITERIA, minimum_media_items=3)
+    with pytest.raises(ValueError):
+        validate_filter_criteria({"minimum_stars": 3})
+    with pytest.raises(ValueError):
+        validate_filter_criteria({"minimum_media_items": "3"})
+    with pytest.raises(ValueError):
+        validate_filter_criteria({"minimum_media_items": True})
+    with pytest.raises(ValueError):
+        validate_filter_criteria({"minimum_media_items": -1})
+    with pytest.raises(ValueError):
+        validate_filter_criteria([1])
+
+
+def test_set_filter_criteria(app):
+    assert get_filter_criteria() == DEFAULT_FILTER_CRITERIA
+
+    set_filter_criteria({"require_icon": False})
+    set_filter_criteria({"minimum_description_length": 10})
+
+    expected = dict(
+        DEFAULT_FILTER_CRITERIA,
+        require_icon=False,
+        minimum_description_length=10,
+    )
+    assert get_filter_criteria() == expected
+    assert db.session.get(Settings, FILTER_CRITERIA_KEY).value == expected
+
+
+def test_evaluate_filter_criteria(snaps):
+    counts = evaluate_filter_criteria(db.session, DEFAULT_FILTER_CRITERIA)
+
+    assert counts == {
+        "total": 3,
+        "by_criterion": {
+            "is_listed": 3,
+            "has_icon": 2,
+            "has_media": 3,
+            "author_can_be_reached": 3,
+            "has_description": 2,
+            "is_recent": 2,
+        },
+        "passing": 1,
+    }
+
+    relaxed = dict(
+        DEFAULT_FILTER_CRITERIA,
+        minimum_description_length=10,
+        require_icon=False,
+    )
+    counts = evaluate_filter_criteria(db.session, relaxed)
+
+    assert "has_icon" not in counts["by_criterion"]
+    assert counts["by_criterion"]["has_description"] == 3
+    assert counts["passing"] == 2
+    # Nothing is written by a dry run
+    assert db.session.query(Snap).filter(Snap.reaches_min_threshold).count() == 0
+
+
+def test_dry_run_endpoint(app, snaps):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["publisher"] = {"is_admin": True, "nickname": "jane"}
+        session["macaroon_root"] = "root"
+        session["macaroon_discharge"] = "discharge"
+
+    response = client.post(
+        "/api/filter_criteria/dry_run",
+        json={"last_updated_threshold_days": 400},
+    )
+
+    assert response.status_code == 200
+    assert response.json["criteria"]["last_updated_threshold_days"] == 400
+    assert response.json["criteria"]["minimum_description_length"] == 50
+    assert response.json["by_criterion"]["is_recent"] == 3
+    assert response.json["passing"] == 1
+    # The stored criteria are left untouched
+    assert get_filter_criteria() == DEFAULT_FILTER_CRITERIA
+
+    response = client.post(
+        "/api/filter_criteria/dry_run", json={"minimum_stars": 1}
+    )
+    assert response.status_code == 400
+
+    for body in ([1], "x", 3):
+        response = client.post("/api/filter_criteria/dry_run", json=body)
+        assert response.status_code == 400
+        assert "error" in response.json
+        response = client.put("/api/filter_criteria", json=body)
+        assert response.status_code == 400
@@ -0,0 +1,161 @@
+import pytest
+import time
+from requests import Response
+from requests.adapters import BaseAdapter
+from collector.http_client import (
+    AdaptiveBatchSize,
+    CollectorSession,
+    RateLimiter,
+    backoff_delay,
+    get_retry_after,
+)
+
+
+class FakeAdapter(BaseAdapter):
+    """Answers every request with the next canned response."""
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append((request, kwargs))
+        status_code, headers, body = self.responses.pop(0)
+        response = Response()
+        response.status_code = status_code
+        response.headers.update(headers)
+        response._content = body
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def session():
+    return CollectorSession(pool_size=2, timeout=(1, 2))
+
+
+def test_request_uses_default_timeout(session):
+    adapter = FakeAdapter([(200, {}, b"{}")])
+    session.mount("http://store/", adapter)
+
+    session.get("http://store/page")
+
+    request, kwargs = adapter.requests[0]
+    assert kwargs["timeout"] == (1, 2)
+    assert "gzip" in request.headers["Accept-Encoding"]
+
+
+def test_get_conditional_revalidates(session):
+    adapter = FakeAdapter(
+        [
+            (200, {"ETag": '"v1"', "Last-Modified": "yesterday"}, b"{}"),
+            (304, {}, b""),
+        ]
+    )
+    session.mount("http://store/", adapter)
+
+    assert session.get_conditional("http://store/page").status_code == 200
+    assert session.get_conditional("http://store/page").status_code == 304
+
+    first, second = (request for request, _ in adapter.requests)
+    assert "If-None-Match" not in first.headers
+    assert second.headers["If-None-Match"] == '"v1"'
+    assert second.headers["If-Modified-Since"] == "yesterday"
+    assert session.stats == {"requests": 2, "bytes": 2, "not_modified": 1}
+
+
+def test_forget_drops_validators(session):
+    adapter = FakeAdapter([(200, {"ETag": '"v1"'}, b""), (200, {}, b"")])
+    session.mount("http://store/", adapter)
+
+    session.get_conditional("http://store/page")
+    session.forget("http://store/page")
+    session.get_conditional("http://store/page")
+
+    assert "If-None-Match" not in adapter.requests[1][0].headers
+
+
+def test_forget_drops_every_validator(session):
+    adapter = FakeAdapter(
+        [(200, {"ETag": '"v1"'}, b""), (200, {"ETag": '"v2"'}, b"")]
+        + [(200, {}, b"")] * 2
+    )
+    session.mount("http://store/", adapter)
+
+    session.get_conditional("http://store/page1")
+    session.get_conditional("http://store/page2")
+    session.forget()
+    session.get_conditional("http://store/page1")
+    session.get_conditional("http://store/page2")
+
+    for request, _ in adapter.requests[2:]:
+        assert "If-None-Match" not in request.headers
+
+
+def test_reset_stats(session):
+    session.mount("http://store/", FakeAdapter([(200, {}, b"abc")]))
+    session.get("http://store/page")
+
+    session.reset_stats()
+
+    assert session.stats == {"requests": 0, "bytes": 0, "not_modified": 0}
+
+
+def test_adaptive_batch_size():
+    batch_size = AdaptiveBatchSize(10, minimum=2, maximum=12, target_latency=1)
+
+    batch_size.record_success(10, latency=0.5)
+    batch_size.record_success(11, latency=0.5)
+    batch_size.record_success(12, latency=0.5)
+    assert batch_size.size == 12
+
+    # A batch submitted before the size grew doesn't grow it again
+    batch_size.record_success(11, latency=0.5)
+    assert batch_size.size == 12
+
+    batch_size.record_success(12, latency=2)
+    assert batch_size.size == 9
+
+    # Concurrent failures of same-sized batches only halve the size once
+    batch_size.record_failure(9)
+    batch_size.record_failure(9)
+    assert batch_size.size == 4
+    batch_size.record_failure(4)
+    assert batch_size.size == 2
+    assert batch_size.failures == 3
+
+
+def make_response(headers):
+    response = Response()
+    response.headers.update(headers)
+    return response
+
+
+def test_get_retry_after():
+    assert get_retry_after(None) is None
+    assert get_retry_after(make_response({})) is None
+    assert get_retry_after(make_response({"Retry-After": "3"})) == 3
+    assert get_retry_after(make_response({"Retry-After": "soon"})) is None
+    past = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert get_retry_after(make_response({"Retry-After": past})) == 0
+
+
+def test_backoff_delay():
+    assert 0.25 <= backoff_delay(0) <= 0.5
+    assert 2 <= backoff_delay(3) <= 4
+    assert backoff_delay(20) <= 30
+
+
+def test_rate_limiter_pause():
+    limiter = RateLimiter()
+
+    limiter.pause(0.05)
+    start = time.monotonic()
+    limiter.wait()
+
+    assert time.monotonic() - start >= 0.04
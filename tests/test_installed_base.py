@@ -0,0 +1,99 @@
+import datetime
+from unittest.mock import MagicMock, patch
+import pytest
+from collector.installed_base import (
+    get_metrics_start_dates,
+    installed_base_rows,
+    store_installed_base,
+)
+from collector.extra_fields import calculate_active_devices_rows
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+
+@pytest.fixture
+def mock_session():
+    return MagicMock(spec=Session)
+
+
+@pytest.fixture
+def metrics_data():
+    return {
+        "metrics": [
+            {
+                "buckets": ["2026-10-15", "2026-10-16", "2026-10-17"],
+                "series": [
+                    {"name": "1.0", "values": [10, 8, None]},
+                    {"name": "1.1", "values": [5, None, None]},
+                ],
+            },
+            {
+                "buckets": ["2026-10-16", "2026-10-17"],
+                "series": [{"name": "2.0", "values": [0, 3]}],
+            },
+        ]
+    }
+
+
+def test_installed_base_rows(metrics_data):
+    rows = installed_base_rows(["snap1", "snap2"], metrics_data)
+
+    assert rows == [
+        {"snap_id": "snap1", "day": datetime.date(2026, 10, 15), "installed_base": 15},
+        {"snap_id": "snap1", "day": datetime.date(2026, 10, 16), "installed_base": 8},
+        {"snap_id": "snap2", "day": datetime.date(2026, 10, 16), "installed_base": 0},
+        {"snap_id": "snap2", "day": datetime.date(2026, 10, 17), "installed_base": 3},
+    ]
+
+
+def test_active_devices_ignore_history(metrics_data):
+    rows = calculate_active_devices_rows(
+        ["snap1", "snap2"], metrics_data, start_date="2026-10-16"
+    )
+
+    # History before the window is stored, not used for active devices
+    assert rows == [
+        {"snap_id": "snap1", "active_devices": 8},
+        {"snap_id": "snap2", "active_devices": 3},
+    ]
+
+
+@patch("collector.installed_base.INSTALLED_BASE_HISTORY_DAYS", 30)
+def test_get_metrics_start_dates(mock_session):
+    mock_session.execute.return_value.all.return_value = [
+        ("up-to-date", datetime.date(2026, 10, 17)),
+        ("behind", datetime.date(2026, 10, 10)),
+        ("too-far-behind", datetime.date(2026, 1, 1)),
+    ]
+
+    start_dates = get_metrics_start_dates(
+        mock_session,
+        ["up-to-date", "behind", "too-far-behind", "new"],
+        "2026-10-16",
+        "2026-10-17",
+    )
+
+    assert start_dates == {
+        "up-to-date": "2026-10-16",
+        "behind": "2026-10-11",
+        "too-far-behind": "2026-09-18",
+        "new": "2026-09-18",
+    }
+
+
+def test_store_installed_base(mock_session):
+    mock_session.execute.return_value.rowcount = 1
+    rows = [
+        {"snap_id": "snap1", "day": datetime.date(2026, 10, 16), "installed_base": 8}
+    ]
+
+    assert store_installed_base(mock_session, rows) == 1
+    assert store_installed_base(mock_session, []) == 0
+
+    sql = str(
+        mock_session.execute.call_args.args[0].compile(
+            dialect=postgresql.dialect()
+        )
+    )
+    assert "ON CONFLICT (snap_id, day) DO UPDATE" in sql
+    assert "IS DISTINCT FROM excluded.installed_base" in sql
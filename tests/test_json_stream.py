@@ -0,0 +1,57 @@
+import json
+import pytest
+from collector.json_stream import iter_array_items
+
+
+DOCUMENT = {
+    "_embedded": {
+        "clickindex:package": [
+            {"snap_id": "a", "description": "[{\"nested\": \"]\"}]"},
+            {"snap_id": "b", "media": [{"type": "icon"}], "revision": 12},
+            {"snap_id": "c", "title": "Snap é☃"},
+        ]
+    },
+    "_links": {"next": {"href": "/page=2"}},
+}
+
+
+def split(text, size):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 7, 10000])
+def test_iter_array_items(size):
+    document = {}
+    text = json.dumps(DOCUMENT, indent=1)
+
+    items = list(
+        iter_array_items(split(text, size), "clickindex:package", document)
+    )
+
+    assert items == DOCUMENT["_embedded"]["clickindex:package"]
+    assert document == {
+        "_embedded": {"clickindex:package": []},
+        "_links": {"next": {"href": "/page=2"}},
+    }
+
+
+def test_iter_array_items_empty_array():
+    document = {}
+    text = json.dumps({"_embedded": {"clickindex:package": []}, "_links": {}})
+
+    assert list(iter_array_items(split(text, 3), "clickindex:package", document)) == []
+    assert document["_links"] == {}
+
+
+def test_iter_array_items_truncated():
+    text = json.dumps(DOCUMENT)[:-40]
+
+    items = iter_array_items(split(text, 5), "clickindex:package", {})
+
+    with pytest.raises(json.JSONDecodeError):
+        list(items)
+
+
+def test_iter_array_items_missing_key():
+    with pytest.raises(ValueError):
+        list(iter_array_items(['{"_links": {}}'], "clickindex:package", {}))
@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from collector.ratings.collect_ratings import RatingsClient, fetch_ratings
+from scripts.ratings_standin import RatingsStandIn
+from scripts.store_api_standin import SNAP_ID_PREFIX
+
+SNAP_IDS = [f"{SNAP_ID_PREFIX}{index:08d}" for index in range(200)]
+
+
+@pytest.fixture
+def standin():
+    standin = RatingsStandIn(snaps=150, chart_size=5)
+    standin.start()
+    yield standin
+    standin.stop()
+
+
+def collect(standin, method, *args):
+    async def run():
+        async with RatingsClient(standin.address, insecure=True) as client:
+            return await getattr(client, method)(*args)
+
+    return asyncio.run(run())
+
+
+def test_standin_bulk_ratings(standin):
+    ratings = collect(standin, "get_all_ratings", SNAP_IDS, 20, 4)
+
+    expected = {
+        snap_id for snap_id in SNAP_IDS if standin.rating(snap_id)
+    }
+    assert set(ratings) == expected
+    assert 0 < len(expected) < 150
+    assert standin.calls == {"Authenticate": 1, "GetBulkRatings": 10}
+
+
+def test_standin_renews_tokens(standin):
+    standin.token_max_uses = 3
+
+    ratings = collect(standin, "get_all_ratings", SNAP_IDS, 20, 1)
+
+    assert len(ratings) == len(
+        [snap_id for snap_id in SNAP_IDS if standin.rating(snap_id)]
+    )
+    # Every fourth call is rejected, renewed and retried
+    assert standin.calls["GetBulkRatings"] == 13
+    assert standin.calls["Authenticate"] == 4
+
+
+def test_standin_chart_ratings(standin):
+    ratings, charts, failed = collect(
+        standin, "get_chart_ratings", SNAP_IDS, 20, 8
+    )
+
+    assert standin.calls["GetChart"] == 40
+    assert failed == set()
+    assert 0 < len(charts["weekly"]) <= len(charts["monthly"]) <= 100
+    for snap_id, rating in charts["monthly"].items():
+        assert ratings[snap_id] == rating
+    # Snaps missing from the charts are still rated by id
+    assert set(ratings) == {
+        snap_id for snap_id in SNAP_IDS if standin.rating(snap_id)
+    }
+
+
+def test_standin_injects_errors(standin):
+    ratings = collect(standin, "get_all_ratings", SNAP_IDS, 20, 4)
+    standin.error_rate = 0.5
+
+    flaky_ratings = collect(standin, "get_all_ratings", SNAP_IDS, 20, 4)
+
+    # Failed batches are left out
+    assert set(flaky_ratings) < set(ratings)
+
+
+def test_fetch_ratings_insecure(standin):
+    with patch(
+        "collector.ratings.collect_ratings.RATINGS_ADDRESS", standin.address
+    ), patch("collector.ratings.collect_ratings.RATINGS_INSECURE", True):
+        ratings = fetch_ratings(SNAP_IDS[:10], 5)
+
+    assert set(ratings) == {
+        snap_id for snap_id in SNAP_IDS[:10] if standin.rating(snap_id)
+    }
@@ -0,0 +1,145 @@
+import pytest
+from unittest.mock import patch
+from collector.collect import (
+    FIELDS,
+    get_snap_page,
+    insert_snaps,
+    iter_snap_page_chunks,
+    iter_snap_pages,
+    parse_snap_from_response,
+)
+from collector.extra_fields import (
+    calculate_latest_active_devices,
+    fetch_metrics_from_api,
+    iter_metrics_batches,
+)
+from collector.http_client import RateLimiter
+from scripts.store_api_standin import StoreAPIStandIn, SEARCH_PATH, METRICS_PATH
+
+
+@pytest.fixture
+def standin():
+    standin = StoreAPIStandIn(snaps=250, page_size=100, series=3)
+    standin.start()
+    search_url = f"{standin.url}{SEARCH_PATH}?fields={','.join(FIELDS)}"
+    with patch("collector.collect.URL", search_url), patch(
+        "collector.extra_fields.METRICS_URL", f"{standin.url}{METRICS_PATH}"
+    ):
+        yield standin
+    standin.stop()
+
+
+def test_crawl_standin(standin):
+    pages = list(iter_snap_pages(workers=4))
+
+    assert [page for page, _ in pages] == [1, 2, 3]
+    snaps = [snap for _, page_snaps in pages for snap in page_snaps]
+    assert len(snaps) == 250
+    assert len({snap["snap_id"] for snap in snaps}) == 250
+    # Every synthetic snap can be parsed by the collector, with the scalar
+    # columns the database expects
+    for snap in snaps:
+        assert isinstance(parse_snap_from_response(snap)["publisher"], str)
+
+
+def test_crawl_standin_streaming(standin):
+    chunks = list(iter_snap_page_chunks(chunk_size=30, conditional=False))
+
+    assert [(page, len(snaps)) for page, snaps in chunks] == [
+        (1, 30), (1, 30), (1, 30), (1, 10),
+        (2, 30), (2, 30), (2, 30), (2, 10),
+        (3, 30), (3, 20),
+    ]
+    snaps = [snap for _, chunk in chunks for snap in chunk]
+    assert snaps == [
+        snap
+        for _, page in iter_snap_pages(conditional=False)
+        for snap in page
+    ]
+
+    # Unchanged pages are revalidated as a whole
+    assert list(iter_snap_page_chunks(chunk_size=30)) == [
+        (1, None), (2, None), (3, None)
+    ]
+
+
+@patch("collector.collect.db")
+@patch("collector.collect.set_setting")
+@patch("collector.collect.get_setting", return_value=None)
+@patch("collector.collect.sweep_delisted_snaps")
+@patch("collector.collect.upsert_snap_rows")
+def test_insert_snaps_rewrites_pages_after_failure(
+    mock_upsert_snap_rows, mock_sweep, mock_get_setting, mock_set_setting,
+    mock_db, standin,
+):
+    written = []
+
+    def upsert_snap_rows(session, rows):
+        # Fails the first run's write of page 2
+        if mock_upsert_snap_rows.call_count == 2:
+            raise RuntimeError("write failed")
+        written.extend(row["snap_id"] for row in rows)
+        return {"inserted": len(rows), "changed": 0, "unchanged": 0}
+
+    mock_upsert_snap_rows.side_effect = upsert_snap_rows
+
+    # Pages 2 and 3 are fetched ahead of the failed write of page 2
+    with pytest.raises(RuntimeError):
+        insert_snaps(workers=4, pipeline_depth=2)
+    assert len(written) == 100
+
+    insert_snaps(workers=4, pipeline_depth=2)
+
+    # Pages fetched but never written are not skipped as not modified
+    assert len(set(written)) == 250
+
+
+def test_standin_revalidates_pages(standin):
+    snaps, has_next = get_snap_page(2)
+    assert len(snaps) == 100 and has_next
+
+    assert get_snap_page(2) == (None, True)
+
+
+def test_standin_metrics(standin):
+    snap_ids = ["standin-00000001", "standin-00000002"]
+
+    metrics = fetch_metrics_from_api(snap_ids, "2026-10-01", "2026-10-02")
+
+    assert [m["snap_id"] for m in metrics["metrics"]] == [
+        "standin-00000001",
+        "standin-00000002",
+    ]
+    for snap_metrics in metrics["metrics"]:
+        assert len(snap_metrics["series"]) == 3
+        assert calculate_latest_active_devices(snap_metrics) >= 0
+
+
+def test_standin_injects_errors():
+    standin = StoreAPIStandIn(snaps=10, error_rate=1.0)
+    standin.start()
+    try:
+        with patch(
+            "collector.collect.URL", f"{standin.url}{SEARCH_PATH}?scope=wide"
+        ):
+            with pytest.raises(Exception):
+                get_snap_page(1)
+    finally:
+        standin.stop()
+
+
+def test_standin_rate_limits_metrics(standin):
+    standin.rate_limit = 2
+    snap_ids = [f"snap{i}" for i in range(40)]
+
+    with patch("collector.extra_fields.METRICS_BATCH_SIZE", 5), patch(
+        "collector.extra_fields.METRICS_RATE_LIMITER", RateLimiter()
+    ):
+        batches = list(
+            iter_metrics_batches(snap_ids, "2025-01-01", "2025-01-02", 4)
+        )
+
+    assert standin.rate_limited > 0
+    assert [snap_id for batch, _ in batches for snap_id in batch] == snap_ids
+    for batch, metrics_data in batches:
+        assert [m["snap_id"] for m in metrics_data["metrics"]] == batch